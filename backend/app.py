@@ -1,65 +1,165 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from gradio_client import Client, handle_file
 import os
 import re  # >>> INTENT detection
-import tempfile
-import shutil
-from werkzeug.utils import secure_filename
-from io import BytesIO
+from werkzeug.exceptions import RequestEntityTooLarge
 from dotenv import load_dotenv
-from elevenlabs import ElevenLabs
-from dedalus_labs import AsyncDedalus, DedalusRunner
-import asyncio
 from uuid import uuid4
-from fin import get_cad
-from testing import iterate_cad
+import providers
+import resilience
+import cancellation
+from metrics import metrics, span
+from profiling import profiler
+import profiling
+from persistence import WriteBehindQueue
+from jobs import JobRegistry, coalesce_key
+from idempotency import IdempotencyStore, idempotent
+from ratelimit import RateLimiter, rate_limited
+from sessions import SessionStore
+from stt_stream import StreamRegistry
+import audio_prep
+import compression
+import summaries
+import cad_engines
+import uploads
+import artifacts
+import pregen
+from status_phrases import PhraseBank
+from prompts import strip_markdown_fences
+from concurrent.futures import ThreadPoolExecutor
+import atexit
+import threading
+import base64
+import json
+import hmac
+import time
+from datetime import datetime, timezone
 
 load_dotenv()
-currentText = ""
-generation_jobs = {}
+sessions = SessionStore()  # per-session transcript / active model / recent turns
+jobs = JobRegistry()
+# generation jobs still running after this are cancelled (must exceed the "cad" guard timeout)
+GENERATION_DEADLINE_S = float(os.getenv("GENERATION_DEADLINE_S", "600"))
+generation_jobs = jobs.jobs  # job_id -> state, polled via /api/generation/job/<id>
+idempotency = IdempotencyStore()
+rate_limits = RateLimiter()  # per-user token buckets per endpoint class, see ratelimit.py
+stt_streams = StreamRegistry()
+summary_cache = summaries.SummaryCache()  # parsed SCAD by hash, summaries + audio by summary_key
+status_bank = PhraseBank()  # status sentences stitched from pre-synthesized clips
+cad_router = cad_engines.default_router()  # scad / kittycad / hunyuan, see cad_engines.py
+popularity = pregen.PopularityTracker()  # new-model prompts, for idle-time pre-generation
+warm_models = pregen.WarmCache()  # pre-built SCAD + STL + summary for popular prompts
+stt_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="stt-spec")
 
 # ----------------------------- Supabase ---------------------------------
-from supabase import create_client
-
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY")
-supabase = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
-print("[INFO] Supabase client initialized")
-
-# --------------------------- External clients ---------------------------
-elevenlabs_api_key = os.getenv("ELEVENLABS_API_KEY")
-if not elevenlabs_api_key:
-    print("[WARN] ELEVENLABS_API_KEY not set. /api/transcribe will return 501 until provided.")
-    elevenlabs = None
-else:
-    elevenlabs = ElevenLabs(api_key=elevenlabs_api_key)
+# Upstream clients (Supabase, ElevenLabs, Dedalus, CAD, Hunyuan) come from providers.py
 
-dedalus_api_key = os.getenv("DEDALUS_API_KEY")
-if not dedalus_api_key:
-    print("[WARN] DEDALUS_API_KEY not set. /api/getresponse will fall back.")
-    dedalus = None
-else:
-    dedalus = AsyncDedalus(api_key=dedalus_api_key)
+# Model rows are written behind the response; see persistence.py
+model_writes = WriteBehindQueue(providers.db, table="models")
+atexit.register(model_writes.stop)
 
 # ------------------------------- Flask ----------------------------------
 app = Flask(__name__)
+# uploads are spooled to disk past a small buffer and hashed as they arrive (uploads.py)
+app.request_class = uploads.UploadRequest
+app.config["MAX_CONTENT_LENGTH"] = uploads.MAX_UPLOAD_BYTES
 
 # CORS
 cors_origins = os.getenv("CORS_ORIGINS", "http://localhost:5173,http://localhost:5174,http://localhost:3000").split(",")
 if os.getenv("FLASK_ENV") == "production" or os.getenv("DYNO"):
-    CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True)
+    CORS(app, resources={r"/api/*": {"origins": "*"}}, supports_credentials=True,
+         expose_headers=["X-Stage-Timings", "X-Request-Id", "Retry-After",
+                         "X-RateLimit-Limit", "X-RateLimit-Remaining"])
 else:
-    CORS(app, origins=cors_origins, supports_credentials=True)
+    CORS(app, origins=cors_origins, supports_credentials=True,
+         expose_headers=["X-Stage-Timings", "X-Request-Id", "Retry-After",
+                         "X-RateLimit-Limit", "X-RateLimit-Remaining"])
+
+# ------------------------------ Metrics ---------------------------------
+# Stage spans (metrics.py) are exported at /metrics; clients that send
+# `X-Stage-Timings: 1` (or ?timings=1) get this request's spans back in the
+# X-Stage-Timings response header. Requests can also be stack-sampled (see
+# profiling.py); profiles are stored under the X-Request-Id returned here.
+@app.before_request
+def _start_request_metrics():
+    request.environ["vibecad.started"] = time.perf_counter()
+    rid = request.headers.get("X-Request-Id") or ""
+    request.environ["vibecad.request_id"] = rid if re.fullmatch(r"[\w.-]{1,64}", rid) else uuid4().hex
+    metrics.request_started()
+    if profiler.should_profile(request.headers.get("X-Profile")):
+        profiler.start(request.environ["vibecad.request_id"], f"{request.method} {request.path}")
+
+# per-route upload caps, applied before any view decorator can parse the body (uploads.py)
+app.before_request(uploads.enforce_limit)
+
+@app.after_request
+def _finish_request_metrics(resp):
+    started = request.environ.get("vibecad.started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.request_finished(request.method, endpoint, resp.status_code, time.perf_counter() - started)
+    timings = metrics.request_timings()
+    if _flag(request.headers.get("X-Stage-Timings") or request.args.get("timings")):
+        resp.headers["X-Stage-Timings"] = metrics.format_timings(timings)
+    if profiler.finish(status=resp.status_code, stage_timings=metrics.format_timings(timings)):
+        resp.headers["X-Profiled"] = "true"
+    resp.headers["X-Request-Id"] = request.environ.get("vibecad.request_id", "")
+    return resp
+
+@app.teardown_request
+def _finish_request_profile(exc=None):
+    profiler.finish()  # no-op unless after_request was skipped by an unhandled error
+
+# Registered after the metrics hook so it runs first and its time counts toward the request
+@app.after_request
+def _compress_response(resp):
+    return compression.compress_response(resp, request.headers.get("Accept-Encoding", ""))
+
+@app.errorhandler(resilience.ProviderUnavailable)
+def _provider_unavailable(e):
+    """Degraded upstream: fail fast with 503 instead of holding the worker."""
+    print("[RESILIENCE] request failed fast:", e)
+    headers = {"Retry-After": str(max(1, int(e.retry_after)))} if e.retry_after else {}
+    return jsonify({"error": str(e), "provider": e.provider, "retryable": True}), 503, headers
+
+@app.errorhandler(RequestEntityTooLarge)
+def _upload_too_large(e):
+    return uploads.too_large()
+
+@app.errorhandler(cancellation.Cancelled)
+def _generation_cancelled(e):
+    """A synchronous request whose generation job was cancelled or hit its deadline."""
+    reason = str(e) or "cancelled"
+    status = 504 if reason == "deadline exceeded" else 409
+    return jsonify({"error": f"generation {reason}", "cancelled": True}), status
+
+def _require_admin():
+    """None if the request carries ADMIN_TOKEN, else an error response."""
+    if not profiling.ADMIN_TOKEN:
+        return jsonify({"error": "admin endpoints are disabled (ADMIN_TOKEN not set)"}), 404
+    auth = request.headers.get("Authorization", "")
+    token = auth[7:] if auth.startswith("Bearer ") else request.headers.get("X-Admin-Token", "")
+    if not hmac.compare_digest(token.encode("utf-8"), profiling.ADMIN_TOKEN.encode("utf-8")):
+        return jsonify({"error": "unauthorized"}), 401
+    return None
 
 # ------------------------------ Helpers ---------------------------------
-UPLOAD_FOLDER = "uploads"
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 def allowed_file(filename: str) -> bool:
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _extension(filename: str) -> str:
+    return filename.rsplit(".", 1)[1].lower()
+
+def _request_value(name: str):
+    body = request.get_json(silent=True) if request.is_json else None
+    return request.args.get(name) or request.form.get(name) or (body or {}).get(name)
+
+def _session_id() -> str | None:
+    """Conversation state is keyed by X-Session-Id / session_id, falling back to the userid."""
+    return request.headers.get("X-Session-Id") or _request_value("session_id") or _request_value("userid")
+
 def _audio_to_bytes(obj) -> bytes:
     if obj is None:
         return b""
@@ -82,153 +182,428 @@ def _audio_to_bytes(obj) -> bytes:
         return b"".join(parts)
     raise TypeError(f"Unsupported audio object type: {type(obj)}")
 
-def _strip_markdown_fences(code: str) -> str:
-    """
-    Remove markdown code fences from SCAD code.
-    Handles various formats:
-    - ```openscad ... ```
-    - ```scad ... ```
-    - ```plaintext ... ```
-    - ``` ... ```
-    - With or without whitespace
-    """
-    code = code.strip()
-    
-    # Split into lines for robust fence detection
-    lines = code.split('\n')
-    
-    # Remove opening fence: Check first line for any fence format
-    if lines and lines[0].strip().startswith('```'):
-        fence_type = lines[0].strip()
-        lines = lines[1:]
-        print(f"[_strip_markdown_fences] Stripped opening fence: {fence_type}")
-    
-    # Remove closing fence: Check last line
-    if lines and lines[-1].strip() == '```':
-        lines = lines[:-1]
-        print(f"[_strip_markdown_fences] Stripped closing fence")
-    
-    result = '\n'.join(lines).strip()
-    return result
+def _db_execute(query):
+    """Run a Supabase query under the supabase timeout/breaker (resilience.py)."""
+    return resilience.guard("supabase").call(query.execute)
+
+def _now_iso() -> str:
+    # models.created_at is timestamptz; epoch floats are rejected by PostgREST
+    return datetime.now(timezone.utc).isoformat()
+
+# ----------------------------- Model listing -----------------------------
+# Carousel rows only need metadata; SCAD and mesh bodies are fetched per model.
+MODEL_META_FIELDS = ("id", "name", "created_at", "glb_file_url", "stl_file_url")
+MODEL_BODY_FIELDS = ("scad_code", "glb_file_url", "stl_file_url")
+MODEL_FIELDS = {"id", "user_id", "name", "created_at", "scad_code", "glb_file_url", "stl_file_url"}
+MODEL_PAGE_DEFAULT = 24
+MODEL_PAGE_MAX = 100
+
+def _parse_fields(raw: str | None, default) -> list[str]:
+    if not raw:
+        return list(default)
+    fields = [f.strip() for f in raw.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in MODEL_FIELDS]
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(unknown)}")
+    return fields
+
+def _encode_cursor(row: dict) -> str:
+    raw = json.dumps([row["created_at"], row["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def _decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        created_at, mid = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(created_at), str(mid)
+    except Exception:
+        raise ValueError("invalid cursor")
+
+def _list_models(userid: str, fields: list[str], limit: int, cursor: str | None = None):
+    """Keyset page of a user's models, newest first. Backed by idx_models_user_created_at."""
+    # The keyset columns are always selected so the next cursor can be built.
+    cols = list(dict.fromkeys(["id", "created_at", *fields]))
+    q = (
+        providers.db().table("models")
+        .select(",".join(cols))
+        .eq("user_id", userid)
+        .order("created_at", desc=True)
+        .order("id", desc=True)
+        .limit(limit + 1)
+    )
+    if cursor:
+        created_at, mid = _decode_cursor(cursor)
+        q = q.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt."{mid}")')
+    rows = _db_execute(q).data or []
+    if not cursor:
+        # models still in the write-behind queue (just generated) lead the first page
+        stored = {r["id"] for r in rows}
+        queued = [q for q in model_writes.pending_inserts(userid) if q["id"] not in stored]
+        rows = sorted(rows + queued, key=lambda r: (str(r.get("created_at") or ""), r["id"]), reverse=True)
+    for r in rows:
+        update = model_writes.pending(r["id"])
+        if update and update.get("user_id") == userid:
+            r.update(update)
+
+    next_cursor = _encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    rows = rows[:limit]
+    return [{k: r.get(k) for k in fields} for r in rows], next_cursor
+
+def _render_scad(scad_code: str, quality: str = "full") -> dict:
+    """Render through the Node converter: {"ok", "url", ...} or {"ok": False, "error"}."""
+    with span("scad_render"):
+        return resilience.guard("converter").call(providers.converter().render, scad_code, quality)
+
+# >>> PREGEN: popular prompts are pre-built while idle (pregen.py)
+def _warm_model(norm: str) -> dict | None:
+    """Pre-built result for a popular prompt, if its STL is still stored."""
+    entry = warm_models.get(norm) if norm else None
+    if entry is not None and not artifacts.generated.touch(artifacts.generated.rel_from_url(entry["stl_file_url"]) or ""):
+        warm_models.drop(norm)  # evicted from the artifact store; rebuilt on the next idle pass
+        entry = None
+    metrics.cache_result("pregen", entry is not None)
+    if entry is not None:
+        # the summary request that follows the render finds it (audio included); it was
+        # built without the prompt, like the client's request, so no wording is shared
+        key, _, _ = _summary_facts(entry["scad_code"], "", False, entry.get("mesh_stats"))
+        summary_cache.put(key, dict(entry["summary"]))
+    return entry
+
+def _pregenerate_model(prompt: str) -> dict:
+    """Warm entry for a popular prompt: SCAD, a full render (which validates it) and the
+    spoken summary with audio."""
+    _, result = cad_router.run("text", {"prompt": prompt}, preferred="scad")
+    scad_code = strip_markdown_fences(result.get("scad_code") or "")
+    rendered = _render_scad(scad_code)
+    if not rendered["ok"]:
+        raise ValueError(f"SCAD does not compile: {rendered['error']}")
+    mesh = summaries.stl_stats_for_url(rendered["url"])
+    summary, _ = _model_summary(scad_code, "", mesh=mesh)
+    return {"prompt": prompt, "scad_code": scad_code, "stl_file_url": rendered["url"],
+            "mesh_stats": mesh, "summary": dict(summary)}
 
 # CAD generation (new model)
-def _generate_cad_model(prompt: str, userid: str | None = None, modelid: str | None = None):
+def _generate_cad_model(prompt: str, userid: str | None = None, modelid: str | None = None,
+                        variant: str | None = None, name: str | None = None, engine: str | None = None):
+    """Run a text-to-CAD engine (cad_engines.py; variants need SCAD). Returns (model id,
+    job fields): scad_code, or stl_file_url for mesh engines, plus the engine used.
+    New models get a server-generated id; `modelid` is only for rewriting a model this
+    user already owns (render repairs) and is never taken from the request."""
     if not prompt:
-        return None, None
+        return None, {"scad_code": None}
     mid = modelid or str(uuid4())
-    try:
-        asyncio.run(get_cad(prompt))
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        try:
-            loop.run_until_complete(get_cad(prompt))
-        finally:
-            loop.close()
+    preferred = "scad" if variant else engine or cad_engines.CAD_ENGINE
+    warm = None
+    if not variant:
+        norm = popularity.record(prompt)
+        warm = _warm_model(norm) if preferred == "scad" else None
+    if warm is not None:
+        used, result = "scad", {"scad_code": warm["scad_code"]}
+    else:
+        used, result = cad_router.run("text", {"prompt": prompt, "variant": variant}, preferred=preferred)
 
-    scad_code = None
-    if os.path.exists("output.scad"):
-        with open("output.scad", "r", encoding="utf-8") as f:
-            raw = f.read()
+    fields = {"engine": used, "scad_code": None}
+    if warm is not None:
+        fields.update(scad_code=warm["scad_code"], stl_file_url=warm["stl_file_url"], warm=True)
+    elif result.get("scad_code") is not None:
         # Robust markdown fence removal
-        scad_code = _strip_markdown_fences(raw)
+        with span("fence_strip"):
+            fields["scad_code"] = strip_markdown_fences(result["scad_code"])
+    elif result.get("mesh_url"):
+        fields["stl_file_url"] = result["mesh_url"]
 
-    if userid and scad_code:
+    saved = {k: fields[k] for k in ("scad_code", "stl_file_url") if fields.get(k)}
+    if userid and saved:
         try:
-            import time as _time
-            supabase.table("models").insert({
-                "id": mid,
-                "user_id": userid,
-                "name": prompt,
-                "created_at": _time.time(),
-                "scad_code": scad_code
-            }).execute()
+            if modelid:
+                model_writes.put({"id": mid, "user_id": userid, "name": name or prompt, **saved})
+            else:
+                model_writes.put({
+                    "id": mid,
+                    "user_id": userid,
+                    "name": name or prompt,
+                    "created_at": _now_iso(),
+                    **saved,
+                }, insert=True)
         except Exception as db_e:
             print("[WARN] Supabase insert failed:", db_e)
-    return mid, scad_code
+    return mid, fields
 
 # >>> ITERATION: iterate existing model
-def _iterate_cad_model(prompt: str, userid: str, modelid: str):
+def _iterate_cad_model(prompt: str, userid: str, modelid: str, name: str | None = None):
     """Fetch existing scad_code by (userid, modelid), iterate with iterate_cad(prompt, old),
-    write outputIterated.scad, update Supabase, return updated scad_code."""
+    update Supabase, return updated scad_code."""
     if not (prompt and userid and modelid):
         raise ValueError("iterate requires prompt, userid, and modelid")
-    # fetch current model
-    res = supabase.table("models").select("*").eq("id", modelid).eq("user_id", userid).single().execute()
-    if not res.data:
+    # fetch current model (a write still queued for this model is newer than the DB row)
+    queued = model_writes.pending(modelid)
+    if queued and queued.get("user_id") != userid:
+        # someone else's model: refuse before the LLM call (the queue would reject the write)
         raise RuntimeError("model not found")
-    old_scad = res.data["scad_code"]
+    hit = bool(queued and queued.get("scad_code"))
+    metrics.cache_result("pending_row", hit)
+    if hit:
+        old_scad = queued["scad_code"]
+    else:
+        with span("db_read"):
+            res = _db_execute(providers.db().table("models").select("*").eq("id", modelid).eq("user_id", userid).single())
+        if not res.data:
+            raise RuntimeError("model not found")
+        old_scad = res.data["scad_code"]
 
     # run iterate
-    try:
-        asyncio.run(iterate_cad(prompt, old_scad))
-    except RuntimeError:
-        loop = asyncio.new_event_loop()
-        try:
-            loop.run_until_complete(iterate_cad(prompt, old_scad))
-        finally:
-            loop.close()
-
-    # read output
-    if not os.path.exists("outputIterated.scad"):
-        raise RuntimeError("outputIterated.scad not produced by iterate_cad")
-    with open("outputIterated.scad", "r", encoding="utf-8") as f:
-        raw = f.read()
-    scad_code = _strip_markdown_fences(raw)
-
-    # update DB
-    supabase.table("models").update({"scad_code": scad_code, "name": prompt}).eq("id", modelid).eq("user_id", userid).execute()
+    raw = resilience.guard("cad").call(providers.cad().iterate, prompt, old_scad)
+    if raw is None:
+        raise RuntimeError("iterate_cad produced no SCAD")
+    with span("fence_strip"):
+        scad_code = strip_markdown_fences(raw)
+
+    # update DB (scoped to the owner, see persistence.py)
+    model_writes.put({"id": modelid, "user_id": userid, "scad_code": scad_code, "name": name or prompt})
     return scad_code
 
-# Status sentence + TTS
-def _status_update(text: str):
-    status_text = "Preparing your CAD model; generating now."
+# >>> PIPELINE: jobs render their own SCAD (generate -> render -> mesh stats), so the client
+# gets an STL URL with the result instead of making its own /convert-scad round trip
+GENERATION_RENDER = os.getenv("GENERATION_RENDER", "1").lower() not in ("0", "false", "no")
+RENDER_REPAIRS = int(os.getenv("GENERATION_RENDER_REPAIRS", "1"))  # regenerations after a compile error
+
+def _repair_note(scad_code: str, error: str) -> str:
+    return ("The previous attempt at this model did not compile in OpenSCAD "
+            f"({error}). Fix it and return code that compiles:\n{scad_code}")
+
+def _render_stage(scad_code: str, regenerate, userid: str | None, mid: str | None) -> dict:
+    """Render a job's SCAD as soon as it is generated. A compile error asks `regenerate(note)`
+    for corrected SCAD, up to RENDER_REPAIRS times. Returns job fields: scad_code (the version
+    that rendered), stl_file_url and mesh_stats, or render_error if it never compiled or the
+    converter is unreachable (the client can still render the SCAD itself)."""
+    fields = {"scad_code": scad_code, "render_attempts": 0}
+    while True:
+        fields["render_attempts"] += 1
+        jobs.progress(stage="rendering", scad_code=scad_code)
+        try:
+            rendered = _render_scad(scad_code)
+        except (resilience.ProviderUnavailable, OSError) as e:
+            print("[PIPELINE] converter unavailable, leaving the render to the client:", e)
+            return {**fields, "stage": "render_failed", "render_error": str(e)}
+        metrics.count("job_renders", "In-job SCAD renders by outcome.",
+                      outcome="ok" if rendered["ok"] else "compile_error")
+        if rendered["ok"]:
+            break
+        if fields["render_attempts"] > RENDER_REPAIRS:
+            return {**fields, "stage": "render_failed", "render_error": rendered["error"]}
+        print(f"[PIPELINE] SCAD did not compile ({rendered['error']}), regenerating")
+        jobs.progress(stage="repairing")
+        try:
+            repaired = regenerate(_repair_note(scad_code, rendered["error"]))
+        except (resilience.ProviderUnavailable, RuntimeError) as e:
+            print("[PIPELINE] repair failed:", e)
+            repaired = None
+        if not repaired:
+            return {**fields, "stage": "render_failed", "render_error": rendered["error"]}
+        scad_code = fields["scad_code"] = repaired
+
+    fields.update(stage="rendered", stl_file_url=rendered["url"],
+                  mesh_stats=summaries.stl_stats_for_url(rendered["url"]))
+    if userid and mid:
+        model_writes.put({"id": mid, "user_id": userid, "stl_file_url": rendered["url"]})
+    return fields
+
+def _render_new_model(mid: str, fields: dict, prompt: str, userid: str | None,
+                      variant: str | None = None, name: str | None = None) -> dict:
+    """Render stage for a generated model; mesh engines and warm results already have an STL."""
+    if not GENERATION_RENDER or not fields.get("scad_code") or fields.get("stl_file_url"):
+        return fields
+
+    def regenerate(note):
+        _, repaired = _generate_cad_model(prompt, userid=userid, modelid=mid, name=name or prompt,
+                                          variant=f"{variant}\n\n{note}" if variant else note)
+        return repaired["scad_code"]
+    return {**fields, **_render_stage(fields["scad_code"], regenerate, userid, mid)}
+
+def _render_fields(job: dict) -> dict:
+    """Render-stage results of a finished job, for responses that carry them."""
+    return {k: job[k] for k in ("stl_file_url", "mesh_stats", "render_error") if job.get(k) is not None}
+
+# >>> JOBS: every generation runs as a job so identical in-flight requests share it
+def _start_generation_job(mode: str, prompt: str, userid: str | None, modelid: str | None,
+                          sid: str | None = None, engine: str | None = None):
+    """Start (or attach to an identical in-flight) generate/iterate job. Returns (job_id, attached).
+    On success the model becomes the session's active model. `engine` picks the text-to-CAD
+    engine for new models ("auto" lets the router choose)."""
+    if mode == "iterate":
+        def fn():
+            code = _iterate_cad_model(prompt, userid, modelid)
+            sessions.update(sid, model_id=modelid)
+            if not GENERATION_RENDER:
+                return {"scad_code": code}
+            return _render_stage(code, lambda note: _iterate_cad_model(note, userid, modelid, name=prompt),
+                                 userid, modelid)
+    else:
+        def fn():
+            mid, fields = _generate_cad_model(prompt, userid=userid, engine=engine)
+            if fields["scad_code"] or fields.get("stl_file_url"):
+                sessions.update(sid, model_id=mid)
+            return {**_render_new_model(mid, fields, prompt, userid), "model_id": mid}
+    return jobs.submit(
+        mode, fn,
+        key=coalesce_key(f"{mode}:{engine}" if engine else mode, userid, prompt, modelid),
+        deadline_s=GENERATION_DEADLINE_S or None,
+        owner=userid or sid,  # fair-share scheduling unit
+        prompt=prompt, userid=userid, modelid=modelid,
+    )
+
+def _run_generation_job(mode: str, prompt: str, userid: str | None, modelid: str | None,
+                        sid: str | None = None, engine: str | None = None) -> dict:
+    """Synchronous variant: start or attach, then wait for the result."""
+    job_id, _ = _start_generation_job(mode, prompt, userid, modelid, sid, engine)
+    job = jobs.wait(job_id)
+    if job["status"] == "cancelled":
+        raise cancellation.Cancelled(job["error"])
+    if job["status"] == "error":
+        provider = job.get("provider")
+        if provider:
+            message = job["error"].removeprefix(f"{provider}: ")
+            raise resilience.ProviderUnavailable(provider, message, job.get("retry_after"))
+        raise RuntimeError(job["error"])
+    return job
+
+# >>> BATCH: several prompts, or variants of one, fanned out as a job group
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "4"))
+# variants after the first wait this long for it to get the shared prompt prefix cached
+BATCH_PREFIX_WAIT_S = float(os.getenv("BATCH_PREFIX_WAIT_S", "10"))
+VARIANT_STYLES = (
+    "the most straightforward, faithful version",
+    "noticeably different proportions and silhouette",
+    "a minimal, simplified take with fewer parts",
+    "a more detailed, decorative take",
+    "optimised for printing: flat base, no overhangs steeper than 45 degrees",
+    "softer, rounded forms",
+)
+
+def _batch_items() -> list[dict] | None:
+    """[{prompt, variant, name}] from {prompts: [...]} or {prompt, variants: n}; None if invalid."""
+    body = request.get_json(silent=True) or {}
+    prompts = [p.strip() for p in body.get("prompts") or [] if isinstance(p, str) and p.strip()]
+    if prompts:
+        return [{"prompt": p, "variant": None, "name": p} for p in prompts[:BATCH_MAX_ITEMS]]
+    prompt = (body.get("prompt") or "").strip()
     try:
-        tpl = (
-            "based on ${currentText} generate one short sentence that says we are generating the CAD model now. "
-            "No features, no brands, no fluff."
-        )
-        prompt = tpl.replace("${currentText}", text or "")
-        client = AsyncDedalus() if os.getenv("DEDALUS_API_KEY") else None
-        if client:
-            runner = DedalusRunner(client)
-            async def _run():
-                return await runner.run(
-                    input=prompt,
-                    model=["openai/gpt-5", "gemini-2.5-flash"],
-                    mcp_servers=["windsor/brave-search-mcp"],
-                    stream=False,
-                )
+        n = min(int(body.get("variants") or 0), BATCH_MAX_ITEMS, len(VARIANT_STYLES))
+    except (TypeError, ValueError):
+        return None
+    if not prompt or n < 1:
+        return None
+    return [{
+        "prompt": prompt,
+        "variant": f"Variant {i + 1} of {n}: {VARIANT_STYLES[i]}. Keep it the same kind of object.",
+        "name": f"{prompt} (variant {i + 1})",
+    } for i in range(n)]
+
+def _batch_cost() -> float:
+    return float(len(_batch_items() or [None]))
+
+def _start_batch(items: list[dict], userid: str | None, sid: str | None) -> tuple[str, list[dict]]:
+    """Submit every item as a job in one group. Variants share the first one's prompt prefix:
+    the others start once it has been cached (or after BATCH_PREFIX_WAIT_S)."""
+    group_id = str(uuid4())
+    lead_ready = threading.Event()
+    submitted = []
+    for index, item in enumerate(items):
+        prompt, variant = item["prompt"], item["variant"]
+        def fn(prompt=prompt, variant=variant, name=item["name"], lead=(index == 0)):
+            if variant and lead:
+                providers.on_prefix_ready(lead_ready.set)
+            elif variant:
+                deadline = time.monotonic() + BATCH_PREFIX_WAIT_S
+                while not lead_ready.is_set() and time.monotonic() < deadline:
+                    cancellation.sleep(0.05)
             try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = None
-            if loop and loop.is_running():
-                new_loop = asyncio.new_event_loop()
-                try:
-                    asyncio.set_event_loop(new_loop)
-                    result = new_loop.run_until_complete(_run())
-                finally:
-                    new_loop.close()
-                    asyncio.set_event_loop(loop)
-            elif loop:
-                result = loop.run_until_complete(_run())
-            else:
-                result = asyncio.run(_run())
-            status_text = getattr(result, "final_output", None) or str(result)
-    except Exception as e:
-        print("[WARN] Status Dedalus failed:", e)
+                mid, fields = _generate_cad_model(prompt, userid=userid, variant=variant, name=name)
+            finally:
+                if lead:
+                    lead_ready.set()  # failed or finished without signalling: don't hold the rest
+            if fields["scad_code"]:
+                sessions.update(sid, model_id=mid)
+            return {**_render_new_model(mid, fields, prompt, userid, variant, name), "model_id": mid}
+        job_id, attached = jobs.submit(
+            "generate", fn,
+            key=coalesce_key("generate", userid, f"{prompt}\n{variant or ''}"),
+            deadline_s=GENERATION_DEADLINE_S or None,
+            owner=userid or sid,
+            group=group_id,
+            prompt=prompt, variant=variant, userid=userid, modelid=None,
+        )
+        submitted.append({"index": index, "job_id": job_id, "prompt": prompt, "variant": variant,
+                          "attached": attached})
+    return group_id, submitted
+
+def _batch_status(group_id: str) -> dict | None:
+    members = jobs.group(group_id)
+    if members is None:
+        return None
+    items = []
+    for index, (job_id, job) in enumerate(members):
+        item = {"index": index, "job_id": job_id, "status": job["status"],
+                "prompt": job.get("prompt"), "variant": job.get("variant")}
+        if job["status"] == "done":
+            item.update(model_id=job.get("model_id"), scad_code=job.get("scad_code"),
+                        engine=job.get("engine"), stl_file_url=job.get("stl_file_url"),
+                        **{k: v for k, v in _render_fields(job).items() if k != "stl_file_url"})
+        elif job["status"] == "running" and job.get("stage"):
+            item["stage"] = job["stage"]
+        elif job["status"] in ("error", "cancelled"):
+            item["error"] = job.get("error")
+        items.append(item)
+    statuses = [i["status"] for i in items]
+    if any(st in ("pending", "running") for st in statuses):
+        overall = "running"
+    elif all(st == "done" for st in statuses):
+        overall = "done"
+    elif all(st == "cancelled" for st in statuses):
+        overall = "cancelled"
+    else:
+        overall = "partial" if "done" in statuses else "error"
+    return {"group_id": group_id, "status": overall, "total": len(items),
+            "done": statuses.count("done"), "items": items}
+
+# >>> RESILIENCE: short LLM calls and TTS go through resilience.py (timeouts, breakers, failover)
+SUMMARY_MODELS = ["openai/gpt-4o-mini", "gemini-2.5-flash"]
+
+def _dedalus_text(prompt: str, models: list[str], **kwargs) -> str | None:
+    """One short Dedalus completion. Equivalent models are tried fastest-first, each with its
+    own timeout and circuit breaker. None when Dedalus is not configured; raises if all fail."""
+    if not providers.dedalus_configured():
+        return None
+    def attempt(model):
+        # a fresh runner per attempt: each guarded call runs on its own event loop
+        return lambda: providers.dedalus_runner().run(input=prompt, model=model, stream=False, **kwargs)
+    result = resilience.failover([(f"dedalus:{m}", attempt(m)) for m in models])
+    return getattr(result, "final_output", None) or str(result)
+
+def _tts(text: str) -> bytes:
+    elevenlabs = providers.elevenlabs()
+    def call():
+        # convert() streams; draining it inside the guard keeps the download under the timeout
+        return _audio_to_bytes(elevenlabs.text_to_speech.convert(
+            text=text,
+            voice_id="EXAVITQu4vr4xnSDxMaL",
+            model_id="eleven_multilingual_v2",
+            output_format="mp3_44100_128",
+        ))
+    return resilience.guard("elevenlabs_tts").call(call)
+
+# Status sentence + TTS: local templates with pre-synthesized audio (status_phrases.py)
+def _status_update(text: str):
+    with span("status_phrase"):
+        status_text, audio_bytes = status_bank.phrase(text, iterate=_detect_iterate_intent(text))
 
     audio_b64 = None
     try:
-        if elevenlabs and status_text:
-            audio_obj = elevenlabs.text_to_speech.convert(
-                text=status_text,
-                voice_id="EXAVITQu4vr4xnSDxMaL",
-                model_id="eleven_multilingual_v2",
-                output_format="mp3_44100_128",
-            )
-            audio_bytes = _audio_to_bytes(audio_obj)
-            import base64
+        if providers.elevenlabs() and status_text:
+            if audio_bytes is None:
+                # fragments not synthesized yet (cold start): speak the whole sentence once
+                status_bank.start(_tts)
+                with span("status_tts"):
+                    audio_bytes = _tts(status_text)
             audio_b64 = base64.b64encode(audio_bytes).decode("utf-8")
             print(f"[STATUS TTS] bytes={len(audio_bytes)} b64_len={len(audio_b64)}")
         else:
@@ -238,28 +613,11 @@ def _status_update(text: str):
 
     return status_text, audio_b64
 
-# --------------------------- Hunyuan client -----------------------------
-_client = None
-def get_client():
-    global _client
-    if _client is not None:
-        return _client
-    import time as _time
-    last_err = None
-    hf_token = os.getenv("HUGGINGFACE_TOKEN")
-    for _ in range(3):
-        try:
-            _c = Client("tencent/Hunyuan3D-2", hf_token=hf_token) if hf_token else Client("tencent/Hunyuan3D-2")
-            _client = _c
-            return _client
-        except Exception as e:
-            last_err = e
-            _time.sleep(2)
-    raise last_err
-
 # ------------------------------- Routes ---------------------------------
 
 @app.route("/api/hunyuan/generate", methods=["POST"])
+@uploads.upload_limit("image")
+@rate_limited(rate_limits, "hunyuan")
 def generate_hunyuan_model():
     import time
     start_time = time.time()
@@ -273,237 +631,139 @@ def generate_hunyuan_model():
         if "image" not in request.files:
             return jsonify({"error": "Main image is required"}), 400
 
-        temp_dir = tempfile.mkdtemp()
-        file_paths = {}
-        try:
-            image_file = request.files["image"]
-            if not image_file or not image_file.filename:
-                return jsonify({"error": "No image file provided"}), 400
-            if not allowed_file(image_file.filename):
-                return jsonify({"error": f"Invalid file type. Allowed: {ALLOWED_EXTENSIONS}"}), 400
-
-            image_path = os.path.join(temp_dir, secure_filename(image_file.filename))
-            image_file.save(image_path)
-            file_paths["image"] = image_path
-
-            mv_images = {
-                "mv_image_front": request.files.get("mv_image_front"),
-                "mv_image_back": request.files.get("mv_image_back"),
-                "mv_image_left": request.files.get("mv_image_left"),
-                "mv_image_right": request.files.get("mv_image_right"),
-            }
-            for key, file in mv_images.items():
-                if file and file.filename and allowed_file(file.filename):
-                    p = os.path.join(temp_dir, secure_filename(file.filename))
-                    file.save(p)
-                    file_paths[key] = p
-
-            steps = int(request.form.get("steps", 32))
-            guidance_scale = float(request.form.get("guidance_scale", 5.5))
-            seed = int(request.form.get("seed", 42))
-            octree_resolution = int(request.form.get("octree_resolution", 256))
-            check_box_rembg = request.form.get("check_box_rembg", "true").lower() == "true"
-            num_chunks = int(request.form.get("num_chunks", 8000))
-            randomize_seed = request.form.get("randomize_seed", "false").lower() == "true"
-
-            client = get_client()
-            result = client.predict(
-                caption=caption,
-                image=handle_file(file_paths["image"]),
-                mv_image_front=handle_file(file_paths.get("mv_image_front", file_paths["image"])),
-                mv_image_back=handle_file(file_paths.get("mv_image_back", file_paths["image"])),
-                mv_image_left=handle_file(file_paths.get("mv_image_left", file_paths["image"])),
-                mv_image_right=handle_file(file_paths.get("mv_image_right", file_paths["image"])),
-                steps=steps,
-                guidance_scale=guidance_scale,
-                seed=seed,
-                octree_resolution=octree_resolution,
-                check_box_rembg=check_box_rembg,
-                num_chunks=num_chunks,
-                randomize_seed=randomize_seed,
-                api_name="/shape_generation",
-            )
-
-            def extract_url(obj):
-                if isinstance(obj, dict):
-                    if "__type__" in obj and "value" in obj:
-                        return obj["value"]
-                    elif "value" in obj:
-                        return obj["value"]
-                return obj
-
-            model_url = None
-            if isinstance(result, (list, tuple)) and len(result) > 0:
-                model_url = extract_url(result[0])
-            elif result:
-                model_url = extract_url(result)
-
-            if model_url and not isinstance(model_url, str):
-                model_url = str(model_url)
-            if model_url and model_url.startswith("/tmp/gradio/"):
-                base_url = "https://tencent-hunyuan3d-2.hf.space"
-                model_url = f"{base_url}/file={model_url}"
+        image_file = request.files["image"]
+        if not image_file or not image_file.filename:
+            return jsonify({"error": "No image file provided"}), 400
+        if not allowed_file(image_file.filename):
+            return jsonify({"error": f"Invalid file type. Allowed: {ALLOWED_EXTENSIONS}"}), 400
+
+        # stored by content hash, so re-sent photos (same image as another view, retries) are written once
+        file_paths = {"image": uploads.persist(image_file, artifacts.uploads, _extension(image_file.filename))}
+        for key in ("mv_image_front", "mv_image_back", "mv_image_left", "mv_image_right"):
+            file = request.files.get(key)
+            if file and file.filename and allowed_file(file.filename):
+                file_paths[key] = uploads.persist(file, artifacts.uploads, _extension(file.filename))
+
+        options = {
+            "steps": int(request.form.get("steps", 32)),
+            "guidance_scale": float(request.form.get("guidance_scale", 5.5)),
+            "seed": int(request.form.get("seed", 42)),
+            "octree_resolution": int(request.form.get("octree_resolution", 256)),
+            "check_box_rembg": request.form.get("check_box_rembg", "true").lower() == "true",
+            "num_chunks": int(request.form.get("num_chunks", 8000)),
+            "randomize_seed": request.form.get("randomize_seed", "false").lower() == "true",
+        }
+
+        # submitted and polled by the hunyuan engine (cad_engines.py)
+        _, generated = cad_router.run(
+            "image", {"images": file_paths, "caption": caption, "options": options},
+            preferred="hunyuan",
+        )
+        model_url, result = generated["mesh_url"], generated["result"]
 
-            try:
-                supabase.table("models").insert({
-                    "id": str(uuid4()),
-                    "user_id": userid,
-                    "name": caption if caption else f"Model_{int(start_time)}",
-                    "glb_file_url": model_url
-                }).execute()
-            except Exception as db_error:
-                print("[WARN] Database save failed:", db_error)
-
-            return jsonify({"success": True, "model_url": model_url, "result": result})
-        finally:
-            if os.path.exists(temp_dir):
-                shutil.rmtree(temp_dir)
+        try:
+            model_writes.put({
+                "id": str(uuid4()),
+                "user_id": userid,
+                "name": caption if caption else f"Model_{int(start_time)}",
+                "created_at": _now_iso(),
+                "glb_file_url": model_url
+            }, insert=True)
+        except Exception as db_error:
+            print("[WARN] Database save failed:", db_error)
+
+        return jsonify({"success": True, "model_url": model_url, "result": result})
+    except resilience.ProviderUnavailable:
+        raise
     except Exception as e:
         import traceback
         return jsonify({"success": False, "error": str(e), "traceback": traceback.format_exc() if app.debug else None}), 500
 
 @app.get("/api/getresponse")
+@rate_limited(rate_limits, "voice")
 def get_response():
-    if not elevenlabs:
+    if not providers.elevenlabs():
         return jsonify({"error": "ELEVENLABS_API_KEY not configured"}), 500
 
-    global currentText
-    prompt = (
-        "based on ${currentText} generate one short sentence that says we are generating the CAD model now."
-        " No features, no brands, no fluff."
-    ).replace("${currentText}", currentText or "")
-
-    try:
-        client = AsyncDedalus() if os.getenv("DEDALUS_API_KEY") else None
-        if client:
-            runner = DedalusRunner(client)
-            async def _run():
-                return await runner.run(
-                    input=prompt,
-                    model=["openai/gpt-5", "gemini-2.5-flash"],
-                    mcp_servers=["windsor/brave-search-mcp"],
-                    stream=False,
-                )
-            try:
-                loop = asyncio.get_event_loop()
-            except RuntimeError:
-                loop = None
-            if loop and loop.is_running():
-                new_loop = asyncio.new_event_loop()
-                try:
-                    asyncio.set_event_loop(new_loop)
-                    result = new_loop.run_until_complete(_run())
-                finally:
-                    new_loop.close()
-                    asyncio.set_event_loop(loop)
-            elif loop:
-                result = loop.run_until_complete(_run())
-            else:
-                result = asyncio.run(_run())
-            text_out = getattr(result, "final_output", None) or str(result)
-        else:
-            text_out = "Your CAD model generation is starting now."
-    except Exception:
-        text_out = "Your CAD model generation is starting now."
-
-    try:
-        audio = elevenlabs.text_to_speech.convert(
-            text=text_out,
-            voice_id="EXAVITQu4vr4xnSDxMaL",
-            model_id="eleven_multilingual_v2",
-            output_format="mp3_44100_128",
-        )
-        audio_bytes = _audio_to_bytes(audio)
-        import base64
-        audio_b64 = base64.b64encode(audio_bytes).decode("utf-8")
+    text_out, audio_b64 = _status_update(sessions.transcript(_session_id()))
+    if audio_b64:
         return jsonify({"text": text_out, "audio_b64": audio_b64, "format": "mp3"})
-    except Exception:
-        return jsonify({"error": "TTS failed", "text": text_out}), 500
+    return jsonify({"error": "TTS failed", "text": text_out}), 500
+
+def _summary_facts(scad_code: str, user_prompt: str, refine: bool, mesh: dict | None = None,
+                   stl_url: str | None = None) -> tuple[tuple, dict, dict | None]:
+    """(summary key, parsed facts, mesh stats). Facts and mesh stats depend only on the
+    SCAD, so they are cached by its hash; the key adds the request's subject."""
+    code_hash = summaries.scad_hash(scad_code)
+    parsed = summary_cache.get(("facts", code_hash))
+    if parsed is None:
+        parsed = {"facts": summaries.parse_scad(scad_code), "mesh": None}
+    mesh = mesh or parsed["mesh"] or summaries.stl_stats_for_url(stl_url)
+    if mesh and not parsed["mesh"]:
+        parsed = {**parsed, "mesh": mesh}
+    summary_cache.put(("facts", code_hash), parsed)
+    return summaries.summary_key(code_hash, parsed["facts"], mesh, user_prompt, refine), parsed["facts"], mesh
+
+def _model_summary(scad_code: str, user_prompt: str = "", refine: bool = False,
+                   mesh: dict | None = None, stl_url: str | None = None) -> tuple[dict, bool]:
+    """({summary, source, audio_b64}, cached) for a model, from summary_cache when possible."""
+    with span("summary_build"):
+        key, facts, mesh = _summary_facts(scad_code, user_prompt, refine, mesh, stl_url)
+    entry = summary_cache.get(key)
+    metrics.cache_result("model_summary", entry is not None)
+    cached = entry is not None
+    if entry is None:
+        summary, source = summaries.describe(facts, mesh, user_prompt), "local"
+        if refine:
+            try:
+                refined = _dedalus_text(summaries.refine_prompt(summary, facts, mesh, user_prompt),
+                                        SUMMARY_MODELS)
+                if refined:
+                    summary, source = refined.strip().strip('"').strip("'"), "llm"
+            except Exception as e:
+                print(f"[WARN] Summary refinement failed, using local summary: {e}")
+        entry = {"summary": summary, "source": source, "audio_b64": None}
+        summary_cache.put(key, entry)
+
+    # audio is cached with the text; a miss (or an earlier TTS failure) synthesizes it once
+    if entry["audio_b64"] is None and providers.elevenlabs():
+        try:
+            entry["audio_b64"] = base64.b64encode(_tts(entry["summary"])).decode("utf-8")
+        except Exception as tts_err:
+            print(f"[WARN] TTS failed for summary: {tts_err}")
+    return entry, cached
 
 @app.post("/api/generate-model-summary")
+@rate_limited(rate_limits, "voice")
 def generate_model_summary():
     """
     POST body JSON:
       - scad_code (required): The OpenSCAD code that was generated
       - user_prompt (optional): Original user request for context
-    Returns: { summary: string, audio_b64: string, format: string }
-    
-    Generates a brief natural language summary of the generated model
+      - stl_url (optional): converter URL of the rendered STL, for real dimensions
+      - mesh_stats (optional): {triangles, size: [x, y, z]} if the client already has them
+      - refine (optional): polish the local sentence with an LLM
+    Returns: { summary, audio_b64, format, source: "local"|"llm", cached }
+
+    The summary is built from the parsed SCAD and mesh stats (summaries.py) and
+    cached with its audio by SCAD hash and subject (summaries.summary_key), so repeat
+    views skip both LLM and TTS.
     """
-    if not elevenlabs:
-        return jsonify({"error": "ELEVENLABS_API_KEY not configured"}), 500
-    
     try:
         data = request.get_json() or {}
         scad_code = data.get("scad_code", "")
         user_prompt = data.get("user_prompt", "")
-        
+        refine = _flag(data.get("refine") or request.args.get("refine"))
+
         if not scad_code:
             return jsonify({"error": "scad_code is required"}), 400
-        
-        # Build prompt for summary generation
-        prompt = f"""Based on the following OpenSCAD code, generate ONE SHORT sentence (max 15 words) describing what 3D model was created. 
-Be specific about the shape, dimensions if obvious, and any notable features. Do not mention OpenSCAD or technical details.
-Keep it natural and conversational. Describe the shape for a little bit and start with, I have created/ I have modeled this object...
-
-{f"User requested: {user_prompt}" if user_prompt else ""}
 
-OpenSCAD code:
-{scad_code[:500]}
+        entry, cached = _model_summary(scad_code, user_prompt, refine, data.get("mesh_stats"),
+                                       data.get("stl_url"))
+        return jsonify({"summary": entry["summary"], "audio_b64": entry["audio_b64"],
+                        "format": "mp3" if entry["audio_b64"] else None,
+                        "source": entry["source"], "cached": cached})
 
-Generate a brief description:"""
-        
-        try:
-            client = AsyncDedalus() if os.getenv("DEDALUS_API_KEY") else None
-            if client:
-                runner = DedalusRunner(client)
-                async def _run():
-                    return await runner.run(
-                        input=prompt,
-                        model=["openai/gpt-4o-mini", "gemini-2.5-flash"],
-                        stream=False,
-                    )
-                try:
-                    loop = asyncio.get_event_loop()
-                except RuntimeError:
-                    loop = None
-                if loop and loop.is_running():
-                    new_loop = asyncio.new_event_loop()
-                    try:
-                        asyncio.set_event_loop(new_loop)
-                        result = new_loop.run_until_complete(_run())
-                    finally:
-                        new_loop.close()
-                        asyncio.set_event_loop(loop)
-                elif loop:
-                    result = loop.run_until_complete(_run())
-                else:
-                    result = asyncio.run(_run())
-                summary = getattr(result, "final_output", None) or str(result)
-                # Clean up the summary - remove quotes if wrapped
-                summary = summary.strip().strip('"').strip("'")
-            else:
-                summary = "Your 3D model has been generated successfully."
-        except Exception as e:
-            print(f"[WARN] Summary generation failed: {e}")
-            summary = "Your 3D model has been generated successfully."
-        
-        # Generate TTS audio for the summary
-        try:
-            audio = elevenlabs.text_to_speech.convert(
-                text=summary,
-                voice_id="EXAVITQu4vr4xnSDxMaL",
-                model_id="eleven_multilingual_v2",
-                output_format="mp3_44100_128",
-            )
-            audio_bytes = _audio_to_bytes(audio)
-            import base64
-            audio_b64 = base64.b64encode(audio_bytes).decode("utf-8")
-            return jsonify({"summary": summary, "audio_b64": audio_b64, "format": "mp3"})
-        except Exception as tts_err:
-            print(f"[WARN] TTS failed for summary: {tts_err}")
-            return jsonify({"summary": summary, "audio_b64": None, "format": None})
-            
     except Exception as e:
         import traceback
         print(f"[ERROR] generate-model-summary exception: {e}")
@@ -512,277 +772,578 @@ Generate a brief description:"""
 
 # >>> ITERATION: Dedicated endpoint
 @app.post("/api/iterate")
+@idempotent(idempotency)
+@rate_limited(rate_limits, "generation")  # inside idempotent: replays cost no tokens
 def iterate_endpoint():
     """
     POST body form-data or JSON:
       - userid (required)
-      - modelid (required)
+      - modelid (optional): defaults to the session's active model
       - prompt (required): iteration instruction (e.g., 'make the handle thicker')
-    Returns: { success, scad_code }
+      - session_id (optional, or X-Session-Id header)
+    Returns: { success, model_id, scad_code, stl_file_url?, mesh_stats?, render_error? }
     """
     try:
-        userid = request.form.get("userid") or (request.json or {}).get("userid")
-        modelid = request.form.get("modelid") or (request.json or {}).get("modelid")
-        prompt = request.form.get("prompt") or (request.json or {}).get("prompt")
+        sid = _session_id()
+        userid = _request_value("userid")
+        modelid = _request_value("modelid") or sessions.active_model(sid)
+        prompt = _request_value("prompt")
         if not (userid and modelid and prompt):
             return jsonify({"error": "userid, modelid and prompt are required"}), 400
 
-        scad = _iterate_cad_model(prompt, userid, modelid)
-        return jsonify({"success": True, "scad_code": scad})
+        sessions.update(sid, turn={"role": "user", "text": prompt, "intent": "iterate", "model_id": modelid})
+        job = _run_generation_job("iterate", prompt, userid, modelid, sid)
+        return jsonify({"success": True, "model_id": modelid, "scad_code": job["scad_code"], **_render_fields(job)})
+    except (resilience.ProviderUnavailable, cancellation.Cancelled):
+        raise
     except Exception as e:
         import traceback
         return jsonify({"success": False, "error": str(e), "traceback": traceback.format_exc() if app.debug else None}), 500
 
-@app.post("/api/transcribe")
-def transcribe_audio():
-    try:
-        if not elevenlabs:
-            return jsonify({"error": "ELEVENLABS_API_KEY not configured"}), 501
-
-        print("/api/transcribe content-type:", request.content_type)
-        print("/api/transcribe files keys:", list(request.files.keys()))
-        print("/api/transcribe form keys:", list(request.form.keys()))
-
-        if "file" not in request.files:
-            raw_len = request.content_length or 0
-            return jsonify({
-                "error": "no file provided",
-                "hint": "Send multipart/form-data with a 'file' field",
-                "content_type": request.content_type,
-                "content_length": raw_len,
-            }), 400
-
-        uploaded = request.files["file"]
-        payload = uploaded.read()
-        print("/api/transcribe received bytes:", len(payload))
-        print("/api/transcribe file name:", getattr(uploaded, "filename", None))
-        print("/api/transcribe file mimetype:", getattr(uploaded, "mimetype", None))
-
-        audio_data = BytesIO(payload)
-        try:
-            audio_data.name = uploaded.filename or "audio.webm"
-        except Exception:
-            pass
-
-        tr = elevenlabs.speech_to_text.convert(
-            file=audio_data,
+def _flag(value) -> bool:
+    return str(value).lower() in ("1", "true", "yes")
+
+def _transcribe_options() -> dict:
+    """Chain/async switches and ids for a transcribe request (query string or form)."""
+    def arg(*names):
+        for n in names:
+            v = request.args.get(n) or request.form.get(n)
+            if v:
+                return v
+        return None
+    chain_flag = arg("chain_generate", "generate", "chain")
+    return {
+        "chain": _flag(chain_flag),
+        "chain_flag": chain_flag,
+        "async": _flag(arg("async", "async_generate")),
+        "userid": arg("userid"),
+        "modelid": arg("modelid"),
+        "prompt": (arg("prompt") or "").strip(),
+        "sid": _session_id(),
+        # STT: single-speaker fast path unless the client asks for more
+        "diarize": _flag(arg("diarize")),
+        "audio_events": _flag(arg("audio_events", "tag_audio_events")),
+        "preprocess": str(arg("preprocess") or "1").lower() not in ("0", "false", "no"),
+        # response shape: ?fields=text,intent,job_id and ?raw=1 for the full STT dump
+        "fields": {f.strip() for f in (arg("fields") or "").split(",") if f.strip()} or None,
+        "raw": _flag(arg("raw")),
+        # text-to-CAD engine for new models: scad (default, CAD_ENGINE), kittycad or auto
+        "engine": (arg("engine") or "").strip().lower() or None,
+    }
+
+def _engine_error(engine: str | None):
+    """400 response for an `engine` option no text-to-CAD engine answers to, else None."""
+    valid = ["auto"] + [name for name, e in cad_router.engines.items() if "text" in e.inputs]
+    if engine is None or engine in valid:
+        return None
+    return jsonify({"error": f"unknown engine: {engine}", "engines": valid}), 400
+
+def _speech_to_text(audio, filename: str | None = None, mimetype: str | None = None,
+                    opts: dict | None = None):
+    """Send a file object (or bytes) to ElevenLabs STT. By default the audio is trimmed,
+    downmixed and resampled first (audio_prep.py) and diarization/audio-event tagging
+    are off, since voice commands have a single speaker."""
+    opts = opts or {}
+    extra = {}
+    if opts.get("preprocess", True):
+        with span("audio_prep"):
+            prep = audio_prep.prepare(audio, filename, mimetype)
+        print(f"[AUDIO PREP] bytes {prep['bytes_in']} -> {prep['bytes_out']}")
+        audio, filename, mimetype = prep["audio"], prep["filename"], prep["mimetype"]
+        if prep["file_format"]:
+            extra["file_format"] = prep["file_format"]
+    with span("stt"):
+        return resilience.guard("elevenlabs_stt").call(
+            providers.elevenlabs().speech_to_text.convert,
+            file=(filename or "audio.webm", audio, mimetype),
             model_id="scribe_v1",
-            tag_audio_events=True,
+            tag_audio_events=opts.get("audio_events", False),
             language_code="eng",
-            diarize=True,
+            diarize=opts.get("diarize", False),
+            **extra,
         )
 
-        text = ""
-        if getattr(tr, "utterances", None):
-            text = " ".join(u.text for u in tr.utterances if u.text).strip()
-        elif getattr(tr, "text", None):
-            text = tr.text.strip()
-
-        print("[TRANSCRIPT]", text)
-        global currentText
-        currentText = text
-
-        # >>> INTENT: detect "re iterate" / "reiterate" / "iterate again"
-        tnorm = (text or "").lower()
-        iterate_intent = bool(re.search(r"\bre[\s-]?iterate\b", tnorm) or re.search(r"\biterate again\b", tnorm))
-        print("[INTENT] iterate_intent:", iterate_intent)
-
-        # chain flags
-        chain_flag = (
-            request.args.get("chain_generate")
-            or request.args.get("generate")
-            or request.args.get("chain")
-            or request.form.get("chain_generate")
-            or request.form.get("generate")
-            or request.form.get("chain")
-        )
-        do_chain = str(chain_flag).lower() in ("1", "true", "yes")
-        print("[CHAIN] chain flag:", chain_flag, "=>", do_chain)
-
-        # build prompt (fallbacks)
-        prompt_from_client = (request.args.get("prompt") or request.form.get("prompt") or "").strip()
-        gen_prompt = (text or "").strip() or prompt_from_client or (currentText or "").strip()
-        if not gen_prompt:
-            print("[CHAIN] No usable prompt (empty transcript and no 'prompt' provided).")
-
-        model_id = None
-        scad_code = None
+def _transcript_text(tr) -> str:
+    text = ""
+    if getattr(tr, "utterances", None):
+        text = " ".join(u.text for u in tr.utterances if u.text).strip()
+    elif getattr(tr, "text", None):
+        text = tr.text.strip()
+    return text
+
+def _detect_iterate_intent(text: str) -> bool:
+    # >>> INTENT: detect "re iterate" / "reiterate" / "iterate again"
+    tnorm = (text or "").lower()
+    return bool(re.search(r"\bre[\s-]?iterate\b", tnorm) or re.search(r"\biterate again\b", tnorm))
+
+def _lean_transcript(payload: dict, opts: dict, raw=None):
+    """JSON body for a transcribe response. The raw STT dump (every word with timings) is
+    only built for ?raw=1 or fields=raw; ?fields=a,b keeps just those keys (plus error)."""
+    fields = opts.get("fields")
+    if raw is not None and (opts.get("raw") or (fields and "raw" in fields)):
+        payload["raw"] = raw()
+    if fields:
+        payload = {k: v for k, v in payload.items() if k in fields or k == "error"}
+    return jsonify(payload)
+
+def _respond_to_transcript(text: str, raw, opts: dict, status: tuple | None = None):
+    """Everything /api/transcribe does once the transcript is known: session update,
+    intent, optional status audio, and the chained generate/iterate job.
+    `raw` returns the raw STT payload; `status` is a precomputed (text, audio_b64)."""
+    sid = opts["sid"]
+    with span("intent"):
+        iterate_intent = _detect_iterate_intent(text)
+    print("[INTENT] iterate_intent:", iterate_intent)
+    sessions.update(sid, transcript=text, turn={
+        "role": "user", "text": text, "intent": "iterate" if iterate_intent else "generate",
+    })
+
+    do_chain = opts["chain"]
+    print("[CHAIN] chain flag:", opts["chain_flag"], "=>", do_chain)
+
+    # build prompt (fallbacks)
+    gen_prompt = (text or "").strip() or opts["prompt"]
+    if not gen_prompt:
+        print("[CHAIN] No usable prompt (empty transcript and no 'prompt' provided).")
+
+    model_id = None
+    scad_code = None
 
-        status_text = None
-        status_audio_b64 = None
+    status_text = None
+    status_audio_b64 = None
 
-        if do_chain:
+    if do_chain:
+        if status:
+            status_text, status_audio_b64 = status
+        else:
             print("[CHAIN] Producing status update (Dedalus + TTS) before CAD/iteration...")
             status_text, status_audio_b64 = _status_update(gen_prompt or text or "")
 
-        # async switch and IDs
-        async_flag = (
-            request.args.get("async")
-            or request.args.get("async_generate")
-            or request.form.get("async")
-            or request.form.get("async_generate")
-        )
-        do_async = str(async_flag).lower() in ("1", "true", "yes")
-        userid = request.args.get("userid") or request.form.get("userid")
-        modelid = request.args.get("modelid") or request.form.get("modelid")
-
-        # If not chaining, just return transcript + optional status audio
-        if not do_chain:
-            return jsonify({
+    # async switch and IDs
+    do_async = opts["async"]
+    userid = opts["userid"]
+    modelid = opts["modelid"]
+    if iterate_intent and not modelid:
+        # "iterate again" refers to whatever this session worked on last
+        modelid = sessions.active_model(sid)
+
+    # If not chaining, just return transcript + optional status audio
+    if not do_chain:
+        return _lean_transcript({
+            "text": text,
+            "intent": "iterate" if iterate_intent else "generate",
+            "status_text": status_text,
+            "status_audio_b64": status_audio_b64,
+            "status_audio_format": "mp3" if status_audio_b64 else None
+        }, opts, raw)
+
+    # Chaining: decide between iterate vs generate
+    if iterate_intent:
+        # iteration requires userid + modelid + prompt
+        if not (userid and modelid):
+            return _lean_transcript({
                 "text": text,
-                "raw": tr.model_dump() if hasattr(tr, "model_dump") else dict(tr),
                 "status_text": status_text,
                 "status_audio_b64": status_audio_b64,
-                "status_audio_format": "mp3" if status_audio_b64 else None
-            })
-
-        # Chaining: decide between iterate vs generate
-        if iterate_intent:
-            # iteration requires userid + modelid + prompt
-            if not (userid and modelid):
-                return jsonify({
-                    "text": text,
-                    "status_text": status_text,
-                    "status_audio_b64": status_audio_b64,
-                    "status_audio_format": "mp3" if status_audio_b64 else None,
-                    "error": "Iteration requested but userid/modelid not provided."
-                }), 400
-
-            if not gen_prompt:
-                return jsonify({
-                    "text": text,
-                    "status_text": status_text,
-                    "status_audio_b64": status_audio_b64,
-                    "status_audio_format": "mp3" if status_audio_b64 else None,
-                    "error": "Iteration requested but no prompt instruction captured."
-                }), 400
-
-            if do_async:
-                from threading import Thread
-                job_id = str(uuid4())
-                generation_jobs[job_id] = {
-                    "status": "pending",
-                    "mode": "iterate",
-                    "prompt": gen_prompt,
-                    "userid": userid,
-                    "modelid": modelid,
-                    "scad_code": None,
-                    "error": None,
-                }
-                def _worker():
-                    generation_jobs[job_id]["status"] = "running"
-                    try:
-                        code = _iterate_cad_model(gen_prompt, userid, modelid)
-                        generation_jobs[job_id]["scad_code"] = code
-                        generation_jobs[job_id]["status"] = "done"
-                    except Exception as e:
-                        import traceback
-                        generation_jobs[job_id]["error"] = f"{e}"
-                        generation_jobs[job_id]["trace"] = traceback.format_exc()
-                        generation_jobs[job_id]["status"] = "error"
-                Thread(target=_worker, daemon=True).start()
-
-                return jsonify({
-                    "text": text,
-                    "intent": "iterate",
-                    "status_text": status_text,
-                    "status_audio_b64": status_audio_b64,
-                    "status_audio_format": "mp3" if status_audio_b64 else None,
-                    "job_id": job_id,
-                    "async": True,
-                    "chained_generation": True
-                })
-            else:
-                try:
-                    scad_code = _iterate_cad_model(gen_prompt, userid, modelid)
-                except Exception as e:
-                    return jsonify({"error": str(e), "intent": "iterate"}), 500
-
-                return jsonify({
-                    "text": text,
-                    "intent": "iterate",
-                    "model_id": modelid,
-                    "scad_code": scad_code,
-                    "chained_generation": True,
-                    "status_text": status_text,
-                    "status_audio_b64": status_audio_b64,
-                    "status_audio_format": "mp3" if status_audio_b64 else None
-                })
-
-        # Otherwise: GENERATE (new model)
+                "status_audio_format": "mp3" if status_audio_b64 else None,
+                "error": "Iteration requested but userid/modelid not provided."
+            }, opts), 400
+
         if not gen_prompt:
-            # Return early with status audio + guidance
-            return jsonify({
+            return _lean_transcript({
                 "text": text,
-                "raw": tr.model_dump() if hasattr(tr, "model_dump") else dict(tr),
-                "model_id": None,
-                "scad_code": None,
-                "chained_generation": False,
                 "status_text": status_text,
                 "status_audio_b64": status_audio_b64,
                 "status_audio_format": "mp3" if status_audio_b64 else None,
-                "error": "No prompt text captured. Provide ?prompt=... or speak a description."
-            }), 200
+                "error": "Iteration requested but no prompt instruction captured."
+            }, opts), 400
 
         if do_async:
-            from threading import Thread
-            job_id = str(uuid4())
-            generation_jobs[job_id] = {
-                "status": "pending",
-                "mode": "generate",
-                "prompt": gen_prompt,
-                "userid": userid,
-                "modelid": modelid,
-                "scad_code": None,
-                "error": None,
-            }
-            def _worker():
-                generation_jobs[job_id]["status"] = "running"
-                try:
-                    mid, code = _generate_cad_model(gen_prompt, userid=userid, modelid=modelid)
-                    generation_jobs[job_id]["scad_code"] = code
-                    generation_jobs[job_id]["model_id"] = mid
-                    generation_jobs[job_id]["status"] = "done"
-                except Exception as e:
-                    import traceback
-                    generation_jobs[job_id]["error"] = f"{e}"
-                    generation_jobs[job_id]["trace"] = traceback.format_exc()
-                    generation_jobs[job_id]["status"] = "error"
-            Thread(target=_worker, daemon=True).start()
+            job_id, attached = _start_generation_job("iterate", gen_prompt, userid, modelid, sid)
 
-            return jsonify({
+            return _lean_transcript({
                 "text": text,
-                "intent": "generate",
+                "intent": "iterate",
                 "status_text": status_text,
                 "status_audio_b64": status_audio_b64,
                 "status_audio_format": "mp3" if status_audio_b64 else None,
                 "job_id": job_id,
-                "chained_generation": True,
-                "async": True
-            })
+                "attached": attached,
+                "async": True,
+                "chained_generation": True
+            }, opts)
         else:
-            model_id, scad_code = _generate_cad_model(gen_prompt, userid=userid, modelid=modelid)
-            return jsonify({
+            try:
+                job = _run_generation_job("iterate", gen_prompt, userid, modelid, sid)
+            except (resilience.ProviderUnavailable, cancellation.Cancelled):
+                raise
+            except Exception as e:
+                return _lean_transcript({"error": str(e), "intent": "iterate"}, opts), 500
+
+            return _lean_transcript({
                 "text": text,
-                "intent": "generate",
-                "model_id": model_id,
-                "scad_code": scad_code,
+                "intent": "iterate",
+                "model_id": modelid,
+                "scad_code": job["scad_code"],
+                **_render_fields(job),
                 "chained_generation": True,
                 "status_text": status_text,
                 "status_audio_b64": status_audio_b64,
                 "status_audio_format": "mp3" if status_audio_b64 else None
-            })
+            }, opts)
+
+    # Otherwise: GENERATE (new model)
+    if not gen_prompt:
+        # Return early with status audio + guidance
+        return _lean_transcript({
+            "text": text,
+            "model_id": None,
+            "scad_code": None,
+            "chained_generation": False,
+            "status_text": status_text,
+            "status_audio_b64": status_audio_b64,
+            "status_audio_format": "mp3" if status_audio_b64 else None,
+            "error": "No prompt text captured. Provide ?prompt=... or speak a description."
+        }, opts, raw), 200
+
+    if do_async:
+        job_id, attached = _start_generation_job("generate", gen_prompt, userid, modelid, sid, opts["engine"])
+
+        return _lean_transcript({
+            "text": text,
+            "intent": "generate",
+            "status_text": status_text,
+            "status_audio_b64": status_audio_b64,
+            "status_audio_format": "mp3" if status_audio_b64 else None,
+            "job_id": job_id,
+            "attached": attached,
+            "chained_generation": True,
+            "async": True
+        }, opts)
+    else:
+        job = _run_generation_job("generate", gen_prompt, userid, modelid, sid, opts["engine"])
+        model_id, scad_code = job.get("model_id"), job["scad_code"]
+        return _lean_transcript({
+            "text": text,
+            "intent": "generate",
+            "model_id": model_id,
+            "scad_code": scad_code,
+            "engine": job.get("engine"),
+            **_render_fields(job),
+            "chained_generation": True,
+            "status_text": status_text,
+            "status_audio_b64": status_audio_b64,
+            "status_audio_format": "mp3" if status_audio_b64 else None
+        }, opts)
+
+def _transcribe_limit_class() -> str:
+    return "generation" if _transcribe_options()["chain"] else "speech"
+
+@app.post("/api/transcribe")
+@uploads.upload_limit("audio")
+@idempotent(idempotency)
+@rate_limited(rate_limits, _transcribe_limit_class)
+def transcribe_audio():
+    try:
+        if not providers.elevenlabs():
+            return jsonify({"error": "ELEVENLABS_API_KEY not configured"}), 501
+        bad_engine = _engine_error(_transcribe_options()["engine"])
+        if bad_engine:
+            return bad_engine
+
+        print("/api/transcribe content-type:", request.content_type)
+        print("/api/transcribe files keys:", list(request.files.keys()))
+        print("/api/transcribe form keys:", list(request.form.keys()))
 
+        if "file" not in request.files:
+            raw_len = request.content_length or 0
+            return jsonify({
+                "error": "no file provided",
+                "hint": "Send multipart/form-data with a 'file' field",
+                "content_type": request.content_type,
+                "content_length": raw_len,
+            }), 400
+
+        uploaded = request.files["file"]
+        # Hand the spooled upload straight to STT instead of reading it into another buffer
+        print(f"/api/transcribe received bytes: {uploads.size(uploaded)} sha256={uploads.digest(uploaded)[:12]}")
+        uploaded.stream.seek(0)
+        print("/api/transcribe file name:", getattr(uploaded, "filename", None))
+        print("/api/transcribe file mimetype:", getattr(uploaded, "mimetype", None))
+
+        opts = _transcribe_options()
+        tr = _speech_to_text(uploaded.stream, uploaded.filename, uploaded.mimetype, opts)
+        text = _transcript_text(tr)
+        print("[TRANSCRIPT]", text)
+
+        return _respond_to_transcript(
+            text,
+            lambda: tr.model_dump() if hasattr(tr, "model_dump") else dict(tr),
+            opts,
+        )
+
+    except (resilience.ProviderUnavailable, cancellation.Cancelled):
+        raise
     except Exception as e:
         import traceback
         print("/api/transcribe error:", e)
         print(traceback.format_exc())
         return jsonify({"error": str(e)}), 500
 
+# >>> STREAMING: segmented STT ingestion (see stt_stream.py)
+def _transcribe_segment(audio: bytes, filename: str, mimetype: str | None, opts: dict) -> str:
+    return _transcript_text(_speech_to_text(audio, filename, mimetype, opts))
+
+_stream_status_lock = threading.Lock()
+
+def _on_stream_partial(stream):
+    """Speculatively prepare the status sentence + audio from the first usable partial
+    transcript so it is ready when the final segment lands."""
+    if not stream.options.get("chain"):
+        return
+    partial = stream.partial_text()
+    if not partial:
+        return
+    with _stream_status_lock:
+        if "status" not in stream.extras:
+            stream.extras["status"] = stt_executor.submit(_status_update, partial)
+
+def _read_segment():
+    """Segment audio from a multipart 'file' field or the raw (possibly chunked) body."""
+    if "file" in request.files:
+        f = request.files["file"]
+        return f.read(), f.filename or "segment.webm", f.mimetype
+    return request.get_data(cache=False), request.args.get("filename") or "segment.webm", request.mimetype
+
+@app.post("/api/transcribe/stream")
+@rate_limited(rate_limits, _transcribe_limit_class)
+def open_transcribe_stream():
+    """
+    Open a streaming transcription. Accepts the same query/form options as
+    /api/transcribe (chain, async, userid, modelid, prompt, session_id).
+    Returns: { stream_id }
+    Then POST each self-contained audio segment to /api/transcribe/stream/<stream_id>
+    (multipart 'file' or raw body) and mark the last one with ?final=1.
+    """
+    if not providers.elevenlabs():
+        return jsonify({"error": "ELEVENLABS_API_KEY not configured"}), 501
+    opts = _transcribe_options()
+    bad_engine = _engine_error(opts["engine"])
+    if bad_engine:
+        return bad_engine
+    stream = stt_streams.open(
+        lambda audio, filename, mimetype: _transcribe_segment(audio, filename, mimetype, opts),
+        opts,
+        _on_stream_partial,
+    )
+    return jsonify({"stream_id": stream.id}), 201
+
+@app.get("/api/transcribe/stream/<stream_id>")
+def transcribe_stream_state(stream_id):
+    stream = stt_streams.get(stream_id)
+    if not stream:
+        return jsonify({"error": "stream not found"}), 404
+    state = stream.state()
+    state["intent"] = "iterate" if _detect_iterate_intent(state["partial_text"]) else "generate"
+    return jsonify(state)
+
+@app.post("/api/transcribe/stream/<stream_id>")
+@uploads.upload_limit("segment")
+def transcribe_stream_segment(stream_id):
+    """
+    Append one segment. Non-final segments return 202 with the partial transcript and
+    intent so far. The final segment (?final=1) waits for the remaining STT and returns
+    the same payload as /api/transcribe, starting the chained job immediately.
+    """
+    stream = stt_streams.get(stream_id)
+    if not stream:
+        return jsonify({"error": "stream not found"}), 404
+    try:
+        final = _flag(request.args.get("final") or request.form.get("final"))
+        audio, filename, mimetype = _read_segment()
+        if not audio and not final:
+            return jsonify({"error": "empty segment"}), 400
+        if audio:
+            index = stream.add_segment(audio, filename, mimetype, final=final)
+        else:
+            index = None
+            stream.mark_final()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 409
+
+    if not final:
+        partial = stream.partial_text()
+        return jsonify({
+            "stream_id": stream.id,
+            "segment": index,
+            "partial_text": partial,
+            "intent": "iterate" if _detect_iterate_intent(partial) else "generate",
+        }), 202
+
+    try:
+        text = stream.wait(timeout=120)
+        print("[TRANSCRIPT][stream]", text)
+        status = None
+        pending_status = stream.extras.get("status")
+        if pending_status is not None:
+            try:
+                status = pending_status.result(timeout=30)
+            except Exception as e:
+                print("[WARN] speculative status failed:", e)
+        segments = stream.state()
+        return _respond_to_transcript(text, lambda: {"segments": segments}, stream.options, status)
+    except (resilience.ProviderUnavailable, cancellation.Cancelled):
+        raise
+    except Exception as e:
+        import traceback
+        print("/api/transcribe/stream error:", e)
+        print(traceback.format_exc())
+        return jsonify({"error": str(e)}), 500
+    finally:
+        stt_streams.close(stream.id)
+
 @app.route("/api/health", methods=["GET"])
 def health():
     return jsonify({"status": "ok"})
 
+@app.get("/api/models")
+def list_models():
+    """
+    Query params:
+      - userid (required)
+      - limit (optional, default 24, max 100)
+      - cursor (optional): next_cursor from the previous page
+      - fields (optional): comma list; defaults to metadata only (no scad_code)
+    Returns: { models: [...], next_cursor: string | null }
+    """
+    userid = request.args.get("userid")
+    if not userid:
+        return jsonify({"error": "userid is required"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", MODEL_PAGE_DEFAULT)), MODEL_PAGE_MAX))
+        fields = _parse_fields(request.args.get("fields"), MODEL_META_FIELDS)
+        models, next_cursor = _list_models(userid, fields, limit, request.args.get("cursor"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        print("[ERROR] /api/models failed:", e)
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"models": models, "next_cursor": next_cursor})
+
+@app.get("/api/models/<model_id>")
+def get_model(model_id):
+    """
+    Lazily load one model's bodies. Query params: userid (required), fields (optional,
+    defaults to scad_code + mesh URLs).
+    """
+    userid = request.args.get("userid")
+    if not userid:
+        return jsonify({"error": "userid is required"}), 400
+    try:
+        fields = _parse_fields(request.args.get("fields"), MODEL_BODY_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    queued = model_writes.pending(model_id)
+    if queued and queued.get("user_id") == userid and (
+            model_writes.pending_insert(model_id) or all(f in queued for f in fields)):
+        # a queued insert is the whole row: fields it does not set are empty, not in the DB
+        return jsonify({"id": model_id, **{f: queued.get(f) for f in fields}})
+
+    res = _db_execute(
+        providers.db().table("models")
+        .select(",".join(dict.fromkeys(["id", *fields])))
+        .eq("id", model_id)
+        .eq("user_id", userid)
+        .limit(1)
+    )
+    if not res.data:
+        return jsonify({"error": "model not found"}), 404
+    row = res.data[0]
+    if queued and queued.get("user_id") == userid:
+        row.update({f: queued[f] for f in fields if f in queued})
+    return jsonify(row)
+
+metrics.gauge("generation_jobs_in_flight", "Generation jobs pending or running.",
+              lambda: sum(1 for j in list(generation_jobs.values()) if j.get("status") in ("pending", "running")))
+metrics.gauge("generation_jobs_queued", "Generation jobs waiting for a worker slot (GENERATION_WORKERS).",
+              lambda: jobs.stats()["queued"])
+metrics.gauge("persistence_queue_depth", "Rows waiting in the write-behind queue.",
+              lambda: model_writes.stats()["queue_depth"])
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus text exposition of stage histograms, in-flight gauges and cache hit rates."""
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.get("/api/admin/profiles")
+def list_profiles():
+    denied = _require_admin()
+    if denied:
+        return denied
+    return jsonify({"profiles": profiler.list()})
+
+@app.get("/api/admin/artifacts")
+def artifact_stats():
+    """Artifact store usage as of the last sweep; ?sweep=1 runs one now."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    if _flag(request.args.get("sweep")):
+        return jsonify(artifacts.sweep_all(providers.db))
+    return jsonify({"generated": artifacts.generated.stats(), "uploads": artifacts.uploads.stats()})
+
+@app.get("/api/admin/pregen")
+def pregen_stats():
+    """Popular prompts and the pre-generation worker's progress."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    return jsonify(pregenerator.stats())
+
+@app.get("/api/admin/profiles/<request_id>")
+def get_profile(request_id):
+    """Collapsed stacks for one profiled request (flamegraph.pl / speedscope input)."""
+    denied = _require_admin()
+    if denied:
+        return denied
+    profile = profiler.get(request_id)
+    if profile is None:
+        return jsonify({"error": "profile not found"}), 404
+    if request.args.get("format") == "json":
+        return jsonify({**profile.summary(), "stacks": dict(profile.stacks.most_common())})
+    return profile.collapsed(), 200, {
+        "Content-Type": "text/plain; charset=utf-8",
+        "Content-Disposition": f'attachment; filename="{request_id}.collapsed"',
+    }
+
+@app.get("/api/resilience/stats")
+def resilience_stats():
+    """Circuit state, EWMA latency and in-flight calls per upstream guard."""
+    return jsonify(resilience.stats())
+
+@app.get("/api/cad/engines")
+def cad_engine_stats():
+    """Router view of each CAD engine: observed latency, success rate, availability."""
+    return jsonify({"default": cad_engines.CAD_ENGINE, "engines": cad_router.stats()})
+
+@app.get("/api/persistence/stats")
+def persistence_stats():
+    return jsonify(model_writes.stats())
+
+@app.get("/api/session")
+def get_session():
+    """Current conversation state for X-Session-Id / session_id / userid."""
+    sid = _session_id()
+    if not sid:
+        return jsonify({"error": "session_id or userid is required"}), 400
+    return jsonify({"session_id": sid, **sessions.get(sid)})
+
+@app.delete("/api/session")
+def clear_session():
+    sessions.clear(_session_id())
+    return jsonify({"success": True})
+
 @app.get("/api/generation/job/<job_id>")
 def get_generation_job(job_id):
     job = generation_jobs.get(job_id)
@@ -790,43 +1351,103 @@ def get_generation_job(job_id):
         return jsonify({"error": "job not found"}), 404
     return jsonify(job)
 
-# (Kept for compatibility)
+@app.delete("/api/generation/job/<job_id>")
+def cancel_generation_job(job_id):
+    """Cancel a pending/running job; its waiters are released and the LLM call stops at
+    its next stream chunk. A job shared with coalesced requests is only detached from
+    unless ?force=1."""
+    outcome = jobs.cancel(job_id, force=request.args.get("force") in ("1", "true"))
+    if outcome is None:
+        return jsonify({"error": "job not found"}), 404
+    return jsonify({"job_id": job_id, "result": outcome, "status": generation_jobs[job_id]["status"]})
+
+@app.post("/api/generation/batch")
+@idempotent(idempotency)
+@rate_limited(rate_limits, "generation", cost=_batch_cost)  # one token per item
+def generation_batch():
+    """
+    POST body JSON:
+      - prompts: ["a pen holder", "a phone stand"]   or
+      - prompt + variants: "a pen holder", 3          (distinct takes on one request)
+      - userid (optional, models are saved for it), session_id (optional)
+    Returns 202 { group_id, items: [{index, job_id, prompt, variant}] }; poll
+    GET /api/generation/batch/<group_id> for per-item progress.
+    """
+    items = _batch_items()
+    if not items:
+        return jsonify({"error": f"give 'prompts' (up to {BATCH_MAX_ITEMS}) or 'prompt' with 'variants' >= 1"}), 400
+    userid = _request_value("userid")
+    sid = _session_id()
+    group_id, submitted = _start_batch(items, userid, sid)
+    print(f"[BATCH] group {group_id}: {len(submitted)} item(s) for {userid or sid or 'anonymous'}")
+    return jsonify({"group_id": group_id, "items": submitted}), 202
+
+@app.get("/api/generation/batch/<group_id>")
+def generation_batch_status(group_id):
+    status = _batch_status(group_id)
+    if status is None:
+        return jsonify({"error": "batch not found"}), 404
+    return jsonify(status)
+
+@app.delete("/api/generation/batch/<group_id>")
+def cancel_generation_batch(group_id):
+    """Cancel every unfinished item of a batch (same `force` semantics as a single job)."""
+    members = jobs.group(group_id)
+    if members is None:
+        return jsonify({"error": "batch not found"}), 404
+    force = request.args.get("force") in ("1", "true")
+    results = {job_id: jobs.cancel(job_id, reason="batch cancelled by client", force=force)
+               for job_id, _ in members}
+    return jsonify({"group_id": group_id, "results": results, "status": _batch_status(group_id)["status"]})
+
+# (Kept for compatibility; same provider guards as the job routes, see resilience.py)
 @app.route("/api/claude/generate", methods=["GET"])
+@rate_limited(rate_limits, "generation")
 def generate_claude():
-    import time
-    p = currentText
+    p = sessions.transcript(_session_id())
     userid = request.form.get("userid")
     modelid = request.form.get("modelid")
-    asyncio.run(get_cad(p))
-    with open("output.scad", "r", encoding="utf-8") as f:
-        cont = f.read()
-    scad = cont.removeprefix("```openscad").removesuffix("```")
-    supabase.table("models").insert({
+    cont = resilience.guard("cad").call(providers.cad().generate, p) or ""
+    scad = strip_markdown_fences(cont)
+    _db_execute(providers.db().table("models").insert({
         "id": modelid or str(uuid4()),
         "user_id": userid,
         "name": p,
-        "created_at": time.time(),
+        "created_at": _now_iso(),
         "scad_code": scad
-    }).execute()
+    }))
     return jsonify({"success": True, "scadcode": scad})
 
 @app.route("/api/claude/edit", methods=["GET"])
+@rate_limited(rate_limits, "generation")
 def edit_claude():
-    p = currentText
+    p = sessions.transcript(_session_id())
     userid = request.form.get("userid")
     modelid = request.form.get("modelid")
-    response = supabase.table("models").select("*").eq("id", modelid).eq("user_id", userid).single().execute()
+    response = _db_execute(providers.db().table("models").select("*").eq("id", modelid).eq("user_id", userid).single())
     if response.data:
         ret = response.data
     else:
         raise RuntimeError("no file found")
     old = ret["scad_code"]
-    asyncio.run(iterate_cad(p, old))
-    with open("outputIterated.scad", "r", encoding="utf-8") as f:
-        cont = f.read()
-    scad = cont.removeprefix("```openscad").removesuffix("```")
-    supabase.table("models").update({"scad_code": scad}).eq("id", modelid).eq("user_id", userid).execute()
+    cont = resilience.guard("cad").call(providers.cad().iterate, p, old) or ""
+    scad = strip_markdown_fences(cont)
+    _db_execute(providers.db().table("models").update({"scad_code": scad}).eq("id", modelid).eq("user_id", userid))
     return jsonify({"success": True, "scadcode": scad})
 
+def _warm_status_phrases():
+    if providers.elevenlabs():
+        status_bank.start(_tts)
+
+# Build provider clients and status audio in the background rather than on the first request
+if providers.start_warmup() is not None:
+    threading.Thread(target=_warm_status_phrases, name="status-phrase-warmup", daemon=True).start()
+artifacts.start_sweeper(providers.db)  # keeps generated files / uploads within their disk budget
+pregenerator = pregen.Pregenerator(
+    popularity, warm_models, _pregenerate_model,
+    busy=lambda: any(jobs.stats()[k] for k in ("running", "queued")),
+)
+pregenerator.start()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,258 @@
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import hostlock
+import resilience
+
+# Content-addressed store for generated files, with bounded disk use.
+#
+# Files are named by the sha256 of their bytes and sharded by its first two
+# hex digits, so identical outputs are stored once:
+#
+#   generated/<ab>/<sha>.stl          meshes (Node renders, KittyCAD)   served at /files/generated/
+#   generated/debug/<ab>/<sha>.scad   SCAD that failed to render (Node)
+#   generated/index/<key>             render cache key -> relative path (Node, see server.js)
+#   uploads/<ab>/<sha>.<ext>          uploaded images (uploads.persist)
+#
+# The Node converter writes the same layout. Reading an artifact through the
+# store bumps its mtime, which the sweeper treats as "last used".
+#
+# sweep() deletes, least recently used first, artifacts that no model row
+# references until the store is under ARTIFACT_MAX_MB, plus unreferenced ones
+# older than ARTIFACT_MAX_AGE_DAYS (debug dumps: ARTIFACT_DEBUG_MAX_AGE_H).
+# Reference counts come from the stl_file_url / glb_file_url columns of
+# Supabase `models`, reading only rows that point into this store; if they
+# cannot be loaded only debug dumps are evicted. The periodic sweep runs in
+# one process per host, the one holding ARTIFACT_LOCK_PATH.
+# Anything younger than ARTIFACT_GRACE_S is kept, since a job or client may
+# still be about to save it. Files from before this layout (model_*.stl,
+# failed_*.scad, ...) are swept the same way; anything else in the
+# directories (checked-in samples) is left alone.
+
+GENERATED_DIR = os.getenv("ARTIFACT_DIR", os.path.join(os.path.dirname(__file__), "nodeserv", "public", "generated"))
+GENERATED_URL_PREFIX = "/files/generated/"
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(os.path.dirname(__file__), "uploads"))
+MAX_BYTES = int(float(os.getenv("ARTIFACT_MAX_MB", "2048")) * 1024 * 1024)
+UPLOAD_MAX_BYTES = int(float(os.getenv("UPLOAD_STORE_MAX_MB", "512")) * 1024 * 1024)
+MAX_AGE_S = float(os.getenv("ARTIFACT_MAX_AGE_DAYS", "30")) * 86400
+DEBUG_MAX_AGE_S = float(os.getenv("ARTIFACT_DEBUG_MAX_AGE_H", "24")) * 3600
+GRACE_S = float(os.getenv("ARTIFACT_GRACE_S", "3600"))
+SWEEP_INTERVAL_S = float(os.getenv("ARTIFACT_SWEEP_S", "900"))
+LOCK_PATH = os.getenv("ARTIFACT_LOCK_PATH", os.path.join(tempfile.gettempdir(), "vibecad-artifact-sweeper.lock"))
+REF_PAGE = 1000
+CHUNK = 1024 * 1024
+_SHARDED = re.compile(r"^(?:debug/)?[0-9a-f]{2}/(?:[0-9a-f]{64}\.\w+|[\w.-]+\.part)$")
+_LEGACY = re.compile(r"^(?:model|failed|kittycad|full|preview)_[\w.-]+$")
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class ArtifactStore:
+    def __init__(self, root: str, url_prefix: str | None = None, max_bytes: int = MAX_BYTES,
+                 max_age_s: float = MAX_AGE_S):
+        self.root = root
+        self.url_prefix = url_prefix
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self._lock = threading.Lock()
+        self._last_sweep = None
+
+    def relpath(self, sha: str, ext: str) -> str:
+        return f"{sha[:2]}/{sha}.{ext.lower()}"
+
+    def path(self, rel: str) -> str:
+        return os.path.join(self.root, *rel.split("/"))
+
+    def url(self, rel: str) -> str:
+        return self.url_prefix + rel
+
+    def rel_from_url(self, url: str | None) -> str | None:
+        if not url or not self.url_prefix:
+            return None
+        pos = url.find(self.url_prefix)  # absolute and relative URLs
+        return url[pos + len(self.url_prefix):].split("?", 1)[0] if pos >= 0 else None
+
+    def touch(self, rel: str) -> bool:
+        """Mark an artifact as used; False if it does not exist (e.g. evicted)."""
+        try:
+            os.utime(self.path(rel))  # recently used
+            return True
+        except FileNotFoundError:
+            return False
+
+    def put(self, data: bytes, ext: str) -> str:
+        """Store bytes; returns the relative path (shared with identical content)."""
+        rel = self.relpath(sha256_bytes(data), ext)
+        if not self.touch(rel):
+            self._write(rel, lambda out: out.write(data))
+        return rel
+
+    def put_stream(self, stream, sha: str, ext: str) -> str:
+        """Store a file object whose sha256 is already known (uploads hash while receiving)."""
+        rel = self.relpath(sha, ext)
+        if not self.touch(rel):
+            stream.seek(0)
+            self._write(rel, lambda out: shutil.copyfileobj(stream, out, CHUNK))
+        return rel
+
+    def _write(self, rel: str, fill):
+        target = self.path(rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                fill(out)
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, target)  # atomic, so readers never see a partial file
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    # ------------------------------- eviction -------------------------------
+    def _files(self):
+        for dirpath, _, names in os.walk(self.root):
+            rel_dir = os.path.relpath(dirpath, self.root).replace(os.sep, "/")
+            for name in names:
+                rel = name if rel_dir == "." else f"{rel_dir}/{name}"
+                try:
+                    st = os.stat(os.path.join(dirpath, name))
+                except FileNotFoundError:
+                    continue
+                yield rel, st.st_size, st.st_mtime
+
+    def sweep(self, refs: Counter | None = None) -> dict:
+        """Evict unreferenced artifacts by age and size. `refs`: rel path -> model rows
+        pointing at it, or None when unknown (then only debug dumps are evicted)."""
+        with self._lock:
+            now = time.time()
+            files, index = [], []
+            for rel, size, mtime in self._files():
+                if rel.startswith("index/"):
+                    index.append((rel, size, mtime))
+                elif _SHARDED.match(rel) or _LEGACY.match(rel):
+                    files.append((rel, size, mtime))
+            total = sum(size for _, size, _ in files)
+            victims = []
+            for rel, size, mtime in files:
+                age = now - mtime
+                if age < GRACE_S:
+                    continue
+                if rel.startswith("debug/") or rel.startswith("failed_") or rel.endswith(".part"):
+                    if age > DEBUG_MAX_AGE_S or rel.endswith(".part"):
+                        victims.append((rel, size))
+                elif refs is not None and not refs.get(rel) and age > self.max_age_s:
+                    victims.append((rel, size))
+            remaining = total - sum(size for _, size in victims)
+            if refs is not None and remaining > self.max_bytes:
+                chosen = {rel for rel, _ in victims}
+                lru = sorted((mtime, rel, size) for rel, size, mtime in files
+                             if rel not in chosen and not refs.get(rel) and now - mtime >= GRACE_S)
+                for _, rel, size in lru:
+                    if remaining <= self.max_bytes:
+                        break
+                    victims.append((rel, size))
+                    remaining -= size
+
+            freed = 0
+            for rel, size in victims:
+                try:
+                    os.remove(self.path(rel))
+                    freed += size
+                except FileNotFoundError:
+                    pass
+            dangling = self._drop_dangling_index(index)
+            stats = {
+                "files": len(files) - len(victims),
+                "bytes": total - freed,
+                "max_bytes": self.max_bytes,
+                "evicted": len(victims),
+                "freed_bytes": freed,
+                "dangling_index": dangling,
+                "referenced": None if refs is None else sum(1 for rel, _, _ in files if refs.get(rel)),
+                "at": now,
+            }
+            self._last_sweep = stats
+        if victims:
+            print(f"[ARTIFACTS] {self.root}: evicted {len(victims)} files, {freed} bytes")
+        return stats
+
+    def _drop_dangling_index(self, index) -> int:
+        dropped = 0
+        for rel, _, _ in index:
+            try:
+                with open(self.path(rel), encoding="utf-8") as f:
+                    target = f.read().strip()
+                if os.path.exists(self.path(target)):
+                    continue
+                os.remove(self.path(rel))
+                dropped += 1
+            except (FileNotFoundError, UnicodeDecodeError):
+                pass
+        return dropped
+
+    def stats(self) -> dict:
+        return {"root": self.root, "last_sweep": self._last_sweep}
+
+
+generated = ArtifactStore(GENERATED_DIR, GENERATED_URL_PREFIX)
+uploads = ArtifactStore(UPLOAD_DIR, max_bytes=UPLOAD_MAX_BYTES)
+
+
+def load_refs(db) -> Counter:
+    """Model rows per generated artifact, from the models rows that point into the store (paged)."""
+    refs = Counter()
+    start = 0
+    local = f"*{GENERATED_URL_PREFIX}*"
+    while True:
+        q = (db().table("models").select("id,stl_file_url,glb_file_url")
+             .or_(f"stl_file_url.like.{local},glb_file_url.like.{local}")
+             .order("id").range(start, start + REF_PAGE - 1))
+        rows = resilience.guard("supabase").call(q.execute).data or []
+        for row in rows:
+            for col in ("stl_file_url", "glb_file_url"):
+                rel = generated.rel_from_url(row.get(col))
+                if rel:
+                    refs[rel] += 1
+        if len(rows) < REF_PAGE:
+            return refs
+        start += REF_PAGE
+
+
+def sweep_all(db) -> dict:
+    try:
+        refs = load_refs(db)
+    except Exception as e:
+        print("[ARTIFACTS] model references unavailable, evicting debug dumps only:", e)
+        refs = None
+    return {"generated": generated.sweep(refs), "uploads": uploads.sweep(Counter())}
+
+
+def start_sweeper(db, interval_s: float = SWEEP_INTERVAL_S, lock_path: str = LOCK_PATH):
+    """Sweep every `interval_s` (first run right away) on a daemon thread; 0 disables.
+    Only the process holding `lock_path` sweeps."""
+    if interval_s <= 0:
+        return None
+    if not hostlock.claim(lock_path):
+        print("[ARTIFACTS] another worker process runs the sweeper")
+        return None
+
+    def loop():
+        while True:
+            try:
+                sweep_all(db)
+            except Exception as e:
+                print("[ARTIFACTS] sweep failed:", e)
+            time.sleep(interval_s)
+
+    t = threading.Thread(target=loop, name="artifact-sweeper", daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,203 @@
+import io
+import os
+import shutil
+import subprocess
+import warnings
+import wave
+from array import array
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import audioop  # C sample ops; removed from the stdlib in Python 3.13
+except ImportError:
+    audioop = None
+
+# Audio normalization before speech-to-text.
+#
+# Voice commands are one speaker, mostly silence at both ends, recorded at
+# 44.1/48 kHz (often stereo). STT only needs 16 kHz mono, so we trim leading
+# and trailing silence, downmix and resample before uploading. With ffmpeg on
+# PATH any input format is re-encoded to 16 kHz mono Opus; without it, only
+# WAV input is normalized (browser WebM recordings go out unchanged) and sent
+# as raw 16-bit PCM. That path uses audioop where the stdlib still has it;
+# the per-sample Python loops that replace it hold the GIL, so they only run
+# on recordings up to PY_FALLBACK_MAX_S. Anything we cannot process is passed
+# through unchanged.
+#
+# Uploads spooled to disk (uploads.HashingSpool) are fed to ffmpeg straight
+# from their file, so a large recording is never held in memory in full.
+
+TARGET_RATE = 16000
+SILENCE_DB = float(os.getenv("STT_SILENCE_DB", "-45"))
+KEEP_PAD_S = 0.15     # audio kept around detected speech
+MIN_SPEECH_S = 0.2    # shorter results are treated as a failed trim
+FFMPEG = shutil.which("ffmpeg")
+FFMPEG_TIMEOUT = 20
+PY_FALLBACK_MAX_S = float(os.getenv("STT_PY_FALLBACK_MAX_S", "15"))  # without ffmpeg and audioop
+
+
+def prepare(audio, filename: str | None = None, mimetype: str | None = None) -> dict:
+    """Normalize an upload for STT. `audio` is bytes or a binary file object.
+
+    Returns {"audio", "filename", "mimetype", "file_format", "bytes_in", "bytes_out"};
+    `file_format` is "pcm_s16le_16" for raw PCM output and None otherwise.
+    """
+    if isinstance(audio, (bytes, bytearray)) or not getattr(audio, "on_disk", False):
+        audio = bytes(audio if isinstance(audio, (bytes, bytearray)) else audio.read())
+        size = len(audio)
+    else:
+        audio.seek(0, os.SEEK_END)
+        size = audio.tell()
+        audio.seek(0)
+    out = {
+        "audio": audio,
+        "filename": filename or "audio.webm",
+        "mimetype": mimetype,
+        "file_format": None,
+        "bytes_in": size,
+        "bytes_out": size,
+    }
+    if not size:
+        return out
+
+    try:
+        if FFMPEG:
+            encoded = _ffmpeg_normalize(audio)
+            if encoded:
+                out.update(audio=encoded, filename="audio.ogg", mimetype="audio/ogg")
+        else:
+            data = audio if isinstance(audio, bytes) else audio.read()
+            if _is_wav(data):
+                pcm = _wav_normalize(data)
+                if pcm:
+                    out.update(audio=pcm, filename="audio.pcm", mimetype="application/octet-stream",
+                               file_format="pcm_s16le_16")
+    except Exception as e:
+        print("[AUDIO PREP] normalization failed, sending original:", e)
+
+    if isinstance(out["audio"], bytes):
+        out["bytes_out"] = len(out["audio"])
+    else:
+        out["audio"].seek(0)  # passed through as a file
+    return out
+
+
+# ------------------------------- ffmpeg -----------------------------------
+def _ffmpeg_normalize(audio) -> bytes | None:
+    """`audio` is bytes or a real file (read by ffmpeg from its descriptor)."""
+    silence = (
+        f"silenceremove=start_periods=1:start_threshold={SILENCE_DB}dB:start_silence={KEEP_PAD_S},"
+        f"areverse,"
+        f"silenceremove=start_periods=1:start_threshold={SILENCE_DB}dB:start_silence={KEEP_PAD_S},"
+        f"areverse"
+    )
+    cmd = [
+        FFMPEG, "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-af", silence,
+        "-ac", "1", "-ar", str(TARGET_RATE),
+        "-c:a", "libopus", "-b:a", "24k", "-application", "voip",
+        "-f", "ogg", "pipe:1",
+    ]
+    if isinstance(audio, bytes):
+        proc = subprocess.run(cmd, input=audio, capture_output=True, timeout=FFMPEG_TIMEOUT)
+    else:
+        audio.seek(0)
+        proc = subprocess.run(cmd, stdin=audio, capture_output=True, timeout=FFMPEG_TIMEOUT)
+    if proc.returncode != 0:
+        print("[AUDIO PREP] ffmpeg failed:", proc.stderr.decode("utf-8", "replace")[:300])
+        return None
+    # ~24 kbps Opus: anything this small is an empty (all-silence) stream
+    if len(proc.stdout) < int(MIN_SPEECH_S * 24000 / 8):
+        return None
+    return proc.stdout
+
+
+# ------------------------------ pure Python -------------------------------
+def _is_wav(data: bytes) -> bool:
+    return data[:4] == b"RIFF" and data[8:12] == b"WAVE"
+
+
+def _wav_normalize(data: bytes) -> bytes | None:
+    with wave.open(io.BytesIO(data), "rb") as w:
+        channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+        frames = w.readframes(w.getnframes())
+    if width != 2:
+        return None  # only 16-bit PCM WAV is handled without ffmpeg
+    if audioop is not None:
+        return _wav_normalize_audioop(frames, channels, rate)
+    if len(frames) / (2 * channels * rate) > PY_FALLBACK_MAX_S:
+        return None  # too long for the per-sample loops; sent as is
+
+    samples = array("h")
+    samples.frombytes(frames)
+    if channels > 1:
+        samples = _downmix(samples, channels)
+    samples = _trim_silence(samples, rate)
+    if len(samples) < MIN_SPEECH_S * rate:
+        return None
+    if rate != TARGET_RATE:
+        samples = _resample(samples, rate, TARGET_RATE)
+    return samples.tobytes()
+
+
+def _wav_normalize_audioop(frames: bytes, channels: int, rate: int) -> bytes | None:
+    if channels == 2:
+        frames = audioop.tomono(frames, 2, 0.5, 0.5)
+    elif channels > 2:
+        lanes = array("h")
+        lanes.frombytes(frames)
+        frames = lanes[::channels].tobytes()  # first channel; rarer than stereo
+    window = 2 * max(1, rate // 50)  # 20 ms, in bytes
+    threshold = 32768 * 10 ** (SILENCE_DB / 20)
+    loud = [audioop.rms(frames[i:i + window], 2) >= threshold for i in range(0, len(frames), window)]
+    if not any(loud):
+        return None
+    first = loud.index(True)
+    last = len(loud) - 1 - loud[::-1].index(True)
+    pad = 2 * int(KEEP_PAD_S * rate)
+    frames = frames[max(0, first * window - pad): min(len(frames), (last + 1) * window + pad)]
+    if len(frames) < 2 * MIN_SPEECH_S * rate:
+        return None
+    if rate != TARGET_RATE:
+        frames, _ = audioop.ratecv(frames, 2, 1, rate, TARGET_RATE, None)
+    return frames
+
+
+def _downmix(samples: array, channels: int) -> array:
+    lanes = [samples[c::channels] for c in range(channels)]
+    return array("h", (sum(v) // channels for v in zip(*lanes)))
+
+
+def _trim_silence(samples: array, rate: int) -> array:
+    window = max(1, rate // 50)  # 20 ms
+    threshold = 32768 * 10 ** (SILENCE_DB / 20)
+    loud = []
+    for start in range(0, len(samples), window):
+        chunk = samples[start:start + window]
+        rms = (sum(s * s for s in chunk) / len(chunk)) ** 0.5
+        loud.append(rms >= threshold)
+    if not any(loud):
+        return array("h")
+    first = loud.index(True)
+    last = len(loud) - 1 - loud[::-1].index(True)
+    pad = int(KEEP_PAD_S * rate)
+    return samples[max(0, first * window - pad): min(len(samples), (last + 1) * window + pad)]
+
+
+def _resample(samples: array, src: int, dst: int) -> array:
+    """Linear-interpolation resampler; plenty for speech going to STT."""
+    n_out = int(len(samples) * dst / src)
+    step = src / dst
+    last = len(samples) - 1
+    out = array("h", bytes(2 * n_out))
+    for i in range(n_out):
+        pos = i * step
+        j = int(pos)
+        if j >= last:
+            out[i] = samples[last]
+            continue
+        frac = pos - j
+        out[i] = int(samples[j] + (samples[j + 1] - samples[j]) * frac)
+    return out
@@ -0,0 +1,334 @@
+"""End-to-end latency benchmark against local stand-in backends.
+
+Runs the Flask app in-process with VIBECAD_PROVIDERS=fake (see providers.py
+and fakes.py), so no network access or API keys are needed, and drives the
+real routes concurrently through the test client.
+
+    python benchmark.py                          # every scenario, defaults
+    python benchmark.py --scenario transcribe_chain --concurrency 16 --requests 200
+    python benchmark.py --latency-scale 0.1 --json
+
+Scenarios:
+    transcribe_chain   POST /api/transcribe?chain=1 (STT -> status LLM/TTS -> CAD -> DB)
+    transcribe_async   POST /api/transcribe?chain=1&async=1, then poll the job to completion
+    iterate            POST /api/iterate against a seeded model row
+    hunyuan            POST /api/hunyuan/generate with a tiny image
+    job_poll           GET /api/generation/job/<id> on a finished job
+    fair_share         async generations by fresh users while one user floods the job queue
+                       (2 extra jobs per request); measures the light users' latency
+    cold_start         fresh interpreter: import app + first request (--cold-starts runs)
+
+Reports p50/p95/p99 latency, errors and throughput per scenario.
+"""
+import argparse
+import io
+import json
+import math
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+os.environ.setdefault("VIBECAD_PROVIDERS", "fake")
+os.environ.setdefault("ARTIFACT_SWEEP_S", "0")  # no sweeper thread (or models scan) per interpreter
+# measure the pipeline, not the per-user limiter (every request here is one user)
+os.environ.setdefault("RATE_LIMITS", "0")
+
+SCENARIOS = ("transcribe_chain", "transcribe_async", "iterate", "hunyuan", "job_poll", "fair_share",
+             "cold_start")
+USER_ID = "bench-user"
+LIGHT_USERS = 32  # fair_share: distinct users, each with a seeded model to iterate on
+POLL_INTERVAL = 0.05
+
+# 1x1 transparent PNG
+TINY_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+
+def make_wav(seconds: float = 1.5, rate: int = 44100, freq: float = 220.0, seed: int = 0) -> bytes:
+    """A stereo 16-bit tone with silence at both ends, like a short voice command."""
+    frames = bytearray()
+    total = int(seconds * rate)
+    pad = int(0.3 * rate)
+    for i in range(total):
+        v = 0
+        if pad <= i < total - pad:
+            v = int(8000 * math.sin(2 * math.pi * (freq + seed) * i / rate))
+        frames += struct.pack("<hh", v, v)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(2)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(bytes(frames))
+    return buf.getvalue()
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100.0
+    lo, hi = math.floor(k), math.ceil(k)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+# Runs in a fresh interpreter: time to import app, serve a first request, then warm providers
+COLD_START_CODE = """
+import contextlib, io, json, os, sys, time
+t0 = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    import app
+    t1 = time.perf_counter()
+    app.app.test_client().get("/api/health")
+    t2 = time.perf_counter()
+    import providers
+    providers.warm_up()
+    t3 = time.perf_counter()
+print(json.dumps({"import_s": t1 - t0, "first_request_s": t2 - t1, "warmup_s": t3 - t2}))
+"""
+
+
+def cold_start(runs: int) -> dict:
+    """Import + first-request latency of a new worker, with background warm-up off so the
+    numbers show what request handling waits for. Warm-up is timed separately afterwards."""
+    env = dict(os.environ, VIBECAD_WARMUP="0")
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples, errors = [], 0
+    started = time.perf_counter()
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-c", COLD_START_CODE], cwd=here, env=env,
+                              capture_output=True, text=True, timeout=300)
+        try:
+            samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        except (IndexError, ValueError):
+            print("[BENCH] cold start failed:", proc.stderr[-500:], file=sys.stderr)
+            errors += 1
+    wall = time.perf_counter() - started
+
+    ms = lambda v: None if v is None else round(v * 1000, 1)
+    total = [s["import_s"] + s["first_request_s"] for s in samples]
+    return {
+        "scenario": "cold_start",
+        "requests": runs,
+        "concurrency": 1,
+        "errors": errors,
+        "p50_ms": ms(percentile(total, 50)),
+        "p95_ms": ms(percentile(total, 95)),
+        "p99_ms": ms(percentile(total, 99)),
+        "max_ms": ms(max(total) if total else None),
+        "throughput_rps": round(runs / wall, 2) if wall else None,
+        "wall_s": round(wall, 2),
+        "import_p50_ms": ms(percentile([s["import_s"] for s in samples], 50)),
+        "first_request_p50_ms": ms(percentile([s["first_request_s"] for s in samples], 50)),
+        "warmup_p50_ms": ms(percentile([s["warmup_s"] for s in samples], 50)),
+    }
+
+
+class Bench:
+    def __init__(self, app_module):
+        self.app = app_module
+        self.client = app_module.app.test_client()
+        # A handful of distinct recordings so coalescing doesn't collapse every request
+        self.wavs = [make_wav(seed=i) for i in range(8)]
+        self._lock = threading.Lock()
+        self._counter = 0
+
+    def _next(self) -> int:
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def _audio(self, n: int):
+        return (io.BytesIO(self.wavs[n % len(self.wavs)]), "audio.wav", "audio/wav")
+
+    # ------------------------------------------------------------ scenarios
+    def transcribe_chain(self):
+        n = self._next()
+        r = self.client.post(
+            f"/api/transcribe?chain=1&userid={USER_ID}&modelid={self.seed_model_id}&session_id=bench-{n}",
+            data={"file": self._audio(n)},
+            content_type="multipart/form-data",
+        )
+        return r.status_code < 400
+
+    def transcribe_async(self):
+        n = self._next()
+        r = self.client.post(
+            f"/api/transcribe?chain=1&async=1&userid={USER_ID}&modelid={self.seed_model_id}"
+            f"&session_id=bench-{n}",
+            data={"file": self._audio(n)},
+            content_type="multipart/form-data",
+        )
+        if r.status_code >= 400:
+            return False
+        job_id = (r.get_json() or {}).get("job_id")
+        if not job_id:
+            return True  # no generation intent detected; the transcript alone was the answer
+        return self._poll(job_id)
+
+    def iterate(self):
+        n = self._next()
+        r = self.client.post("/api/iterate", json={
+            "prompt": f"make the base wider by {n} mm",
+            "userid": USER_ID,
+            "modelid": self.seed_model_id,
+        })
+        return r.status_code < 400
+
+    def hunyuan(self):
+        r = self.client.post(
+            "/api/hunyuan/generate",
+            data={"image": (io.BytesIO(TINY_PNG), "tiny.png", "image/png"), "userid": USER_ID},
+            content_type="multipart/form-data",
+        )
+        return r.status_code < 400
+
+    def job_poll(self):
+        r = self.client.get(f"/api/generation/job/{self.finished_job_id}")
+        return r.status_code == 200
+
+    def fair_share(self):
+        n = self._next()
+        for i in range(2):
+            self.app._start_generation_job("generate", f"flood part {n}-{i}", "bench-hog", None)
+        r = self.client.post(
+            f"/api/transcribe?chain=1&async=1&userid=bench-light-{n % LIGHT_USERS}"
+            f"&modelid={self.light_models[n % LIGHT_USERS]}&session_id=bench-light-{n}",
+            data={"file": self._audio(n)},
+            content_type="multipart/form-data",
+        )
+        if r.status_code >= 400:
+            return False
+        job_id = (r.get_json() or {}).get("job_id")
+        return self._poll(job_id) if job_id else True
+
+    def _poll(self, job_id: str, timeout: float = 120.0) -> bool:
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = self.client.get(f"/api/generation/job/{job_id}").get_json() or {}
+            if job.get("status") == "done":
+                return True
+            if job.get("status") == "error":
+                return False
+            time.sleep(POLL_INTERVAL)
+        return False
+
+    # ---------------------------------------------------------------- setup
+    def setup(self):
+        import providers
+        self.seed_model_id = str(uuid4())
+        providers.db().table("models").insert({
+            "id": self.seed_model_id,
+            "user_id": USER_ID,
+            "scad_code": "cube([10, 10, 10]);",
+            "prompt": "a cube",
+            "created_at": self.app._now_iso(),
+        }).execute()
+        self.light_models = []
+        for i in range(LIGHT_USERS):
+            mid = str(uuid4())
+            providers.db().table("models").insert({
+                "id": mid, "user_id": f"bench-light-{i}", "scad_code": "cube([10, 10, 10]);",
+                "prompt": "a cube", "created_at": self.app._now_iso(),
+            }).execute()
+            self.light_models.append(mid)
+        job_id, _ = self.app._start_generation_job("generate", "a warm-up cube", USER_ID, None)
+        self.app.jobs.wait(job_id, timeout=120)
+        self.finished_job_id = job_id
+
+    def run(self, scenario: str, concurrency: int, requests: int) -> dict:
+        fn = getattr(self, scenario)
+        latencies, errors = [], 0
+        lat_lock = threading.Lock()
+
+        def one(_):
+            nonlocal errors
+            t0 = time.perf_counter()
+            try:
+                ok = fn()
+            except Exception as e:
+                print(f"[BENCH] {scenario} request failed:", e, file=sys.stderr)
+                ok = False
+            dt = time.perf_counter() - t0
+            with lat_lock:
+                latencies.append(dt)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - started
+
+        ms = lambda v: None if v is None else round(v * 1000, 1)
+        return {
+            "scenario": scenario,
+            "requests": requests,
+            "concurrency": concurrency,
+            "errors": errors,
+            "p50_ms": ms(percentile(latencies, 50)),
+            "p95_ms": ms(percentile(latencies, 95)),
+            "p99_ms": ms(percentile(latencies, 99)),
+            "max_ms": ms(max(latencies) if latencies else None),
+            "throughput_rps": round(requests / wall, 2) if wall else None,
+            "wall_s": round(wall, 2),
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="VibeCAD backend latency benchmark (fake providers)")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="scenario to run (repeatable; default: all)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=50, help="requests per scenario")
+    parser.add_argument("--latency-scale", type=float, default=None,
+                        help="multiply every fake upstream latency (sets FAKE_LATENCY_SCALE)")
+    parser.add_argument("--cold-starts", type=int, default=3, help="fresh interpreters for cold_start")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.latency_scale is not None:
+        os.environ["FAKE_LATENCY_SCALE"] = str(args.latency_scale)
+
+    import contextlib
+    scenarios = args.scenario or SCENARIOS
+    results = []
+    if "cold_start" in scenarios:
+        # before this process imports app, so nothing is cached in it either way
+        results.append(cold_start(args.cold_starts))
+
+    in_process = [s for s in scenarios if s != "cold_start"]
+    if in_process:
+        # The routes print a lot; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app as app_module
+            bench = Bench(app_module)
+            bench.setup()
+    for scenario in in_process:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results.append(bench.run(scenario, args.concurrency, args.requests))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    header = f"{'scenario':<18}{'reqs':>6}{'conc':>6}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rps':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['scenario']:<18}{r['requests']:>6}{r['concurrency']:>6}{r['errors']:>5}"
+              f"{r['p50_ms']!s:>10}{r['p95_ms']!s:>10}{r['p99_ms']!s:>10}{r['throughput_rps']!s:>9}")
+        if r["scenario"] == "cold_start":
+            print(f"{'':<18}import {r['import_p50_ms']} ms, first request {r['first_request_p50_ms']} ms, "
+                  f"warm-up {r['warmup_p50_ms']} ms (p50)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import base64
+import os
+import random
+import threading
+import time
+
+import artifacts
+import cancellation
+import providers
+import resilience
+from metrics import metrics, span
+
+# CAD engines and the router that picks one per request.
+#
+#   scad      Claude -> OpenSCAD (providers.cad(), i.e. fin.get_cad)       text  -> SCAD code
+#   kittycad  KittyCAD/Zoo text-to-CAD, polled until the STL is ready      text  -> STL file
+#   hunyuan   Hunyuan3D-2 on Gradio, submitted and polled                  image -> GLB URL
+#
+# Every engine runs under its resilience guard and uses the provider's shared
+# client (providers.py), so connections are pooled across requests. Remote
+# jobs are polled with exponential backoff and the polling wakes up on job
+# cancellation.
+#
+# EngineRouter.run(kind, request, preferred) runs the named engine only, or
+# for preferred="auto" ranks every available engine for that input kind by
+# expected latency / success rate (EWMAs of its own runs, seeded with
+# `typical_s`) and fails over down the list. A small CAD_ROUTER_EXPLORE share
+# of auto requests tries a non-best engine first so its numbers stay fresh.
+#
+# Mesh outputs go to the content-addressed artifact store (artifacts.py),
+# which the converter serves at /files/generated/.
+
+CAD_ENGINE = os.getenv("CAD_ENGINE", "scad").strip().lower()  # default for text requests
+EXPLORE = float(os.getenv("CAD_ROUTER_EXPLORE", "0.05"))
+EWMA_ALPHA = 0.3
+HUNYUAN_SPACE_URL = "https://tencent-hunyuan3d-2.hf.space"
+
+
+def poll(fetch, is_done, provider: str, timeout_s: float, first_s: float = 1.0, max_s: float = 8.0):
+    """fetch() until is_done(state), sleeping first_s, 1.5x longer each round up to max_s."""
+    deadline = time.monotonic() + timeout_s
+    delay = first_s
+    while True:
+        state = fetch()
+        if is_done(state):
+            return state
+        if time.monotonic() + delay > deadline:
+            raise resilience.ProviderTimeout(provider, f"job not finished after {timeout_s:g}s")
+        cancellation.sleep(delay)
+        delay = min(max_s, delay * 1.5)
+
+
+def save_mesh(data: bytes, fmt: str) -> str:
+    """Store a generated mesh where the converter serves it; returns its URL."""
+    return artifacts.generated.url(artifacts.generated.put(data, fmt))
+
+
+class Engine:
+    name = ""
+    inputs = ("text",)
+    output = "scad"       # "scad" -> {"scad_code"}, "mesh" -> {"mesh_url", "mesh_format"}
+    typical_s = 60.0      # latency prior until the router has measured the engine
+
+    def available(self) -> bool:
+        return True
+
+    def generate(self, request: dict) -> dict:
+        raise NotImplementedError
+
+
+class ScadEngine(Engine):
+    name = "scad"
+
+    def generate(self, request: dict) -> dict:
+        cad = providers.cad()
+        if request.get("variant"):
+            raw = resilience.guard("cad").call(cad.generate, request["prompt"], request["variant"])
+        else:
+            raw = resilience.guard("cad").call(cad.generate, request["prompt"])
+        return {"scad_code": raw}
+
+
+class KittyCadEngine(Engine):
+    name = "kittycad"
+    output = "mesh"
+    typical_s = 90.0
+
+    def available(self) -> bool:
+        return providers.kittycad() is not None
+
+    def generate(self, request: dict) -> dict:
+        client = providers.kittycad()
+        g = resilience.guard("kittycad")
+        return g.call(self._run, client, request["prompt"], g.timeout)
+
+    def _run(self, client, prompt: str, timeout_s: float) -> dict:
+        try:
+            from kittycad.models.file_export_format import FileExportFormat
+            from kittycad.models.text_to_cad_create_body import TextToCadCreateBody
+            fmt, body = FileExportFormat.STL, TextToCadCreateBody(project_name="vibecad", prompt=prompt)
+        except ImportError:  # only the fake client (fakes.py) runs without the SDK
+            fmt, body = "stl", {"project_name": "vibecad", "prompt": prompt}
+        with span("kittycad_generate"):
+            job = client.ml.create_text_to_cad(output_format=fmt, kcl=False, body=body)
+            fetch = self._fetcher(client, job.id)
+            job = poll(fetch, lambda j: _status(j) in ("completed", "failed"), "kittycad", timeout_s)
+        if _status(job) == "failed":
+            raise RuntimeError(f"text-to-cad failed: {getattr(job, 'error', None) or 'no detail'}")
+        outputs = getattr(job, "outputs", None) or {}
+        stl = next((v for k, v in outputs.items() if str(k).endswith(".stl")), None)
+        if stl is None:
+            raise RuntimeError("text-to-cad finished without an STL output")
+        return {"mesh_url": save_mesh(_decode(stl), "stl"), "mesh_format": "stl"}
+
+    @staticmethod
+    def _fetcher(client, job_id):
+        # the polling call was renamed across SDK releases
+        for name in ("get_text_to_cad_part_for_user", "get_text_to_cad_model_for_user"):
+            fn = getattr(client.ml, name, None)
+            if fn is not None:
+                return lambda: fn(id=job_id)
+        return lambda: client.api_calls.get_async_operation(id=job_id)
+
+
+def _status(job) -> str:
+    status = getattr(job, "status", None)
+    return str(getattr(status, "value", status) or "").lower().rsplit(".", 1)[-1]
+
+
+def _decode(data) -> bytes:
+    if hasattr(data, "get_decoded"):
+        return data.get_decoded()
+    if isinstance(data, (bytes, bytearray)):
+        return bytes(data)
+    return base64.b64decode(data)
+
+
+class HunyuanEngine(Engine):
+    name = "hunyuan"
+    inputs = ("image",)
+    output = "mesh"
+    typical_s = 120.0
+
+    def generate(self, request: dict) -> dict:
+        g = resilience.guard("hunyuan")
+        return g.call(self._run, providers.hunyuan(), request, g.timeout)
+
+    def _run(self, client, request: dict, timeout_s: float) -> dict:
+        from gradio_client import handle_file
+        images = request["images"]
+        main = images["image"]
+        views = {k: handle_file(images.get(k, main))
+                 for k in ("mv_image_front", "mv_image_back", "mv_image_left", "mv_image_right")}
+        with span("gradio_predict"):
+            job = client.submit(caption=request.get("caption"), image=handle_file(main), **views,
+                                **request.get("options", {}), api_name="/shape_generation")
+            try:
+                poll(lambda: job, lambda j: j.done(), "hunyuan", timeout_s, first_s=2.0)
+            except (cancellation.Cancelled, resilience.ProviderTimeout):
+                job.cancel()
+                raise
+            result = job.result()
+        return {"mesh_url": _gradio_url(result), "mesh_format": "glb", "result": result}
+
+
+def _gradio_url(result) -> str | None:
+    first = result[0] if isinstance(result, (list, tuple)) and result else result
+    url = first.get("value") if isinstance(first, dict) else first
+    if url and not isinstance(url, str):
+        url = str(url)
+    if url and url.startswith("/tmp/gradio/"):
+        url = f"{HUNYUAN_SPACE_URL}/file={url}"
+    return url
+
+
+class EngineRouter:
+    def __init__(self, engines: list[Engine], explore: float = EXPLORE):
+        self.engines = {e.name: e for e in engines}
+        self.explore = explore
+        self._stats = {e.name: {"latency_s": None, "success": 1.0, "runs": 0, "failures": 0}
+                       for e in engines}
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+
+    def _expected_cost(self, name: str) -> float:
+        s = self._stats[name]
+        latency = s["latency_s"] if s["latency_s"] is not None else self.engines[name].typical_s
+        return latency / max(s["success"], 0.05)
+
+    def candidates(self, kind: str, preferred: str | None = None) -> list[Engine]:
+        """Engines to try in order: just `preferred` when it names one, else ranked."""
+        if preferred and preferred != "auto":
+            engine = self.engines.get(preferred)
+            if engine is None or kind not in engine.inputs:
+                raise ValueError(f"unknown {kind} engine: {preferred}")
+            return [engine]
+        usable = [e for e in self.engines.values()
+                  if kind in e.inputs and e.available() and resilience.guard(self._guard(e)).available()]
+        with self._lock:
+            usable.sort(key=lambda e: self._expected_cost(e.name))
+            if len(usable) > 1 and self._rng.random() < self.explore:
+                usable.insert(0, usable.pop(self._rng.randrange(1, len(usable))))
+        return usable
+
+    @staticmethod
+    def _guard(engine: Engine) -> str:
+        return "cad" if engine.name == "scad" else engine.name
+
+    def run(self, kind: str, request: dict, preferred: str | None = None) -> tuple[str, dict]:
+        """(engine name, result) from the first engine that succeeds."""
+        engines = self.candidates(kind, preferred)
+        if not engines:
+            raise resilience.ProviderUnavailable(f"{kind}-to-cad", "no engine available")
+        errors = []
+        for engine in engines:
+            started = time.perf_counter()
+            try:
+                result = engine.generate(request)
+            except cancellation.Cancelled:
+                raise
+            except Exception as e:
+                self._record(engine.name, None)
+                if len(engines) == 1:
+                    raise
+                print(f"[ENGINES] {engine.name} failed, trying next:", e)
+                errors.append(f"{engine.name}: {e}")
+                continue
+            self._record(engine.name, time.perf_counter() - started)
+            return engine.name, result
+        raise resilience.ProviderUnavailable("+".join(e.name for e in engines), "; ".join(errors))
+
+    def _record(self, name: str, elapsed: float | None):
+        ok = elapsed is not None
+        metrics.count("cad_engine_runs", "CAD engine runs by engine and outcome.",
+                      engine=name, outcome="ok" if ok else "error")
+        with self._lock:
+            s = self._stats[name]
+            s["runs"] += 1
+            s["success"] += EWMA_ALPHA * ((1.0 if ok else 0.0) - s["success"])
+            if ok:
+                s["latency_s"] = elapsed if s["latency_s"] is None else \
+                    s["latency_s"] + EWMA_ALPHA * (elapsed - s["latency_s"])
+            else:
+                s["failures"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {name: {**s, "inputs": list(self.engines[name].inputs),
+                           "output": self.engines[name].output,
+                           "available": self.engines[name].available(),
+                           "expected_cost_s": round(self._expected_cost(name), 2)}
+                    for name, s in self._stats.items()}
+
+
+def default_router() -> EngineRouter:
+    return EngineRouter([ScadEngine(), KittyCadEngine(), HunyuanEngine()])
@@ -0,0 +1,120 @@
+import contextvars
+import threading
+import time
+
+# Cooperative cancellation for generation jobs.
+#
+# Each job runs with a CancelToken in context (jobs.py). Anything on the job's
+# path -- resilience guards, stream readers, LLM tool callbacks, fakes -- calls
+# `check()` between steps or waits on the token instead of sleeping, so a
+# DELETE /api/generation/job/<id> or a passed deadline stops the work at the
+# next chunk. Guards also cancel in-flight coroutines on their event loop via
+# `on_cancel`. Context is copied into guard threads, so the token follows the
+# job everywhere a contextvar does.
+
+
+class Cancelled(Exception):
+    """The job this code runs for was cancelled or ran past its deadline."""
+
+
+class CancelToken:
+    def __init__(self, deadline_s: float | None = None):
+        self.deadline_at = time.time() + deadline_s if deadline_s else None
+        self.reason = None
+        self._event = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._timer = None
+        if deadline_s:
+            self._timer = threading.Timer(deadline_s, self.cancel, args=("deadline exceeded",))
+            self._timer.daemon = True
+            self._timer.start()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """Returns False if the token was already cancelled."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        if self._timer is not None:
+            self._timer.cancel()
+        for fn in callbacks:
+            try:
+                fn()
+            except Exception as e:
+                print("[CANCEL] callback failed:", e)
+        return True
+
+    def close(self):
+        """Job finished normally: stop the deadline timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+
+    def on_cancel(self, fn):
+        """Run fn() once on cancellation (immediately if already cancelled). Returns an
+        unregister function."""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return lambda: self._discard(fn)
+        fn()
+        return lambda: None
+
+    def _discard(self, fn):
+        with self._lock:
+            if fn in self._callbacks:
+                self._callbacks.remove(fn)
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled(self.reason)
+
+    def wait(self, timeout: float | None) -> bool:
+        """Sleep up to timeout; True if cancelled meanwhile."""
+        return self._event.wait(timeout)
+
+
+_current = contextvars.ContextVar("cancel_token", default=None)
+
+
+def current() -> CancelToken | None:
+    return _current.get()
+
+
+def bind(token: CancelToken | None):
+    _current.set(token)
+
+
+def check():
+    """Raise Cancelled if the current job has been cancelled."""
+    token = _current.get()
+    if token is not None:
+        token.check()
+
+
+def sleep(seconds: float):
+    """time.sleep that wakes up (and raises Cancelled) when the current job is cancelled."""
+    token = _current.get()
+    if token is None:
+        time.sleep(seconds)
+    elif token.wait(seconds):
+        token.check()
+
+
+def iterate(chunks):
+    """Yield from a stream, stopping at the next chunk once the current job is cancelled.
+    Closing the generator closes the underlying stream/connection."""
+    try:
+        for chunk in chunks:
+            check()
+            yield chunk
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
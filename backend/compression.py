@@ -0,0 +1,77 @@
+import gzip
+import os
+
+from metrics import span
+
+# Content-Encoding negotiation for JSON responses.
+#
+# Responses of at least COMPRESS_MIN_BYTES are compressed with brotli when the
+# client accepts it and the optional `brotli` package is installed, else gzip.
+# Levels favour speed: these bodies are built per request, never cached
+# compressed. COMPRESS_RESPONSES=0 turns it off (e.g. behind a proxy that
+# compresses already).
+
+ENABLED = os.getenv("COMPRESS_RESPONSES", "1").lower() not in ("0", "false", "no")
+MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+COMPRESSIBLE = ("application/json", "text/plain")
+
+try:
+    import brotli  # optional: pip install brotli
+except ImportError:
+    brotli = None
+
+
+def _accepted(header: str) -> dict:
+    """Accept-Encoding -> {coding: q}."""
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding.lower()] = q
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> str | None:
+    accepted = _accepted(accept_encoding)
+    wildcard = accepted.get("*", 0.0)
+    for coding in (("br",) if brotli is not None else ()) + ("gzip",):
+        if accepted.get(coding, wildcard) > 0:
+            return coding
+    return None
+
+
+def compress_response(resp, accept_encoding: str):
+    """Compress a Flask response in place when worthwhile; returns it."""
+    if not ENABLED or resp.direct_passthrough or resp.is_streamed:
+        return resp
+    if resp.status_code < 200 or resp.status_code in (204, 304) or "Content-Encoding" in resp.headers:
+        return resp
+    if resp.mimetype not in COMPRESSIBLE:
+        return resp
+    resp.vary.add("Accept-Encoding")
+    body = resp.get_data()
+    if len(body) < MIN_BYTES:
+        return resp
+    coding = choose_encoding(accept_encoding)
+    if coding is None:
+        return resp
+    with span("compress"):
+        if coding == "br":
+            packed = brotli.compress(body, quality=BROTLI_QUALITY)
+        else:
+            packed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    resp.set_data(packed)
+    resp.headers["Content-Encoding"] = coding
+    resp.headers["X-Uncompressed-Length"] = str(len(body))
+    return resp
@@ -0,0 +1,340 @@
+import asyncio
+import hashlib
+import os
+import random
+import struct
+import threading
+import time
+from types import SimpleNamespace
+from uuid import uuid4
+
+import artifacts
+import cancellation
+import providers
+from metrics import span
+
+# Deterministic local stand-ins for the upstream services (see providers.py).
+#
+# Each fake sleeps for a configurable latency with jitter so the backend can
+# be benchmarked offline:
+#
+#   FAKE_LATENCY_SCALE        multiplies every base latency (0 = no sleeping)
+#   FAKE_LATENCY_<NAME>_MS    base latency per call, NAME in
+#                             STT, TTS, LLM, CAD, DB, HUNYUAN, KITTYCAD, RENDER
+#   FAKE_JITTER               +/- fraction of the base latency (default 0.2)
+#   FAKE_SEED                 seed for the jitter RNG (default 1234)
+#   FAKE_FAIL_<NAME>          fraction of calls that fail after sleeping (default 0),
+#                             to exercise the circuit breakers in resilience.py
+#                             (RENDER: the SCAD fails to compile instead)
+
+BASE_LATENCY_MS = {
+    "STT": 400,
+    "TTS": 300,
+    "LLM": 800,
+    "CAD": 3000,
+    "DB": 40,
+    "HUNYUAN": 5000,
+    "KITTYCAD": 4000,
+    "RENDER": 1500,
+}
+
+FAKE_PROMPTS = [
+    "make a traffic cone with two white stripes",
+    "a pen holder that clips onto a desk",
+    "a phone stand with a charging slot",
+    "a gear with twenty teeth",
+    "re iterate and make the base wider",
+]
+
+_rng = random.Random(int(os.getenv("FAKE_SEED", "1234")))
+_rng_lock = threading.Lock()
+
+
+def latency_s(kind: str) -> float:
+    scale = float(os.getenv("FAKE_LATENCY_SCALE", "1"))
+    base = float(os.getenv(f"FAKE_LATENCY_{kind}_MS", BASE_LATENCY_MS[kind])) / 1000.0
+    jitter = float(os.getenv("FAKE_JITTER", "0.2"))
+    with _rng_lock:
+        factor = 1.0 + _rng.uniform(-jitter, jitter)
+    return max(0.0, base * factor * scale)
+
+
+def _sleep(kind: str):
+    cancellation.sleep(latency_s(kind))
+    _maybe_fail(kind)
+
+
+def _maybe_fail(kind: str):
+    fail_rate = float(os.getenv(f"FAKE_FAIL_{kind}", "0"))
+    if fail_rate:
+        with _rng_lock:
+            failed = _rng.random() < fail_rate
+        if failed:
+            raise RuntimeError(f"fake {kind.lower()} failure")
+
+
+# ------------------------------- ElevenLabs -------------------------------
+class _FakeTranscript:
+    def __init__(self, text: str):
+        self.text = text
+        self.utterances = None
+        self.language_code = "eng"
+
+    def model_dump(self):
+        return {"text": self.text, "language_code": self.language_code, "words": []}
+
+
+class _FakeSTT:
+    def convert(self, file=None, **kwargs):
+        data = file
+        if isinstance(file, tuple):
+            data = file[1]
+        if hasattr(data, "read"):
+            data = data.read()
+        _sleep("STT")
+        override = os.getenv("FAKE_TRANSCRIPT")
+        if override:
+            return _FakeTranscript(override)
+        # Same audio -> same transcript, so coalescing/caching behave like production
+        digest = hashlib.sha256(bytes(data or b"")).digest()
+        return _FakeTranscript(FAKE_PROMPTS[digest[0] % len(FAKE_PROMPTS)])
+
+
+class _FakeTTS:
+    def convert(self, text: str = "", **kwargs):
+        _sleep("TTS")
+        # ~1 KB of "mp3" per word, roughly what mp3_44100_128 produces
+        return b"\xff\xfb\x90\x00" * (256 * max(1, len(text.split())))
+
+
+class FakeElevenLabs:
+    def __init__(self):
+        self.speech_to_text = _FakeSTT()
+        self.text_to_speech = _FakeTTS()
+
+
+# -------------------------------- Dedalus ---------------------------------
+class FakeDedalusRunner:
+    async def run(self, input=None, **kwargs):
+        await asyncio.sleep(latency_s("LLM"))
+        _maybe_fail("LLM")
+        return SimpleNamespace(final_output="Generating your CAD model now.")
+
+
+# ---------------------------------- CAD -----------------------------------
+class FakeCad:
+    """Splits its latency like the real pipeline: ~30% orchestrator prompt building,
+    the rest code generation."""
+
+    def _run(self):
+        total = latency_s("CAD")
+        # wakes up early when the job is cancelled, like the real stream readers
+        with span("prompt_build"):
+            cancellation.sleep(total * 0.3)
+        providers.prefix_ready()
+        with span("llm_generate"):
+            cancellation.sleep(total * 0.7)
+        _maybe_fail("CAD")
+
+    def generate(self, prompt: str, variant: str | None = None) -> str:
+        self._run()
+        note = f"// {variant}\n" if variant else ""
+        return (
+            "```openscad\n"
+            f"// {prompt}\n"
+            f"{note}"
+            "use <MCAD/boxes.scad>\n"
+            "$fn = 64;\n"
+            "roundedBox([20, 12, 6], 2, true);\n"
+            "translate([0, 0, 3]) cylinder(h = 10, r = 4);\n"
+            "```"
+        )
+
+    def iterate(self, prompt: str, old_scad: str) -> str:
+        self._run()
+        return f"// iteration: {prompt}\n{old_scad}"
+
+
+# -------------------------------- Supabase --------------------------------
+class _FakeQuery:
+    def __init__(self, store, table):
+        self._store = store
+        self._table = table
+        self._op = "select"
+        self._payload = None
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._offset = 0
+        self._single = False
+        self._columns = None
+
+    def select(self, columns="*"):
+        self._op = "select"
+        self._columns = None if columns == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, rows):
+        self._op, self._payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict="id", **kwargs):
+        self._op, self._payload = "upsert", rows
+        return self
+
+    def update(self, fields):
+        self._op, self._payload = "update", fields
+        return self
+
+    def delete(self):
+        self._op = "delete"
+        return self
+
+    def eq(self, col, value):
+        self._filters.append(lambda r: str(r.get(col)) == str(value))
+        return self
+
+    def or_(self, expr):
+        # Keyset filters are not interpreted; the fake just pages from the start.
+        return self
+
+    def order(self, col, desc=False):
+        self._order.append((col, desc))
+        return self
+
+    def limit(self, n):
+        self._limit = n
+        return self
+
+    def range(self, start, end):
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def execute(self):
+        _sleep("DB")
+        with self._store.lock:
+            rows = self._store.tables.setdefault(self._table, {})
+            if self._op in ("insert", "upsert"):
+                payload = self._payload if isinstance(self._payload, list) else [self._payload]
+                for row in payload:
+                    row = dict(row)
+                    row.setdefault("id", str(uuid4()))
+                    if self._op == "insert" and row["id"] in rows:
+                        raise RuntimeError(f"duplicate key value violates unique constraint ({row['id']})")
+                    rows.setdefault(row["id"], {}).update(row)
+                return SimpleNamespace(data=payload)
+            matched = [r for r in rows.values() if all(f(r) for f in self._filters)]
+            if self._op == "update":
+                for r in matched:
+                    r.update(self._payload)
+                return SimpleNamespace(data=matched)
+            if self._op == "delete":
+                for r in matched:
+                    rows.pop(r.get("id"), None)
+                return SimpleNamespace(data=matched)
+            for col, desc in reversed(self._order):
+                matched.sort(key=lambda r: str(r.get(col) or ""), reverse=desc)
+            if self._limit is not None:
+                matched = matched[self._offset: self._offset + self._limit]
+            if self._columns:
+                matched = [{c: r.get(c) for c in self._columns} for r in matched]
+            else:
+                matched = [dict(r) for r in matched]
+        if self._single:
+            return SimpleNamespace(data=matched[0] if matched else None)
+        return SimpleNamespace(data=matched)
+
+
+class FakeSupabase:
+    def __init__(self):
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def table(self, name):
+        return _FakeQuery(self, name)
+
+
+# --------------------------------- Hunyuan --------------------------------
+def _mesh_result():
+    return [{"__type__": "file", "value": f"/tmp/gradio/{uuid4().hex}/white_mesh.glb"}]
+
+
+class _FakeGradioJob:
+    """gradio_client.Job look-alike that finishes after the fake latency."""
+
+    def __init__(self):
+        self._ready_at = time.monotonic() + latency_s("HUNYUAN")
+        self._cancelled = False
+
+    def done(self) -> bool:
+        return self._cancelled or time.monotonic() >= self._ready_at
+
+    def cancel(self) -> bool:
+        self._cancelled = True
+        return True
+
+    def result(self):
+        cancellation.sleep(max(0.0, self._ready_at - time.monotonic()))
+        _maybe_fail("HUNYUAN")
+        return _mesh_result()
+
+
+class FakeGradioClient:
+    def predict(self, **kwargs):
+        _sleep("HUNYUAN")
+        return _mesh_result()
+
+    def submit(self, *args, **kwargs):
+        return _FakeGradioJob()
+
+
+# -------------------------------- KittyCAD --------------------------------
+def _cube_stl(size: float = 20.0) -> bytes:
+    """Binary STL of an axis-aligned cube."""
+    s = size
+    corners = [(x, y, z) for x in (0, s) for y in (0, s) for z in (0, s)]
+    faces = [(0, 1, 3, 2), (4, 6, 7, 5), (0, 4, 5, 1), (2, 3, 7, 6), (0, 2, 6, 4), (1, 5, 7, 3)]
+    tris = [(a, b, c) for q in faces for a, b, c in ((q[0], q[1], q[2]), (q[0], q[2], q[3]))]
+    body = b"".join(struct.pack("<12fH", 0, 0, 0, *corners[a], *corners[b], *corners[c], 0)
+                    for a, b, c in tris)
+    return b"\0" * 80 + struct.pack("<I", len(tris)) + body
+
+
+class _FakeML:
+    def __init__(self):
+        self._jobs = {}
+
+    def create_text_to_cad(self, output_format=None, kcl=False, body=None):
+        job_id = str(uuid4())
+        self._jobs[job_id] = time.monotonic() + latency_s("KITTYCAD")
+        return SimpleNamespace(id=job_id, status="queued", outputs=None, error=None)
+
+    def get_text_to_cad_part_for_user(self, id=None):
+        if time.monotonic() < self._jobs[id]:
+            return SimpleNamespace(id=id, status="in_progress", outputs=None, error=None)
+        _maybe_fail("KITTYCAD")
+        return SimpleNamespace(id=id, status="completed", outputs={"source.stl": _cube_stl()}, error=None)
+
+
+class FakeKittyCAD:
+    def __init__(self):
+        self.ml = _FakeML()
+
+
+# -------------------------------- Converter -------------------------------
+class FakeConverter:
+    """Renders any SCAD to the same cube, stored like the Node converter stores it."""
+
+    def render(self, scad: str, quality: str = "full") -> dict:
+        cancellation.sleep(latency_s("RENDER"))
+        try:
+            _maybe_fail("RENDER")
+        except RuntimeError:
+            return {"ok": False, "error": "OpenSCAD compilation error code: 1"}
+        stl = _cube_stl()
+        return {"ok": True, "url": artifacts.generated.url(artifacts.generated.put(stl, "stl")),
+                "bytes": len(stl), "quality": quality}
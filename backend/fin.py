@@ -1,98 +1,176 @@
 from dotenv import load_dotenv
 import asyncio
 from dedalus_labs import AsyncDedalus, DedalusRunner, Dedalus
-from prompts import mkprompt
+from prompts import mkprompt, directprompt, GET_CAD_INSTRUCTIONS, GEN_CAD_SYSTEM, cached_system, strip_markdown_fences
 import os
 import anthropic
+from metrics import metrics, span
+import resilience
+import cancellation
 from flask import Flask, jsonify
+import contextvars
+import re
 import threading
+import time
+import providers
 
 load_dotenv()
 
-client2 = anthropic.Anthropic(api_key=os.getenv("CLAUDE_API_KEY"))
+# Generation pipelines:
+#   orchestrated  Dedalus runner (two models, MCP search tools) writes a prompt via mkprompt,
+#                 then calls gen_cad -- several serial LLM hops, best for hard requests
+#   direct        prompt built locally, one streaming Anthropic call (gen_cad_direct)
+#   auto          direct unless the request looks complex (see choose_pipeline)
+CAD_PIPELINE = os.getenv("CAD_PIPELINE", "auto").strip().lower()
+CAD_DIRECT_MODEL = os.getenv("CAD_DIRECT_MODEL", "claude-sonnet-4-5")
+CAD_DIRECT_MAX_SCORE = float(os.getenv("CAD_DIRECT_MAX_SCORE", "2"))
+
+# Requests that benefit from the orchestrator's web search / reference lookup
+_REFERENCE_HINTS = re.compile(
+    r"\b(replica|realistic|accurate|exact|official|brand|logo|like (?:a|an|the)|based on|reference|"
+    r"iphone|ipad|airpods|lego|nintendo|xbox|playstation|raspberry pi|arduino)\b"
+)
+# Multi-part or mechanical requests
+_ASSEMBLY_HINTS = re.compile(
+    r"\b(mechanism|assembly|interlocking|hinge[sd]?|thread(?:ed|s)?|gearbox|gear train|linkage|"
+    r"moving|articulated|snap[- ]fit|mount(?:ing)? for|compatible with)\b"
+)
+
+# Equivalent models for gen_cad, tried fastest-healthy first (see resilience.failover)
+ANTHROPIC_MODELS = [m.strip() for m in os.getenv(
+    "ANTHROPIC_MODELS", "claude-sonnet-4-5,claude-sonnet-4-20250514").split(",") if m.strip()]
+
+# Variants of one request (batch generation) always take the direct pipeline: the shared
+# request is a prompt-cache breakpoint and only the short variant note differs.
+
+# Where gen_cad leaves its code for get_cad_orchestrated (output.scad is shared by every job)
+_output = contextvars.ContextVar("cad_output", default=None)
+
+# Created on first use so importing this module never touches the network or env
+_client2 = None
+
+def _anthropic():
+    global _client2
+    if _client2 is None:
+        _client2 = anthropic.Anthropic(api_key=os.getenv("CLAUDE_API_KEY"))
+    return _client2
 
 def gen_cad(p):
-    response =  client2.messages.create(
-        model="claude-sonnet-4-5",
-        max_tokens=20000,
-        messages=[{"role": "user", "content": p}]
-    )
+    # the orchestrator has finished building the prompt once it calls us
+    metrics.end("prompt_build")
+    cancellation.check()  # don't start the expensive call for a cancelled job
+    def create(model):
+        return lambda: _anthropic().messages.create(
+            model=model,
+            max_tokens=20000,
+            system=cached_system(GEN_CAD_SYSTEM),
+            messages=[{"role": "user", "content": p}]
+        )
+    with span("llm_generate"):
+        response = resilience.failover([(f"anthropic:{m}", create(m)) for m in ANTHROPIC_MODELS])
+    _record_prompt_cache(response)
     content =  response.content
     code_blocks = [block.text for block in content if hasattr(block, "text")]
     full_text = "\n".join(code_blocks)
     
     # Strip markdown fences before writing
-    full_text = _strip_markdown_fences(full_text)
+    with span("fence_strip"):
+        full_text = strip_markdown_fences(full_text)
     
+    holder = _output.get()
+    if holder is not None:
+        holder["scad"] = full_text
     with open('output.scad', 'w', encoding='utf-8') as f:
         f.write(full_text)
 
-def _strip_markdown_fences(code: str) -> str:
-    """
-    Remove markdown code fences from SCAD code.
-    Handles various formats:
-    - ```openscad ... ```
-    - ```scad ... ```
-    - ```plaintext ... ```
-    - ``` ... ```
-    - With or without whitespace
-    """
-    code = code.strip()
-    
-    # Split into lines for robust fence detection
-    lines = code.split('\n')
-    
-    # Remove opening fence: Check first line for any fence format
-    if lines and lines[0].strip().startswith('```'):
-        lines = lines[1:]
-        print(f"[gen_cad] Stripped opening markdown fence")
-    
-    # Remove closing fence: Check last line
-    if lines and lines[-1].strip() == '```':
-        lines = lines[:-1]
-        print(f"[gen_cad] Stripped closing markdown fence")
-    
-    result = '\n'.join(lines).strip()
-    return result
+def _record_prompt_cache(response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    written = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    metrics.cache_result("anthropic_prompt", read > 0)
+    print(f"[gen_cad] prompt cache read={read} written={written} uncached={getattr(usage, 'input_tokens', 0)}")
+
+def choose_pipeline(user_prompt: str) -> str:
+    """"direct" or "orchestrated" for this request, honouring CAD_PIPELINE."""
+    if CAD_PIPELINE in ("direct", "orchestrated"):
+        return CAD_PIPELINE
+    text = (user_prompt or "").lower()
+    score = len(text.split()) / 15
+    score += len(_REFERENCE_HINTS.findall(text))
+    score += len(_ASSEMBLY_HINTS.findall(text))
+    # "with 5 gears", "three drawers": counted parts usually mean an assembly
+    score += len(re.findall(r"\b(?:\d+|two|three|four|five|six|seven|eight|nine|ten)\s+\w+s\b", text)) * 0.5
+    return "orchestrated" if score > CAD_DIRECT_MAX_SCORE else "direct"
+
+def gen_cad_direct(user_prompt: str, variant: str | None = None) -> str:
+    """Single streaming model call: local prompt, cached system prefix, no tool hops.
+    A `variant` note is appended after the request so sibling variants share the cached prefix."""
+    with span("prompt_build"):
+        p = directprompt(user_prompt)
+        if variant:
+            p = [{"type": "text", "text": p, "cache_control": {"type": "ephemeral"}},
+                 {"type": "text", "text": variant}]
+    started = time.perf_counter()
+    first_token = None
+    parts = []
+
+    def generate():
+        nonlocal first_token
+        with _anthropic().messages.stream(
+            model=CAD_DIRECT_MODEL,
+            max_tokens=20000,
+            system=cached_system(GEN_CAD_SYSTEM),
+            messages=[{"role": "user", "content": p}],
+        ) as stream:
+            # stops at the next token once the job is cancelled; leaving the block closes the stream
+            for text in cancellation.iterate(stream.text_stream):
+                if first_token is None:
+                    first_token = time.perf_counter() - started
+                    metrics.observe("llm_first_token", first_token)
+                    providers.prefix_ready()
+                parts.append(text)
+            return stream.get_final_message()
+
+    with span("llm_generate"):
+        response = resilience.guard(f"anthropic:{CAD_DIRECT_MODEL}").call(generate)
+    _record_prompt_cache(response)
+
+    with span("fence_strip"):
+        full_text = strip_markdown_fences("".join(parts))
+    return full_text
+
+async def get_cad(user_prompt, variant=None):
+    """The generated SCAD (fences stripped), or None if the orchestrator never called gen_cad."""
+    pipeline = "direct" if variant else choose_pipeline(user_prompt)
+    print(f"[get_cad] pipeline={pipeline}")
+    if pipeline == "direct":
+        return gen_cad_direct(user_prompt, variant)
+    return await get_cad_orchestrated(user_prompt)
 
-async def get_cad(user_prompt):
+async def get_cad_orchestrated(user_prompt):
+    holder = {}
+    _output.set(holder)
     client = Dedalus()
     runner = DedalusRunner(client)
+    metrics.begin("prompt_build")
     # p = mkprompt(user_prompt)
     # print(p)
-    result =  runner.run(
-        input=f"""use mkprompt to make a proper prompt for cad generation based on this user request: {user_prompt}
-                then use gen_cad and pass in the prompt you made to generate the openSCAD code for the user request
-                use all tools available to you to make the best description of the cad model possible, 
-                make the prompt very detailed so that the generated cad model is as accurate as possible to the user request
-                make sure to mention in the prompt to use MCAD libraries built into OpenSCAD whenever appropriate; moreover, all items must be attached together and there should not be any random floating bodies.
-                also, make sure the prompt specifies that the only return should be OpenSCAD code, with no supporting text or dialogue.
-                
-                WHENEVER YOU WANT TO IMPORT AN MCAD LIBRARY, MAKE SURE IT ACTUALLY EXISTS IN https://github.com/openscad/MCAD
-                I DONT WANT ANY HALLUCINATED LIBRARIES IN THE OPENSCAD CODE.
-
-                
-                the openScad code should be stored and not returned into the terminal. 
-                THE OPENSCAD CODE SHOULD BE WRITTEEN INTO A FILE VIA gen_cad
-
-                MAKE SURE THE ONLY THING PASSSED INTO GEN_CAD IS THE PROMPT FOR CAD GENERATION
-                THE FULL_TEXT IN GEN CAD SHOULD NOT BE WRITTEN TO THE SCAD FILE, ONLY THE OPEN SCAD CODE
-
-                YOU NEED TO WAIT UNTIL gen_cad HAS FINISHED WRITING THE FILE BEFORE YOU FINISH YOUR RESPONSE
-
-                ADDITIONALLY, IN THE output.scad FILE MAKE SURE TO REMOVE THE FIRST LINE IF IT CONTAINS ANYTHING LIKE "```openscad" OR "```"
-                AND THE LAST LINE IF IT CONTAINS "```"
-
-                DO NOT RUN GEN_CAD MORE THAN ONCE PER REQUEST, TRY TO GET THE BEST PROMPT POSSIBLE IN ONE GO, RE-ITERATE THE PROMPT
-                RATHER THAN CALLING GEN_CAD MULTIPLE TIMES.
-                """,
+    # static instructions first so the provider can reuse the cached prefix
+    result = resilience.guard("dedalus_cad").call(
+        runner.run,
+        instructions=GET_CAD_INSTRUCTIONS,
+        input=f"User request: {user_prompt}",
         model=["openai/gpt-5-mini","claude-sonnet-4-20250514"],
         tools = [gen_cad, mkprompt, ],
         mcp_servers=["windsor/brave-search-mcp", 'akakak/sonar', 'windsor/context7'],
         stream=False,
         verbose=True,
+        prompt_cache_key="vibecad-get-cad",
     )
     print("Dedalus run completed:", result)
+    return holder.get("scad")
     
 # async def writeToFile(text):
 #     with open('output.scad', 'w') as f:
@@ -0,0 +1,32 @@
+import os
+
+try:
+    import fcntl
+except ImportError:  # Windows dev machines: no cross-process lock
+    fcntl = None
+
+# One-process-per-host background work.
+#
+# gunicorn runs one interpreter per worker, and each imports app.py. Work that
+# must run once per host (the pre-generator, the artifact sweeper) first
+# claims an exclusive flock on a lock file; the process that gets it keeps
+# it until it exits, and the others skip the work.
+
+_held = {}  # path -> open lock file
+
+
+def claim(path: str) -> bool:
+    """True if this process holds the lock at `path` (taking it if it is free)."""
+    if fcntl is None:
+        return True
+    if path in _held:
+        return True
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    f = open(path, "w")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _held[path] = f
+    return True
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import threading
+import time
+from functools import wraps
+
+from flask import request, make_response
+
+from metrics import metrics
+import uploads
+
+# Idempotency-Key support for expensive POST routes.
+#
+# The first request with a given key runs normally and its response is kept
+# for IDEMPOTENCY_TTL seconds. Retries with the same key wait for the first
+# one to finish and get the same response back instead of starting a new
+# STT/LLM pipeline. 429 and 5xx responses are not cached so the client can retry.
+# A key reused with a different body (query, form fields, JSON or uploaded
+# file content) gets 422 instead of the first request's response.
+
+IDEMPOTENCY_TTL = 24 * 3600
+IDEMPOTENCY_WAIT = 600  # how long a retry waits on the original request
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_entries: int = 10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # scoped key -> {"fingerprint", "event", "response", "expires_at"}
+        self._lock = threading.Lock()
+
+    def begin(self, key: tuple, fingerprint: str):
+        """Returns (entry, owner). The owner must call finish() or release()."""
+        with self._lock:
+            self._prune()
+            entry = self._entries.get(key)
+            if entry is not None:
+                return entry, False
+            entry = {
+                "fingerprint": fingerprint,
+                "event": threading.Event(),
+                "response": None,
+                "expires_at": time.time() + self.ttl,
+            }
+            self._entries[key] = entry
+            return entry, True
+
+    def finish(self, key: tuple, response):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry["response"] = response
+        entry["event"].set()
+
+    def release(self, key: tuple):
+        """Forget a key whose request failed so a retry can run it again."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry["event"].set()
+
+    def _prune(self):
+        now = time.time()
+        expired = [k for k, e in self._entries.items() if e["expires_at"] < now]
+        for k in expired:
+            del self._entries[k]
+        # Drop the oldest entries if a client floods us with unique keys.
+        overflow = len(self._entries) - self.max_entries
+        if overflow > 0:
+            for k in sorted(self._entries, key=lambda k: self._entries[k]["expires_at"])[:overflow]:
+                del self._entries[k]
+
+
+def _request_field(name: str):
+    body = request.get_json(silent=True) if request.is_json else None
+    return request.args.get(name) or request.form.get(name) or (body or {}).get(name)
+
+
+def _fingerprint() -> str:
+    """sha256 over the method, path, query, form fields, JSON body and the content hash of
+    each uploaded file (computed while it was received, see uploads.py)."""
+    parts = [("arg", k, v) for k, v in request.args.items(multi=True)]
+    parts += [("form", k, v) for k, v in request.form.items(multi=True)]
+    parts += [("file", k, uploads.digest(f)) for k, f in request.files.items(multi=True)]
+    if request.is_json:
+        parts.append(("json", "", json.dumps(request.get_json(silent=True), sort_keys=True, default=str)))
+    h = hashlib.sha256(f"{request.method} {request.path}\n".encode("utf-8"))
+    for part in sorted(parts):
+        h.update(("\0".join(part) + "\n").encode("utf-8"))
+    return h.hexdigest()
+
+
+def idempotent(store: IdempotencyStore):
+    """Route decorator honouring the Idempotency-Key request header."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            idem_key = request.headers.get("Idempotency-Key")
+            if not idem_key:
+                return view(*args, **kwargs)
+
+            userid = _request_field("userid") or request.remote_addr or ""
+            key = (request.path, userid, idem_key)
+            fingerprint = _fingerprint()
+
+            entry, owner = store.begin(key, fingerprint)
+            if not owner:
+                if entry["fingerprint"] != fingerprint:
+                    return {"error": "Idempotency-Key was already used for a different request"}, 422
+                metrics.cache_result("idempotency", True)
+                entry["event"].wait(IDEMPOTENCY_WAIT)
+                cached = entry["response"]
+                if cached is None:
+                    return {"error": "original request with this Idempotency-Key did not complete"}, 409
+                body, status, mimetype = cached
+                resp = make_response(body, status)
+                resp.mimetype = mimetype
+                resp.headers["Idempotent-Replayed"] = "true"
+                return resp
+
+            metrics.cache_result("idempotency", False)
+            try:
+                resp = make_response(view(*args, **kwargs))
+            except Exception:
+                store.release(key)
+                raise
+            if resp.status_code >= 500 or resp.status_code == 429:
+                store.release(key)
+            else:
+                store.finish(key, (resp.get_data(), resp.status_code, resp.mimetype))
+            return resp
+        return wrapper
+    return decorator
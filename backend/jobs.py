@@ -0,0 +1,297 @@
+import asyncio
+import contextvars
+import os
+import re
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from uuid import uuid4
+
+import cancellation
+from metrics import metrics
+from profiling import profiler
+
+# Background generation jobs.
+#
+# Every generation/iteration (sync or async) runs as a job here. Identical
+# requests that arrive while a job is still pending or running are attached to
+# that job instead of launching another LLM pipeline.
+#
+# Jobs can be cancelled (cancel(), DELETE /api/generation/job/<id>) or given a
+# deadline. Either marks the job "cancelled" and releases its waiters at once;
+# the work itself stops at its next cancellation check (see cancellation.py).
+#
+# At most GENERATION_WORKERS jobs run at once. Queued jobs are dispatched
+# fair-share: the owner (user) with the fewest running jobs goes next, ties to
+# whoever was served least recently, so one user's burst waits behind its own
+# jobs instead of everyone else's.
+#
+# Jobs submitted with a `group` id (batch/variant generation) can be listed
+# together through group().
+#
+# A running job can publish intermediate fields with progress() (e.g. its
+# pipeline stage, or the SCAD before the render finishes) for pollers to see.
+
+JOB_TTL = 3600  # finished jobs are kept this long for polling
+MAX_RUNNING = int(os.getenv("GENERATION_WORKERS", "6"))
+
+_current = contextvars.ContextVar("generation_job", default=None)  # (registry, job id) while running
+
+
+def coalesce_key(mode: str, userid: str | None, prompt: str, modelid: str | None = None) -> tuple:
+    """Key under which identical in-flight requests share one job."""
+    norm = re.sub(r"\s+", " ", (prompt or "").strip().lower())
+    return (mode, userid or "", modelid or "", norm)
+
+
+class JobRegistry:
+    def __init__(self, ttl: float = JOB_TTL, max_running: int = MAX_RUNNING):
+        self.ttl = ttl
+        self.max_running = max_running
+        self.jobs = {}        # job_id -> public, JSON-serializable state
+        self._done = {}       # job_id -> threading.Event
+        self._inflight = {}   # coalesce key -> job_id
+        self._tokens = {}     # job_id -> cancellation.CancelToken
+        self._keys = {}       # job_id -> coalesce key
+        self._owners = {}     # job_id -> owner, while queued or running
+        self._groups = {}     # group id -> job ids in submission order
+        self._queues = OrderedDict()  # owner -> deque of (job_id, fn, context) waiting to run
+        self._running = {}    # owner -> running job count
+        self._served = {}     # owner -> dispatch sequence number of its last started job
+        self._dispatched = 0
+        self._lock = threading.Lock()
+
+    def submit(self, mode: str, fn, key: tuple | None = None, deadline_s: float | None = None,
+               owner: str | None = None, group: str | None = None, **fields) -> tuple[str, bool]:
+        """Queue `fn()` as a new job for `owner`, or attach to an identical in-flight one.
+        `fn` returns a dict of result fields merged into the job; past `deadline_s`
+        (counted from submission) the job is cancelled. Returns (job_id, attached)."""
+        with self._lock:
+            self._prune()
+            if key is not None:
+                existing = self._inflight.get(key)
+                if existing and self.jobs.get(existing, {}).get("status") in ("pending", "running"):
+                    self.jobs[existing]["attached"] += 1
+                    print(f"[JOBS] coalesced {mode} request onto job {existing}")
+                    metrics.cache_result("generation_coalesce", True)
+                    return existing, True
+            job_id = str(uuid4())
+            token = cancellation.CancelToken(deadline_s)
+            self.jobs[job_id] = {
+                "status": "pending",
+                "mode": mode,
+                "scad_code": None,
+                "error": None,
+                "attached": 0,
+                "created_at": time.time(),
+                "deadline_at": token.deadline_at,
+                **fields,
+            }
+            if group is not None:
+                self.jobs[job_id]["group"] = group
+                self._groups.setdefault(group, []).append(job_id)
+            self._done[job_id] = threading.Event()
+            self._tokens[job_id] = token
+            if key is not None:
+                self._inflight[key] = job_id
+                self._keys[job_id] = key
+                metrics.cache_result("generation_coalesce", False)
+            # Run in a copy of the caller's context so stage spans are attributed to its request
+            owner = owner or ""
+            self._owners[job_id] = owner
+            self._queues.setdefault(owner, deque()).append((job_id, fn, contextvars.copy_context()))
+            ready = self._dispatch()
+        token.on_cancel(lambda: self._cancelled(job_id))
+        self._start(ready)
+        return job_id, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": sum(self._running.values()),
+                "queued": sum(len(q) for q in self._queues.values()),
+                "max_running": self.max_running,
+                "owners_waiting": len(self._queues),
+            }
+
+    # ----------------------------- scheduling -----------------------------
+    def _dispatch(self) -> list:
+        """Pick queued jobs for free slots, fair-share across owners. Caller holds the lock."""
+        ready = []
+        while self._queues and sum(self._running.values()) < self.max_running:
+            owner = min(self._queues, key=lambda o: (self._running.get(o, 0), self._served.get(o, -1)))
+            queue = self._queues[owner]
+            job_id, fn, ctx = queue.popleft()
+            if not queue:
+                del self._queues[owner]
+            self._running[owner] = self._running.get(owner, 0) + 1
+            self._dispatched += 1
+            self._served[owner] = self._dispatched
+            ready.append((job_id, fn, ctx))
+        return ready
+
+    def _start(self, ready: list):
+        for job_id, fn, ctx in ready:
+            threading.Thread(target=ctx.run, args=(self._run, job_id, fn), daemon=True).start()
+
+    def _slot_freed(self, job_id: str):
+        with self._lock:
+            owner = self._owners.pop(job_id, "")
+            left = self._running.get(owner, 0) - 1
+            if left > 0:
+                self._running[owner] = left
+            else:
+                self._running.pop(owner, None)
+            ready = self._dispatch()
+        self._start(ready)
+
+    def _unqueue(self, job_id: str) -> bool:
+        """Drop a job that has not started yet. Caller holds the lock."""
+        owner = self._owners.get(job_id)
+        queue = self._queues.get(owner)
+        if queue is None:
+            return False
+        for entry in queue:
+            if entry[0] == job_id:
+                queue.remove(entry)
+                if not queue:
+                    del self._queues[owner]
+                del self._owners[job_id]
+                return True
+        return False
+
+    def get(self, job_id: str) -> dict | None:
+        return self.jobs.get(job_id)
+
+    def progress(self, **fields):
+        """Merge fields into the calling job's state while it runs (no-op outside a job)."""
+        current = _current.get()
+        if current is None or current[0] is not self:
+            return
+        with self._lock:
+            job = self.jobs.get(current[1])
+            if job is not None and job["status"] == "running":
+                job.update(fields)
+
+    def group(self, group_id: str) -> list[tuple[str, dict]] | None:
+        """(job_id, state) for every job of a group, in submission order; None if unknown."""
+        with self._lock:
+            ids = self._groups.get(group_id)
+            if ids is None:
+                return None
+            return [(jid, self.jobs[jid]) for jid in ids if jid in self.jobs]
+
+    def wait(self, job_id: str, timeout: float | None = None) -> dict | None:
+        """Block until the job finishes (or timeout) and return its state."""
+        ev = self._done.get(job_id)
+        if ev is not None:
+            ev.wait(timeout)
+        return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str, reason: str = "cancelled by client", force: bool = False) -> str | None:
+        """Cancel a pending/running job. A job shared by coalesced requests is only
+        detached from (one fewer waiter) unless `force`. Returns "cancelled", "detached",
+        "finished" (nothing to do) or None for an unknown job."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] not in ("pending", "running"):
+                return "finished"
+            if job["attached"] > 0 and not force:
+                job["attached"] -= 1
+                return "detached"
+            token = self._tokens.get(job_id)
+        if token is not None:
+            token.cancel(reason)
+        return "cancelled"
+
+    def _cancelled(self, job_id: str):
+        # token callback (client cancel or deadline): free waiters and the coalesce slot now
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] not in ("pending", "running"):
+                return
+            job["status"] = "cancelled"
+            job["error"] = self._tokens[job_id].reason
+            job["finished_at"] = time.time()
+            self._unqueue(job_id)
+            self._release(job_id)
+        print(f"[JOBS] job {job_id} cancelled: {job['error']}")
+        metrics.observe("job_cancelled", job["finished_at"] - job["created_at"])
+
+    def _release(self, job_id: str):
+        key = self._keys.pop(job_id, None)
+        if key is not None and self._inflight.get(key) == job_id:
+            del self._inflight[key]
+        self._done[job_id].set()
+
+    def _run(self, job_id: str, fn):
+        try:
+            self._execute(job_id, fn)
+        finally:
+            self._slot_freed(job_id)
+
+    def _execute(self, job_id: str, fn):
+        profiler.attach_thread()
+        job = self.jobs[job_id]
+        token = self._tokens[job_id]
+        cancellation.bind(token)
+        _current.set((self, job_id))
+        with self._lock:
+            if job["status"] != "pending":
+                return  # cancelled before it started
+            job["status"] = "running"
+            job["started_at"] = time.time()
+        metrics.observe("job_queue_wait", job["started_at"] - job["created_at"])
+        try:
+            result = fn() or {}
+            with self._lock:
+                if job["status"] == "running":
+                    job.update(result)
+                    job["status"] = "done"
+        except (cancellation.Cancelled, asyncio.CancelledError) as e:
+            if not token.cancelled:
+                # raised by something other than this job's token (a nested guard, an asyncio
+                # task): nothing marked the job, so fail it here and free its coalesce key
+                print(f"[JOBS] job {job_id} interrupted by a stray {type(e).__name__}")
+                with self._lock:
+                    if job["status"] == "running":
+                        job["error"] = f"{e}" or "interrupted"
+                        job["error_type"] = type(e).__name__
+                        job["status"] = "error"
+            # otherwise already marked by _cancelled()
+        except Exception as e:
+            trace = traceback.format_exc()
+            with self._lock:
+                if job["status"] == "running":
+                    job["error"] = f"{e}"
+                    job["error_type"] = type(e).__name__
+                    # upstream refusals (resilience.ProviderUnavailable) carry these for a 503
+                    for attr in ("provider", "retry_after"):
+                        if getattr(e, attr, None) is not None:
+                            job[attr] = getattr(e, attr)
+                    job["trace"] = trace
+                    job["status"] = "error"
+        finally:
+            token.close()
+            with self._lock:
+                if job["status"] in ("done", "error"):
+                    job["finished_at"] = time.time()
+                    self._release(job_id)
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        stale = [jid for jid, j in self.jobs.items() if (j.get("finished_at") or time.time()) < cutoff]
+        for jid in stale:
+            self.jobs.pop(jid, None)
+            self._done.pop(jid, None)
+            self._tokens.pop(jid, None)
+        for gid, ids in list(self._groups.items()):
+            ids[:] = [jid for jid in ids if jid in self.jobs]
+            if not ids:
+                del self._groups[gid]
+        # idle owners lose their place in the round-robin (they go first next time)
+        for owner in [o for o in self._served if o not in self._running and o not in self._queues]:
+            del self._served[owner]
@@ -0,0 +1,203 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Per-stage latency instrumentation.
+#
+# Pipeline code wraps each stage in `span("stt")`, `span("status_tts")`, ...
+# Every span feeds a latency histogram and an in-flight gauge, exported in the
+# Prometheus text format by /metrics. Spans that run on behalf of an HTTP
+# request (including job threads started from it, see jobs.py) are also
+# collected per request so they can be returned in the X-Stage-Timings header.
+# Caches report hits/misses through `cache_result(name, hit)`; other events are
+# counted with `count(name, help, **labels)`.
+
+STAGES = (
+    "stt", "audio_prep", "intent", "status_phrase", "status_tts", "prompt_build",
+    "llm_generate", "fence_strip", "db_read", "db_write", "gradio_predict", "compress",
+    "summary_build", "kittycad_generate", "scad_render", "pregen_build",
+)
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+PREFIX = "vibecad"
+
+_request_spans = contextvars.ContextVar("request_spans", default=None)
+_open_marks = contextvars.ContextVar("open_marks", default=None)
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    def __init__(self):
+        self._stages = {}      # stage -> _Histogram
+        self._requests = {}    # (method, endpoint, status) -> _Histogram
+        self._errors = {}      # stage -> count
+        self._inflight = {}    # stage -> count
+        self._cache = {}       # (cache, "hit"|"miss") -> count
+        self._gauges = {}      # name -> (help, fn, label)
+        self._counters = {}    # name -> (help, {label pairs: count})
+        self._http_inflight = 0
+        self._lock = threading.Lock()
+
+    # ------------------------------ recording -----------------------------
+    @contextmanager
+    def span(self, stage: str):
+        with self._lock:
+            self._inflight[stage] = self._inflight.get(stage, 0) + 1
+        t0 = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - t0, error=failed, _inflight=True)
+
+    def observe(self, stage: str, seconds: float, error: bool = False, _inflight: bool = False):
+        with self._lock:
+            self._stages.setdefault(stage, _Histogram()).observe(seconds)
+            if error:
+                self._errors[stage] = self._errors.get(stage, 0) + 1
+            if _inflight:
+                self._inflight[stage] -= 1
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((stage, seconds))
+
+    def begin(self, stage: str):
+        """Start timing a stage whose end is reached in another function (see end())."""
+        marks = _open_marks.get()
+        if marks is None:
+            marks = {}
+            _open_marks.set(marks)
+        marks[stage] = time.perf_counter()
+
+    def end(self, stage: str):
+        marks = _open_marks.get()
+        started = marks.pop(stage, None) if marks else None
+        if started is not None:
+            self.observe(stage, time.perf_counter() - started)
+
+    def cache_result(self, cache: str, hit: bool):
+        key = (cache, "hit" if hit else "miss")
+        with self._lock:
+            self._cache[key] = self._cache.get(key, 0) + 1
+
+    def count(self, name: str, help_text: str, **labels):
+        """Increment the counter `<prefix>_<name>_total` for these labels."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            _, samples = self._counters.setdefault(name, (help_text, {}))
+            samples[key] = samples.get(key, 0) + 1
+
+    def gauge(self, name: str, help_text: str, fn, label: str | None = None):
+        """Register a callback gauge read at scrape time (e.g. queue depth). With `label`,
+        fn returns {label value: gauge value}."""
+        self._gauges[name] = (help_text, fn, label)
+
+    # --------------------------- HTTP requests ----------------------------
+    def request_started(self):
+        _request_spans.set([])
+        with self._lock:
+            self._http_inflight += 1
+
+    def request_finished(self, method: str, endpoint: str, status: int, seconds: float):
+        with self._lock:
+            self._http_inflight = max(0, self._http_inflight - 1)
+            self._requests.setdefault((method, endpoint, str(status)), _Histogram()).observe(seconds)
+
+    def request_timings(self) -> list[tuple[str, float]]:
+        return list(_request_spans.get() or [])
+
+    @staticmethod
+    def format_timings(timings) -> str:
+        """Server-Timing style: 'stt;dur=412.3, intent;dur=0.1' (milliseconds, in order)."""
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings)
+
+    # ------------------------------ exposition ----------------------------
+    def render(self) -> str:
+        with self._lock:
+            stages = {k: (list(h.counts), h.sum, h.count) for k, h in self._stages.items()}
+            requests = {k: (list(h.counts), h.sum, h.count) for k, h in self._requests.items()}
+            errors = dict(self._errors)
+            inflight = dict(self._inflight)
+            cache = dict(self._cache)
+            counters = {n: (h, dict(v)) for n, (h, v) in self._counters.items()}
+            http_inflight = self._http_inflight
+
+        out = []
+        _histogram(out, f"{PREFIX}_stage_duration_seconds", "Pipeline stage latency.",
+                   {(("stage", s),): v for s, v in stages.items()})
+        _family(out, f"{PREFIX}_stage_errors_total", "counter", "Stage spans that raised.",
+                {(("stage", s),): n for s, n in errors.items()})
+        _family(out, f"{PREFIX}_stage_in_flight", "gauge", "Stage spans currently running.",
+                {(("stage", s),): inflight.get(s, 0) for s in sorted(set(STAGES) | set(inflight))})
+        _histogram(out, f"{PREFIX}_http_request_duration_seconds", "HTTP request latency by endpoint.",
+                   {(("method", m), ("endpoint", e), ("status", c)): v for (m, e, c), v in requests.items()})
+        _family(out, f"{PREFIX}_http_requests_in_flight", "gauge", "HTTP requests being served.",
+                {(): http_inflight})
+        _family(out, f"{PREFIX}_cache_requests_total", "counter", "Cache lookups by result.",
+                {(("cache", c), ("result", r)): n for (c, r), n in cache.items()})
+        ratios = {}
+        for name in sorted({c for c, _ in cache}):
+            hits, misses = cache.get((name, "hit"), 0), cache.get((name, "miss"), 0)
+            ratios[(("cache", name),)] = hits / (hits + misses) if hits + misses else 0.0
+        _family(out, f"{PREFIX}_cache_hit_ratio", "gauge", "Cache hits / lookups since start.", ratios)
+        for name, (help_text, samples) in sorted(counters.items()):
+            _family(out, f"{PREFIX}_{name}_total", "counter", help_text, samples)
+        for name, (help_text, fn, label) in sorted(self._gauges.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"[METRICS] gauge {name} failed:", e)
+                continue
+            samples = {((label, k),): v for k, v in value.items()} if label else {(): value}
+            _family(out, f"{PREFIX}_{name}", "gauge", help_text, samples)
+        return "\n".join(out) + "\n"
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in pairs) + "}"
+
+
+def _family(out, name, kind, help_text, samples):
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} {kind}")
+    for labels, value in samples.items():
+        out.append(f"{name}{_labels(labels)} {value}")
+
+
+def _histogram(out, name, help_text, samples):
+    out.append(f"# HELP {name} {help_text}")
+    out.append(f"# TYPE {name} histogram")
+    for labels, (counts, total, count) in samples.items():
+        running = 0
+        for bound, n in zip(BUCKETS, counts):
+            running += n
+            out.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {running}")
+        out.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+        out.append(f"{name}_sum{_labels(labels)} {total}")
+        out.append(f"{name}_count{_labels(labels)} {count}")
+
+
+metrics = Metrics()
+span = metrics.span
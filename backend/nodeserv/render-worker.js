@@ -0,0 +1,19 @@
+// Background OpenSCAD renders (full-quality pass after a preview), off the
+// main thread so the server keeps answering while CSG runs.
+const { parentPort } = require("worker_threads");
+const { createOpenSCAD } = require("openscad-wasm");
+
+const ready = createOpenSCAD({ noInitialRun: true });
+
+parentPort.on("message", async ({ id, scad }) => {
+  try {
+    const scadModule = await ready;
+    const stl = await scadModule.renderToStl(scad);
+    parentPort.postMessage({ id, stl: Buffer.from(stl) });
+  } catch (err) {
+    const error = typeof err === "number"
+      ? `OpenSCAD compilation error code: ${err}`
+      : (err && err.message) || String(err);
+    parentPort.postMessage({ id, error });
+  }
+});
@@ -0,0 +1,42 @@
+// Preview-quality rewrite of SCAD source for the fast first render.
+//
+// - Literal $fn values are capped at PREVIEW_FN, $fa/$fs floored at
+//   PREVIEW_FA/PREVIEW_FS, and file-level $fa/$fs defaults are appended so
+//   curves without explicit settings are coarse too (the last top-level
+//   assignment wins in OpenSCAD).
+// - minkowski() keeps only its first child. It is used to round edges, so the
+//   preview is the unrounded base shape, slightly smaller than the final one.
+//   hull() is left alone: it defines the shape rather than decorating it, and
+//   it is cheap once the curves feeding it are coarse.
+
+const PREVIEW_FN = Number(process.env.PREVIEW_FN || 24);
+const PREVIEW_FA = Number(process.env.PREVIEW_FA || 12);
+const PREVIEW_FS = Number(process.env.PREVIEW_FS || 2);
+
+const SPECIAL_VAR = /\$(fn|fa|fs)(\s*=\s*)(\d+(?:\.\d+)?)/g;
+
+function capResolution(src) {
+  return src.replace(SPECIAL_VAR, (whole, name, eq, value) => {
+    const v = Number(value);
+    if (name === "fn" && v > PREVIEW_FN) return `$fn${eq}${PREVIEW_FN}`;
+    if (name === "fa" && v < PREVIEW_FA) return `$fa${eq}${PREVIEW_FA}`;
+    if (name === "fs" && v < PREVIEW_FS) return `$fs${eq}${PREVIEW_FS}`;
+    return whole;
+  });
+}
+
+function previewScad(src) {
+  let out = capResolution(src);
+  let skipped = 0;
+  out = out.replace(/\bminkowski\s*\(/g, () => {
+    skipped += 1;
+    return "__preview_minkowski(";
+  });
+  if (skipped) {
+    out = `module __preview_minkowski(convexity) { children(0); }\n${out}`;
+  }
+  out += `\n$fa = ${PREVIEW_FA};\n$fs = ${PREVIEW_FS};\n`;
+  return { scad: out, skippedMinkowski: skipped };
+}
+
+module.exports = { previewScad, PREVIEW_FN, PREVIEW_FA, PREVIEW_FS };
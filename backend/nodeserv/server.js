@@ -2,6 +2,9 @@ const express = require("express");
 const { createOpenSCAD } = require("openscad-wasm");
 const fs = require("fs");
 const path = require("path");
+const crypto = require("crypto");
+const { Worker } = require("worker_threads");
+const { previewScad } = require("./scad-preview");
 
 const app = express();
 
@@ -38,6 +41,148 @@ openSCADPromise = (async () => {
   }
 })();
 
+// ---------------------------------------------------------------------------
+// Render quality and cache
+//
+// quality "full" (default) renders as before; "preview" renders a coarse
+// version (scad-preview.js); "progressive" answers with the preview at once
+// and renders the full version in a worker thread, which the client picks up
+// from GET /convert-scad/status/<key>. Every render is cached per quality
+// level under the key <quality>_<hash of the SCAD> (index/<key> points at the
+// content-addressed STL), so a repeat request (or the full pass of SCAD
+// already rendered) is served from disk.
+const QUALITIES = new Set(["full", "preview", "progressive"]);
+const RENDER_CACHE_MAX = Number(process.env.RENDER_CACHE_MAX || 500);
+const renders = new Map(); // key -> { status, url, bytes, ms, error, promise }, oldest first
+
+function renderKey(quality, scad) {
+  return `${quality}_${crypto.createHash("sha256").update(scad).digest("hex").slice(0, 32)}`;
+}
+
+function remember(key, entry) {
+  renders.delete(key);
+  renders.set(key, entry);
+  while (renders.size > RENDER_CACHE_MAX) renders.delete(renders.keys().next().value);
+}
+
+async function renderInProcess(scad) {
+  const scadModule = await openSCADPromise;
+  if (!scadModule) {
+    throw new Error("OpenSCAD module is undefined after initialization");
+  }
+  return scadModule.renderToStl(scad);
+}
+
+let worker = null;
+let workerSeq = 0;
+const workerCalls = new Map(); // id -> { resolve, reject }
+
+function renderInWorker(scad) {
+  if (!worker) {
+    worker = new Worker(path.join(__dirname, "render-worker.js"));
+    worker.on("message", ({ id, stl, error }) => {
+      const call = workerCalls.get(id);
+      workerCalls.delete(id);
+      if (call) error ? call.reject(new Error(error)) : call.resolve(stl);
+    });
+    worker.on("error", (err) => {
+      console.error("[convert] Render worker failed:", err);
+      for (const call of workerCalls.values()) call.reject(err);
+      workerCalls.clear();
+      worker = null;
+    });
+  }
+  const id = ++workerSeq;
+  return new Promise((resolve, reject) => {
+    workerCalls.set(id, { resolve, reject });
+    worker.postMessage({ id, scad });
+  });
+}
+
+// ---------------------------------------------------------------------------
+// Artifact store layout, shared with backend/artifacts.py (which evicts):
+//   generated/<ab>/<sha256>.stl         files named by the hash of their bytes
+//   generated/debug/<ab>/<sha256>.scad  SCAD that failed to render
+//   generated/index/<render key>        relative path of that key's STL
+// Identical outputs are stored once; reusing a file bumps its mtime (LRU).
+function storeArtifact(data, ext, subdir = "") {
+  const sha = crypto.createHash("sha256").update(data).digest("hex");
+  const rel = path.posix.join(subdir, sha.slice(0, 2), `${sha}.${ext}`);
+  const file = path.join(GENERATED_DIR, rel);
+  if (!touchArtifact(rel)) {
+    fs.mkdirSync(path.dirname(file), { recursive: true });
+    const tmp = path.join(path.dirname(file), `${sha}.${process.pid}.${crypto.randomBytes(4).toString("hex")}.part`);
+    fs.writeFileSync(tmp, data);
+    fs.renameSync(tmp, file); // atomic: readers never see a partial file
+  }
+  return rel;
+}
+
+function touchArtifact(rel) {
+  try {
+    const now = new Date();
+    fs.utimesSync(path.join(GENERATED_DIR, rel), now, now);
+    return true;
+  } catch (err) {
+    return false;
+  }
+}
+
+function indexedArtifact(key) {
+  try {
+    const rel = fs.readFileSync(path.join(GENERATED_DIR, "index", key), "utf8").trim();
+    return touchArtifact(rel) ? rel : null; // null once the sweeper evicted it
+  } catch (err) {
+    return null;
+  }
+}
+
+function indexArtifact(key, rel) {
+  fs.mkdirSync(path.join(GENERATED_DIR, "index"), { recursive: true });
+  fs.writeFileSync(path.join(GENERATED_DIR, "index", key), rel);
+}
+
+// Render once per key: concurrent requests share the in-flight render, finished ones hit disk.
+function renderCached(key, scad, render) {
+  const known = renders.get(key);
+  if (known && known.status !== "error" && (known.status === "pending" || touchArtifact(known.rel))) {
+    return known.promise;
+  }
+
+  const entry = { status: "pending", url: null };
+  const indexed = indexedArtifact(key);
+  if (indexed) {
+    const bytes = fs.statSync(path.join(GENERATED_DIR, indexed)).size;
+    Object.assign(entry, { status: "done", rel: indexed, url: `/files/generated/${indexed}`, bytes, ms: 0, cached: true });
+    entry.promise = Promise.resolve(entry);
+  } else {
+    const started = Date.now();
+    entry.promise = (async () => {
+      try {
+        const stl = Buffer.from(await render(scad));
+        const rel = storeArtifact(stl, "stl");
+        indexArtifact(key, rel);
+        return Object.assign(entry, {
+          status: "done", rel, url: `/files/generated/${rel}`, bytes: stl.length, ms: Date.now() - started, cached: false,
+        });
+      } catch (err) {
+        entry.status = "error";
+        entry.error = typeof err === "number" ? `OpenSCAD compilation error code: ${err}` : err.message || String(err);
+        throw err;
+      }
+    })();
+  }
+  remember(key, entry);
+  return entry.promise;
+}
+
+function renderStatus(key) {
+  const entry = renders.get(key);
+  if (!entry) return null;
+  const { status, url, bytes, ms, error } = entry;
+  return { key, status, url, bytes, ms, error };
+}
+
 // Health check endpoint
 app.get("/health", (req, res) => {
   res.json({ status: "ok", service: "scad-converter" });
@@ -47,12 +192,16 @@ app.post("/convert-scad", async (req, res) => {
   const startTime = Date.now();
   try {
     const { scad, model_id, userid, stream: streamFlag } = req.body || {};
+    const quality = (req.body && req.body.quality) || "full";
     
     if (!scad || typeof scad !== "string") {
       return res.status(400).json({ error: "Missing or invalid 'scad' string" });
     }
+    if (!QUALITIES.has(quality)) {
+      return res.status(400).json({ error: `Invalid 'quality': use ${[...QUALITIES].join(", ")}` });
+    }
 
-    console.log(`[convert] Request: scad_length=${scad.length} model_id=${model_id || 'none'} stream=${!!streamFlag}`);
+    console.log(`[convert] Request: scad_length=${scad.length} model_id=${model_id || 'none'} stream=${!!streamFlag} quality=${quality}`);
     console.log(`[convert] SCAD preview (first 500 chars):\n${scad.substring(0, 500)}\n...`);
 
     // Preprocess SCAD: Strip markdown code fences if present
@@ -118,40 +267,57 @@ app.post("/convert-scad", async (req, res) => {
       processedScad = `// Auto-hoisted variables from module scopes\n${varsBlock}\n\n${processedScad}`;
     }
 
-    const scadModule = await openSCADPromise;
-    
-    if (!scadModule) {
-      throw new Error("OpenSCAD module is undefined after initialization");
-    }
+    const fullKey = renderKey("full", processedScad);
+    let rendered;
+    let full = null;
+    let servedQuality = quality;
+    const fullDone = renders.get(fullKey);
 
-    console.log("[convert] Rendering SCAD to STL...");
-    const stlBuffer = await scadModule.renderToStl(processedScad);
-    const bytes = stlBuffer.length || stlBuffer.byteLength || Buffer.byteLength(stlBuffer);
-    console.log(`[convert] Render complete: ${bytes} bytes in ${Date.now() - startTime}ms`);
+    if (quality === "full" || (fullDone && fullDone.status === "done")) {
+      // progressive requests for SCAD whose full render is already cached get it directly
+      console.log("[convert] Rendering SCAD to STL (full quality)...");
+      rendered = await renderCached(fullKey, processedScad, renderInProcess);
+      servedQuality = "full";
+    } else {
+      const preview = previewScad(processedScad);
+      console.log(`[convert] Rendering preview (minkowski skipped: ${preview.skippedMinkowski})...`);
+      try {
+        rendered = await renderCached(renderKey("preview", processedScad), preview.scad, renderInProcess);
+      } catch (previewErr) {
+        if (quality === "preview") throw previewErr;
+        // the rewrite broke something: wait for the real render instead
+        console.warn("[convert] Preview render failed, rendering full quality:", previewErr.message || previewErr);
+        rendered = await renderCached(fullKey, processedScad, renderInProcess);
+        servedQuality = "full";
+      }
+      if (quality === "progressive" && servedQuality === "preview") {
+        renderCached(fullKey, processedScad, renderInWorker)
+          .then((e) => console.log(`[convert] Full render ${fullKey} done: ${e.bytes} bytes in ${e.ms}ms`))
+          .catch((err) => console.error(`[convert] Full render ${fullKey} failed:`, err.message || err));
+        full = { ...renderStatus(fullKey), status_url: `/convert-scad/status/${fullKey}` };
+      }
+    }
+    const { url: fileUrl, bytes } = rendered;
+    console.log(`[convert] ${servedQuality} render ready: ${bytes} bytes in ${Date.now() - startTime}ms${rendered.cached ? " (cached)" : ""}`);
 
     // If stream flag is true, return raw STL buffer
     if (streamFlag) {
       console.log("[convert] Streaming STL response");
       res.setHeader("Content-Type", "application/sla");
       res.setHeader("Content-Disposition", "inline; filename=model.stl");
-      return res.send(Buffer.from(stlBuffer));
+      res.setHeader("X-Render-Quality", servedQuality);
+      if (full) res.setHeader("X-Full-Render", full.status_url);
+      return res.send(fs.readFileSync(path.join(PUBLIC_DIR, fileUrl.replace(/^\/files\//, ""))));
     }
 
-    // Otherwise, save to file and return JSON with URL
-    const timestamp = Date.now();
-    const randomId = Math.random().toString(36).substring(2, 10);
-    const fileName = `model_${timestamp}_${randomId}.stl`;
-    const filePath = path.join(GENERATED_DIR, fileName);
-    
-    fs.writeFileSync(filePath, Buffer.from(stlBuffer));
-    console.log(`[convert] Saved: ${fileName}`);
-
-    const fileUrl = `/files/generated/${fileName}`;
     res.json({
       status: "ok",
       url: fileUrl,
       bytes,
       format: "stl",
+      quality: servedQuality,
+      cached: !!rendered.cached,
+      full,
       model_id,
       ms: Date.now() - startTime
     });
@@ -161,9 +327,7 @@ app.post("/convert-scad", async (req, res) => {
     
     // Save failed SCAD code for debugging
     try {
-      const debugFileName = `failed_${Date.now()}.scad`;
-      const debugPath = path.join(GENERATED_DIR, debugFileName);
-      fs.writeFileSync(debugPath, req.body.scad || 'NO SCAD CODE');
+      const debugFileName = storeArtifact(Buffer.from(req.body.scad || 'NO SCAD CODE'), "scad", "debug");
       console.error(`[convert] Failed SCAD saved to: ${debugFileName}`);
     } catch (saveErr) {
       console.error("[convert] Could not save failed SCAD:", saveErr);
@@ -182,5 +346,14 @@ app.post("/convert-scad", async (req, res) => {
   }
 });
 
+// Progress of a background full-quality render started by a progressive request
+app.get("/convert-scad/status/:key", (req, res) => {
+  const status = renderStatus(req.params.key);
+  if (!status) {
+    return res.status(404).json({ error: "unknown render" });
+  }
+  res.json(status);
+});
+
 const PORT = process.env.PORT || 3001;
 app.listen(PORT, () => console.log(`[convert] SCAD→STL service running on :${PORT}`));
\ No newline at end of file
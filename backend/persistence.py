@@ -0,0 +1,274 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import span
+import resilience
+
+# Write-behind persistence for Supabase rows.
+#
+# Request handlers enqueue rows and return immediately; a background thread
+# coalesces pending writes per row id and flushes them. New rows (put with
+# insert=True, ids generated by the server) go out as bulk inserts, so an id
+# that already exists fails instead of overwriting someone else's row.
+# Changes to existing rows are updates filtered on both the id and the owner
+# column, so a row only ever changes for the user who owns it.
+# Rows that keep failing are appended to a local JSONL spill file and are
+# replayed the next time the queue starts.
+
+FLUSH_INTERVAL = float(os.getenv("PERSIST_FLUSH_INTERVAL", "0.5"))
+BATCH_SIZE = int(os.getenv("PERSIST_BATCH_SIZE", "50"))
+MAX_ATTEMPTS = int(os.getenv("PERSIST_MAX_ATTEMPTS", "5"))
+SPILL_PATH = os.getenv("PERSIST_SPILL_PATH", "persist_spill.jsonl")
+
+
+class WriteBehindQueue:
+    def __init__(self, get_client, table: str = "models", key: str = "id", owner_key: str = "user_id",
+                 flush_interval: float = FLUSH_INTERVAL, batch_size: int = BATCH_SIZE,
+                 max_attempts: int = MAX_ATTEMPTS, spill_path: str = SPILL_PATH):
+        self._get_client = get_client
+        self.table = table
+        self.key = key
+        self.owner_key = owner_key
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.spill_path = spill_path
+
+        # row id -> {"row", "insert", "enqueued_at", "attempts", "not_before"}
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopped = False
+
+        self._stats = {
+            "enqueued_total": 0,
+            "flushed_total": 0,
+            "flush_batches_total": 0,
+            "flush_failures_total": 0,
+            "spilled_total": 0,
+            "replayed_total": 0,
+            "last_flush_lag_s": 0.0,
+            "max_flush_lag_s": 0.0,
+            "last_flush_at": None,
+            "last_error": None,
+        }
+
+    # ----------------------------- public API -----------------------------
+    def put(self, row: dict, insert: bool = False):
+        """Queue a new row (insert=True) or an update to an existing row owned by
+        row[owner_key]. Later writes to the same id by the same owner are merged into it."""
+        rid = row.get(self.key)
+        if not rid:
+            raise ValueError(f"row is missing '{self.key}'")
+        if not row.get(self.owner_key):
+            raise ValueError(f"row is missing '{self.owner_key}'")
+        with self._lock:
+            entry = self._pending.get(rid)
+            if entry and entry["row"].get(self.owner_key) != row[self.owner_key]:
+                raise ValueError(f"row {rid} is queued for another {self.owner_key}")
+            if entry:
+                entry["row"].update(row)  # a pending insert stays an insert
+            else:
+                self._pending[rid] = {
+                    "row": dict(row),
+                    "insert": insert,
+                    "enqueued_at": time.time(),
+                    "attempts": 0,
+                    "not_before": 0.0,
+                }
+            self._stats["enqueued_total"] += 1
+            size = len(self._pending)
+        self._ensure_started()
+        if size >= self.batch_size:
+            self._wake.set()
+
+    def pending(self, rid: str) -> dict | None:
+        """Return a copy of the not-yet-flushed row for `rid`, if any (read-your-writes)."""
+        with self._lock:
+            entry = self._pending.get(rid)
+            return dict(entry["row"]) if entry else None
+
+    def pending_insert(self, rid: str) -> bool:
+        """True while `rid` is a new row that has not been flushed yet (not in the DB)."""
+        with self._lock:
+            entry = self._pending.get(rid)
+            return bool(entry and entry["insert"])
+
+    def pending_inserts(self, owner) -> list[dict]:
+        """Copies of the not-yet-flushed new rows of `owner` (read-your-writes for listings)."""
+        with self._lock:
+            return [dict(e["row"]) for e in self._pending.values()
+                    if e["insert"] and e["row"].get(self.owner_key) == owner]
+
+    def flush(self) -> int:
+        """Flush everything that is due now. Returns the number of rows written."""
+        now = time.time()
+        with self._lock:
+            due = [(rid, e) for rid, e in self._pending.items() if e["not_before"] <= now]
+            due = due[: self.batch_size * 4]
+            # Detach the rows being written so concurrent puts start a fresh entry.
+            for rid, _ in due:
+                self._pending.pop(rid, None)
+        if not due:
+            return 0
+
+        # PostgREST bulk inserts require every object in a request to share the same keys.
+        groups = {}
+        written = 0
+        for rid, entry in due:
+            if entry["insert"]:
+                groups.setdefault(frozenset(entry["row"].keys()), []).append((rid, entry))
+            else:
+                written += self._flush_batch([(rid, entry)])  # updates are scoped one row at a time
+
+        for group in groups.values():
+            for i in range(0, len(group), self.batch_size):
+                written += self._flush_batch(group[i:i + self.batch_size])
+        return written
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+            out["queue_depth"] = len(self._pending)
+            oldest = min((e["enqueued_at"] for e in self._pending.values()), default=None)
+        out["oldest_pending_age_s"] = round(time.time() - oldest, 3) if oldest else 0.0
+        return out
+
+    def stop(self, timeout: float = 5.0):
+        """Flush what we can and spill the rest to disk."""
+        self._stopped = True
+        self._wake.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join(timeout)
+        try:
+            self.flush()
+        except Exception as e:
+            print("[PERSIST] final flush failed:", e)
+        with self._lock:
+            leftovers = list(self._pending.values())
+            self._pending.clear()
+        if leftovers:
+            self._spill(leftovers)
+
+    # ------------------------------ internals -----------------------------
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="persist-flusher", daemon=True)
+            self._thread.start()
+        self._replay_spill()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print("[PERSIST] flush loop error:", e)
+
+    def _query(self, batch):
+        table = self._get_client().table(self.table)
+        if batch[0][1]["insert"]:
+            return table.insert([entry["row"] for _, entry in batch])
+        row = batch[0][1]["row"]
+        fields = {k: v for k, v in row.items() if k not in (self.key, self.owner_key)}
+        return table.update(fields).eq(self.key, row[self.key]).eq(self.owner_key, row[self.owner_key])
+
+    def _flush_batch(self, batch) -> int:
+        rows = [entry["row"] for _, entry in batch]
+        try:
+            with span("db_write"):
+                resilience.guard("supabase").call(self._query(batch).execute)
+        except Exception as e:
+            self._requeue_failed(batch, e)
+            return 0
+
+        now = time.time()
+        lag = max(now - entry["enqueued_at"] for _, entry in batch)
+        with self._lock:
+            self._stats["flushed_total"] += len(rows)
+            self._stats["flush_batches_total"] += 1
+            self._stats["last_flush_lag_s"] = round(lag, 3)
+            self._stats["max_flush_lag_s"] = round(max(self._stats["max_flush_lag_s"], lag), 3)
+            self._stats["last_flush_at"] = now
+        return len(rows)
+
+    def _requeue_failed(self, batch, err):
+        print(f"[PERSIST] write of {len(batch)} rows failed:", err)
+        spill = []
+        now = time.time()
+        with self._lock:
+            self._stats["flush_failures_total"] += 1
+            self._stats["last_error"] = str(err)
+            for rid, entry in batch:
+                entry["attempts"] += 1
+                if entry["attempts"] >= self.max_attempts:
+                    spill.append(entry)
+                    continue
+                newer = self._pending.get(rid)
+                if newer:
+                    # A newer write arrived while we were flushing; it wins field by field.
+                    merged = dict(entry["row"])
+                    merged.update(newer["row"])
+                    newer["row"] = merged
+                    newer["insert"] = entry["insert"]
+                    newer["enqueued_at"] = min(newer["enqueued_at"], entry["enqueued_at"])
+                    newer["attempts"] = max(newer["attempts"], entry["attempts"])
+                    newer["not_before"] = now + min(30.0, 0.5 * 2 ** entry["attempts"])
+                else:
+                    entry["not_before"] = now + min(30.0, 0.5 * 2 ** entry["attempts"])
+                    self._pending[rid] = entry
+        if spill:
+            self._spill(spill)
+
+    def _spill(self, entries):
+        rows = [{"insert": e["insert"], "row": e["row"]} for e in entries]
+        try:
+            with open(self.spill_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, default=str) + "\n")
+            with self._lock:
+                self._stats["spilled_total"] += len(rows)
+            print(f"[PERSIST] spilled {len(rows)} rows to {self.spill_path}")
+        except Exception as e:
+            print("[PERSIST] spill failed, rows dropped:", e)
+
+    def _replay_spill(self):
+        if not os.path.exists(self.spill_path):
+            return
+        replay = self.spill_path + ".replay"
+        try:
+            os.replace(self.spill_path, replay)
+        except OSError:
+            return
+        rows = []
+        with open(replay, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    print("[PERSIST] skipping corrupt spill line")
+        os.remove(replay)
+        for line in rows:
+            # older spill files hold bare rows; replaying them as scoped updates is the safe reading
+            wrapped = "row" in line and "insert" in line
+            try:
+                self.put(line["row"] if wrapped else line, insert=wrapped and line["insert"])
+            except ValueError as e:
+                print("[PERSIST] skipping spilled row:", e)
+        with self._lock:
+            self._stats["replayed_total"] += len(rows)
+        if rows:
+            print(f"[PERSIST] replaying {len(rows)} spilled rows")
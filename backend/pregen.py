@@ -0,0 +1,243 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+import hostlock
+from metrics import metrics, span
+from status_phrases import strip_filler
+
+# Pre-generation of popular prompts while the service is idle.
+#
+# Every new-model request is recorded under its normalized prompt ("Can you
+# make me a gear, please?" -> "gear") by PopularityTracker, a counter that
+# decays with a POPULAR_HALF_LIFE_H half-life so yesterday's fad fades out.
+#
+# When no generation job is queued or running and none was requested for
+# PREGEN_IDLE_S, the Pregenerator takes the PREGEN_TOP_N most popular prompts
+# scoring at least PREGEN_MIN_SCORE and builds the missing ones, one at a
+# time, with the `build(prompt)` callback from app.py: SCAD from the CAD
+# engine, a full render through the converter (which also validates that the
+# SCAD compiles), and the spoken summary with its audio. A request for a warm
+# prompt is answered from WarmCache without an LLM call. Entries expire after
+# PREGEN_TTL_H and are rebuilt if still popular; at most PREGEN_MAX_PER_HOUR
+# builds run per hour, and a prompt whose build failed waits
+# PREGEN_RETRY_S before it is tried again.
+#
+# Pre-generation spends real LLM, render and TTS budget, so it is off unless
+# PREGEN_INTERVAL_S is set. Only one process per host runs the builder: the
+# worker holding the PREGEN_DIR lock file. Built entries are also written to
+# PREGEN_DIR, so every gunicorn worker answers warm prompts from them, but
+# each worker counts popularity only for the requests it serves itself.
+
+HALF_LIFE_S = float(os.getenv("POPULAR_HALF_LIFE_H", "24")) * 3600
+MAX_PROMPTS = int(os.getenv("POPULAR_MAX_PROMPTS", "5000"))
+TOP_N = int(os.getenv("PREGEN_TOP_N", "20"))
+MIN_SCORE = float(os.getenv("PREGEN_MIN_SCORE", "2.5"))  # ~3 requests within a half-life
+IDLE_S = float(os.getenv("PREGEN_IDLE_S", "60"))
+INTERVAL_S = float(os.getenv("PREGEN_INTERVAL_S", "0"))  # opt-in, e.g. 15; 0 disables the worker
+TTL_S = float(os.getenv("PREGEN_TTL_H", "24")) * 3600
+CACHE_MAX = int(os.getenv("PREGEN_CACHE_MAX", "64"))
+MAX_PER_HOUR = int(os.getenv("PREGEN_MAX_PER_HOUR", "12"))
+RETRY_S = float(os.getenv("PREGEN_RETRY_S", "3600"))
+SHARED_DIR = os.getenv("PREGEN_DIR", os.path.join(tempfile.gettempdir(), "vibecad-pregen"))
+
+_POLITE_TAIL = re.compile(r"(?:\s+(?:please|thanks|thank you|now|for me))+$")
+
+
+def normalize_prompt(prompt: str) -> str:
+    return _POLITE_TAIL.sub("", strip_filler(prompt)).strip()
+
+
+class PopularityTracker:
+    def __init__(self, half_life_s: float = HALF_LIFE_S, max_prompts: int = MAX_PROMPTS):
+        self.half_life_s = half_life_s
+        self.max_prompts = max_prompts
+        self._prompts = {}  # normalized -> {"score", "at", "prompt" (latest wording), "seen"}
+        self._lock = threading.Lock()
+        self.last_activity = 0.0
+
+    def _decayed(self, entry: dict, now: float) -> float:
+        return entry["score"] * 0.5 ** ((now - entry["at"]) / self.half_life_s)
+
+    def record(self, prompt: str) -> str:
+        norm = normalize_prompt(prompt)
+        now = time.time()
+        with self._lock:
+            self.last_activity = now
+            if not norm:
+                return norm
+            entry = self._prompts.get(norm)
+            if entry is None:
+                entry = self._prompts[norm] = {"score": 0.0, "at": now, "seen": 0}
+            entry.update(score=self._decayed(entry, now) + 1.0, at=now, prompt=prompt.strip())
+            entry["seen"] += 1
+            if len(self._prompts) > self.max_prompts:
+                # drop the coldest tenth in one pass rather than one per record
+                coldest = sorted(self._prompts, key=lambda k: self._decayed(self._prompts[k], now))
+                for k in coldest[: max(1, self.max_prompts // 10)]:
+                    del self._prompts[k]
+        return norm
+
+    def top(self, n: int, min_score: float = 0.0) -> list[dict]:
+        """Most popular prompts first: [{"norm", "prompt", "score", "seen"}]."""
+        now = time.time()
+        with self._lock:
+            ranked = [{"norm": k, "prompt": e["prompt"], "score": self._decayed(e, now), "seen": e["seen"]}
+                      for k, e in self._prompts.items()]
+        ranked = [r for r in ranked if r["score"] >= min_score]
+        ranked.sort(key=lambda r: r["score"], reverse=True)
+        return ranked[:n]
+
+
+class WarmCache:
+    """Pre-built results by normalized prompt, LRU, each valid for `ttl_s`. With a
+    `shared_dir`, entries are also kept there as JSON for the other worker processes."""
+
+    def __init__(self, max_entries: int = CACHE_MAX, ttl_s: float = TTL_S, shared_dir: str | None = SHARED_DIR):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.shared_dir = shared_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _shared_path(self, norm: str) -> str:
+        return os.path.join(self.shared_dir, hashlib.sha256(norm.encode("utf-8")).hexdigest() + ".json")
+
+    def _load_shared(self, norm: str) -> dict | None:
+        if not self.shared_dir:
+            return None
+        try:
+            with open(self._shared_path(norm), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if entry.get("norm") == norm else None
+
+    def get(self, norm: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(norm)
+        if entry is None:
+            entry = self._load_shared(norm)  # built by the pre-generating worker
+            if entry is None:
+                return None
+        with self._lock:
+            if time.time() - entry["built_at"] > self.ttl_s:
+                self._entries.pop(norm, None)
+                return None
+            self._entries[norm] = entry
+            self._entries.move_to_end(norm)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def put(self, norm: str, entry: dict):
+        entry = {**entry, "norm": norm, "built_at": time.time()}
+        with self._lock:
+            self._entries[norm] = entry
+            self._entries.move_to_end(norm)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self.shared_dir:
+            try:
+                os.makedirs(self.shared_dir, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=self.shared_dir, suffix=".part")
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entry, f)
+                os.replace(tmp, self._shared_path(norm))
+            except OSError as e:
+                print("[PREGEN] could not share warm entry:", e)
+
+    def drop(self, norm: str):
+        with self._lock:
+            self._entries.pop(norm, None)
+        if self.shared_dir:
+            try:
+                os.remove(self._shared_path(norm))
+            except OSError:
+                pass
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Pregenerator:
+    def __init__(self, tracker: PopularityTracker, cache: WarmCache, build, busy,
+                 top_n: int = TOP_N, min_score: float = MIN_SCORE, idle_s: float = IDLE_S,
+                 max_per_hour: int = MAX_PER_HOUR):
+        self.tracker = tracker
+        self.cache = cache
+        self._build = build   # prompt -> warm entry (raises on failure)
+        self._busy = busy     # () -> True while user work is queued or running
+        self.top_n = top_n
+        self.min_score = min_score
+        self.idle_s = idle_s
+        self.max_per_hour = max_per_hour
+        self._recent = []     # start times of builds in the last hour
+        self._failed = {}     # normalized prompt -> time of its last failed build
+        self._thread = None
+        self._stats = {"built": 0, "failed": 0, "last_built": None, "last_error": None}
+
+    def start(self, interval_s: float = INTERVAL_S, lock_dir: str = SHARED_DIR):
+        if interval_s <= 0 or self._thread is not None:
+            return None
+        if not hostlock.claim(os.path.join(lock_dir, "builder.lock")):
+            print("[PREGEN] another worker process is pre-generating; serving its warm entries")
+            return None
+
+        def loop():
+            while True:
+                time.sleep(interval_s)
+                try:
+                    if self.idle():
+                        self.run_once()
+                except Exception as e:
+                    print("[PREGEN] pass failed:", e)
+
+        self._thread = threading.Thread(target=loop, name="pregen", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def idle(self) -> bool:
+        return not self._busy() and time.time() - self.tracker.last_activity >= self.idle_s
+
+    def candidates(self) -> list[dict]:
+        now = time.time()
+        return [c for c in self.tracker.top(self.top_n, self.min_score)
+                if self.cache.get(c["norm"]) is None and now - self._failed.get(c["norm"], 0) >= RETRY_S]
+
+    def run_once(self) -> str | None:
+        """Build the most popular missing prompt; returns its normalized form (None: nothing to do)."""
+        now = time.time()
+        self._recent = [t for t in self._recent if now - t < 3600]
+        if len(self._recent) >= self.max_per_hour:
+            return None
+        todo = self.candidates()
+        if not todo:
+            return None
+        item = todo[0]
+        self._recent.append(now)
+        print(f"[PREGEN] building {item['norm']!r} (score {item['score']:.1f})")
+        try:
+            with span("pregen_build"):
+                entry = self._build(item["prompt"])
+        except Exception as e:
+            self._failed[item["norm"]] = time.time()
+            self._stats.update(failed=self._stats["failed"] + 1, last_error=f"{item['norm']}: {e}")
+            metrics.count("pregen_builds", "Idle-time pre-generation builds by outcome.", outcome="error")
+            print(f"[PREGEN] {item['norm']!r} failed:", e)
+            return item["norm"]
+        self._failed.pop(item["norm"], None)
+        self.cache.put(item["norm"], entry)
+        self._stats.update(built=self._stats["built"] + 1, last_built=item["norm"])
+        metrics.count("pregen_builds", "Idle-time pre-generation builds by outcome.", outcome="ok")
+        return item["norm"]
+
+    def stats(self) -> dict:
+        return {**self._stats, "warm": len(self.cache), "builds_last_hour": len(self._recent),
+                "builder": self._thread is not None, "idle": self.idle(),
+                "top": self.tracker.top(self.top_n)}
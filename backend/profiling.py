@@ -0,0 +1,155 @@
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# Opt-in per-request stack sampling.
+#
+# A profiled request registers its thread (and any job threads it starts, see
+# jobs.py) with a background sampler that snapshots their Python stacks every
+# PROFILE_INTERVAL_MS via sys._current_frames(). Coroutines show up on the
+# stack of the thread whose event loop is running them, so Dedalus/asyncio
+# work is captured too. Samples are kept per request id and exported as
+# collapsed stacks ("frame;frame;frame count"), the input format of
+# flamegraph.pl and speedscope.
+#
+# A request is profiled when it carries `X-Profile: <ADMIN_TOKEN>` or is picked
+# by PROFILE_SAMPLE_RATE (0..1). Without ADMIN_TOKEN the header is ignored.
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0
+MAX_PROFILES = int(os.getenv("PROFILE_MAX_STORED", "50"))
+MAX_DEPTH = 128
+
+_active = contextvars.ContextVar("active_profile", default=None)
+
+
+class Profile:
+    def __init__(self, request_id: str, label: str = ""):
+        self.request_id = request_id
+        self.label = label
+        self.started_at = time.time()
+        self.finished_at = None
+        self.samples = 0
+        self.stacks = Counter()   # collapsed stack -> sample count
+        self.threads = {}         # thread id -> thread name
+        self.extra = {}
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        end = self.finished_at or time.time()
+        return {
+            "request_id": self.request_id,
+            "label": self.label,
+            "started_at": self.started_at,
+            "duration_ms": round((end - self.started_at) * 1000, 1),
+            "samples": self.samples,
+            "threads": len(self.threads),
+            "finished": self.finished_at is not None,
+            **self.extra,
+        }
+
+
+class Profiler:
+    def __init__(self, interval: float = INTERVAL, max_profiles: int = MAX_PROFILES):
+        self.interval = interval
+        self.max_profiles = max_profiles
+        self._running = {}              # request id -> Profile being sampled
+        self._stored = OrderedDict()    # request id -> Profile, oldest first
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def should_profile(self, header_value: str | None) -> bool:
+        if ADMIN_TOKEN and header_value and header_value == ADMIN_TOKEN:
+            return True
+        return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+    def start(self, request_id: str, label: str = "") -> Profile:
+        """Start profiling the current thread on behalf of `request_id`."""
+        profile = Profile(request_id, label)
+        _active.set(profile)
+        with self._lock:
+            self._running[request_id] = profile
+            self._stored[request_id] = profile
+            while len(self._stored) > self.max_profiles:
+                self._stored.popitem(last=False)
+        self.attach_thread()
+        self._ensure_sampler()
+        return profile
+
+    def attach_thread(self):
+        """Add the current thread to the active profile, if this context has one."""
+        profile = _active.get()
+        if profile is not None and profile.finished_at is None:
+            t = threading.current_thread()
+            profile.threads[t.ident] = t.name
+
+    def finish(self, **extra) -> Profile | None:
+        profile = _active.get()
+        if profile is None:
+            return None
+        _active.set(None)
+        profile.finished_at = time.time()
+        profile.extra.update(extra)
+        with self._lock:
+            self._running.pop(profile.request_id, None)
+        return profile
+
+    def get(self, request_id: str) -> Profile | None:
+        with self._lock:
+            return self._stored.get(request_id)
+
+    def list(self) -> list[dict]:
+        with self._lock:
+            profiles = list(self._stored.values())
+        return [p.summary() for p in reversed(profiles)]
+
+    # ------------------------------ sampler -------------------------------
+    def _ensure_sampler(self):
+        self._wake.set()
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._thread.start()
+
+    def _sample_loop(self):
+        while True:
+            with self._lock:
+                running = list(self._running.values())
+            if not running:
+                # sleep until the next profiled request
+                self._wake.clear()
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            for profile in running:
+                for tid, name in list(profile.threads.items()):
+                    frame = frames.get(tid)
+                    if frame is not None:
+                        profile.stacks[_collapse(name, frame)] += 1
+                profile.samples += 1
+            del frames
+            time.sleep(self.interval)
+
+
+def _collapse(thread_name: str, frame) -> str:
+    parts = []
+    while frame is not None and len(parts) < MAX_DEPTH:
+        code = frame.f_code
+        parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    parts.append(thread_name.replace(";", ":").replace(" ", "_"))
+    return ";".join(reversed(parts)).replace(" ", "_")
+
+
+profiler = Profiler()
@@ -1,5 +1,11 @@
-def mkprompt(p: str) -> str:
-    return f"""
+# Prompt text for CAD generation.
+#
+# The large static instruction blocks are module constants and the
+# per-request text is always appended last, so every call starts with a
+# byte-identical prefix that providers can cache (Anthropic cache_control via
+# cached_system(), prefix caching behind Dedalus' prompt_cache_key).
+
+MKPROMPT_INSTRUCTIONS = """
         Help me write a role-based prompt to generate an OpenSCAD code for the user's request. 
         
         YOU NEED TO USE MCAD LIBRARIES BUILT INTO OPENS CAD WHENEVER APPROPRIATE; ALL ITEMS MUST BE ATTACHED TOGETHER, AND THERE SHOULD NOT BE ANY RANDOM FLOATING BODIES.
@@ -10,8 +16,6 @@ def mkprompt(p: str) -> str:
         
         Also, make sure the prompt specifies that the only return should be OpenSCAD code, with no supporting text or dialogue. 
         
-        Here's the user's request: {p}
-        
         Here's an example of a good prompt: 
         
     			(Give me an OpenSCAD file of a cone:
@@ -40,23 +44,207 @@ def mkprompt(p: str) -> str:
 
         MAKE SURE NOT TO WRAP THE FINAL OPENSCAD CODE IN ANY MARKDOWN OR CODE BLOCKS. KEEP IT PLAIN TEXT.
 
+"""
+
+def mkprompt(p: str) -> str:
+    return MKPROMPT_INSTRUCTIONS + f"""
+        Here's the user's request: {p}
     """
 
-def editprompt(p: str, fix: str) -> str:
-	return f"""
-		Here is the user's feedback on what needs to be fixed in the generated OpenSCAD code:
-		{fix}
-            
-        Here is the original openScad code {p} that was generated based on the user's first request.
-        
+EDITPROMPT_INSTRUCTIONS = """
         I WANT YOU TO UNDERSTAND THE OLD CODE FULLY, MAKE CHANGES ONLY TO WHAT THE USER HAS REQUESTED
         USE SONAR TO HELP YOU UNDERSTAND THE OPENSCAD CODE IF NEEDED.
 
-		Based on this feedback, help me write a new and improved role-based prompt to generate an updated OpenSCAD code that addresses the user's concerns. 
+		Based on the user's feedback below, help me write a new and improved role-based prompt to generate an updated OpenSCAD code that addresses the user's concerns. 
 
 		Make sure to keep all the original requirements from the first iteration (MAKE SURE TO UNDERSTAND WHAT THE OPENSCAD CODE IS DOING), but also address the new issues raised by the user. 
 
 		REMEMBER TO USE MCAD LIBRARIES BUILT INTO OPENS CAD WHENEVER APPROPRIATE; ALL ITEMS MUST BE ATTACHED TOGETHER, AND THERE SHOULD NOT BE ANY RANDOM FLOATING BODIES.
 		ALSO, MAKE SURE THE PROMPT SPECIFIES THAT THE ONLY RETURN SHOULD BE OPENS CAD CODE, WITH NO SUPPORTING TEXT OR DIALOGUE.
 
-		HERE IS THE GIT LINK SO YOU CAN UNDERSTAND WHAT I MEAN BY MCAD LIBRARY: https://github.com/openscad/MCAD  """
\ No newline at end of file
+		HERE IS THE GIT LINK SO YOU CAN UNDERSTAND WHAT I MEAN BY MCAD LIBRARY: https://github.com/openscad/MCAD  
+"""
+
+def editprompt(p: str, fix: str) -> str:
+	return EDITPROMPT_INSTRUCTIONS + f"""
+        Here is the original openScad code that was generated based on the user's first request:
+        {p}
+
+		Here is the user's feedback on what needs to be fixed in the generated OpenSCAD code:
+		{fix}
+    """
+
+def directprompt(p: str) -> str:
+    """User turn for the single-call pipeline (fin.gen_cad_direct); the requirements that
+    mkprompt would spell out are already in GEN_CAD_SYSTEM."""
+    return f"""Give me an OpenSCAD file of: {p}
+
+Make it realistic and recognisable as the real object: capture the details that make the item what it is,
+and follow the output rules and MCAD usage above."""
+
+# Orchestrator instructions for fin.get_cad (the user request is the run input)
+GET_CAD_INSTRUCTIONS = """use mkprompt to make a proper prompt for cad generation based on the user request you are given
+                then use gen_cad and pass in the prompt you made to generate the openSCAD code for the user request
+                use all tools available to you to make the best description of the cad model possible, 
+                make the prompt very detailed so that the generated cad model is as accurate as possible to the user request
+                make sure to mention in the prompt to use MCAD libraries built into OpenSCAD whenever appropriate; moreover, all items must be attached together and there should not be any random floating bodies.
+                also, make sure the prompt specifies that the only return should be OpenSCAD code, with no supporting text or dialogue.
+                
+                WHENEVER YOU WANT TO IMPORT AN MCAD LIBRARY, MAKE SURE IT ACTUALLY EXISTS IN https://github.com/openscad/MCAD
+                I DONT WANT ANY HALLUCINATED LIBRARIES IN THE OPENSCAD CODE.
+
+                
+                the openScad code should be stored and not returned into the terminal. 
+                THE OPENSCAD CODE SHOULD BE WRITTEEN INTO A FILE VIA gen_cad
+
+                MAKE SURE THE ONLY THING PASSSED INTO GEN_CAD IS THE PROMPT FOR CAD GENERATION
+                THE FULL_TEXT IN GEN CAD SHOULD NOT BE WRITTEN TO THE SCAD FILE, ONLY THE OPEN SCAD CODE
+
+                YOU NEED TO WAIT UNTIL gen_cad HAS FINISHED WRITING THE FILE BEFORE YOU FINISH YOUR RESPONSE
+
+                ADDITIONALLY, IN THE output.scad FILE MAKE SURE TO REMOVE THE FIRST LINE IF IT CONTAINS ANYTHING LIKE "```openscad" OR "```"
+                AND THE LAST LINE IF IT CONTAINS "```"
+
+                DO NOT RUN GEN_CAD MORE THAN ONCE PER REQUEST, TRY TO GET THE BEST PROMPT POSSIBLE IN ONE GO, RE-ITERATE THE PROMPT
+                RATHER THAN CALLING GEN_CAD MULTIPLE TIMES.
+                """
+
+# Orchestrator instructions for testing.iterate_cad (the fix and old code are the run input)
+ITERATE_CAD_INSTRUCTIONS = """You are given the user's fix to an old request and the generated openSCAD code of the original request.
+                
+                Analyze the openSCAD code and see if it meets all the requirements of the user's original request.
+                If it does, respond with "The openSCAD code meets all the requirements."
+                If it does not, identify the shortcomings and generate a new prompt to fix the issues.
+                Use editprompt to create a new prompt that addresses the shortcomings and improves the openSCAD code.
+                --- pass in the old openSCAD code and the user's fix into editprompt to make the new prompt --- IMPORTANT
+
+                THEN, use gen_cad to generate a new openSCAD code based on the new prompt.
+                
+                MAKE SURE TO FOLLOW ALL THE GUIDELINES ABOUT USING MCAD LIBRARIES BUILT INTO OPENS CAD WHENEVER APPROPRIATE; 
+                ALL ITEMS MUST BE ATTACHED TOGETHER, AND THERE SHOULD NOT BE ANY RANDOM FLOATING BODIES.
+                
+                ALSO, MAKE SURE THE PROMPT SPECIFIES THAT THE ONLY RETURN SHOULD BE OPENS CAD CODE, WITH NO SUPPORTING TEXT OR DIALOGUE.
+                
+                THE NEW OPENSCAD CODE SHOULD BE WRITTEN INTO A FILE VIA gen_cad
+                
+                MAKE SURE THE ONLY THING PASSSED INTO GEN_CAD IS THE PROMPT FOR CAD GENERATION
+                THE FULL_TEXT IN GEN CAD SHOULD NOT BE WRITTEN TO THE SCAD FILE, ONLY THE OPEN SCAD CODE
+
+                YOU NEED TO WAIT UNTIL gen_cad HAS FINISHED WRITING THE FILE BEFORE YOU FINISH YOUR RESPONSE
+
+                ADDITIONALLY, IN THE output.scad FILE MAKE SURE TO REMOVE THE FIRST LINE IF IT CONTAINS ANYTHING LIKE "```openscad" OR "```"
+                AND THE LAST LINE IF IT CONTAINS "```"
+                """
+
+# System prefix for the code-generation call in gen_cad. Anthropic only caches
+# prefixes of 1024+ tokens, so the MCAD catalogue and compile rules live here
+# once rather than being restated in every generated prompt.
+GEN_CAD_SYSTEM = """You are an expert OpenSCAD engineer. You receive a detailed description of one object
+and answer with a single complete OpenSCAD program for it.
+
+Output rules:
+- Return ONLY OpenSCAD code. No prose, no explanations, no markdown, no code fences.
+- The program must compile with a stock OpenSCAD 2021+ install and render with CGAL.
+- Every part must be attached to the rest of the model; there must be no floating bodies.
+- Keep overall dimensions small (at most ~25 units along any axis) so the model compiles quickly.
+- Declare every variable before it is used and never reassign a variable in the same scope.
+- Prefer `$fn` values of 64 or lower; avoid minkowski() and deep hull() chains on curved parts.
+- Use union(), difference() and intersection() explicitly; do not rely on implicit unions across modules.
+
+MCAD usage:
+- Use the MCAD library bundled with OpenSCAD whenever it fits the object, with `use <MCAD/file.scad>`
+  or `include <MCAD/file.scad>`. Only the files below exist; never import anything else from MCAD.
+  - MCAD/2Dshapes.scad: ellipse, ngon, complexRoundSquare, pieSlice, donutSlice
+  - MCAD/3d_triangle.scad: 3D triangles from side lengths
+  - MCAD/bearing.scad: bearing(pos, angle, model) for standard ball bearings (608 etc.)
+  - MCAD/boxes.scad: roundedBox(size, radius, sidesonly)
+  - MCAD/constants.scad: common constants (TAU, PI, mm_per_inch, ...)
+  - MCAD/curves.scad: helix and curve helpers
+  - MCAD/gears.scad: gear(), simple spur gears (legacy)
+  - MCAD/involute_gears.scad: gear(), bevel_gear(), rack() with involute teeth
+  - MCAD/hardware.scad: rods, bearings and hardware placeholders
+  - MCAD/layouts.scad: list(), grid() layout helpers
+  - MCAD/lego_compatibility.scad: block() for LEGO-compatible bricks
+  - MCAD/libtriangles.scad: triangle prisms and wedges
+  - MCAD/linear_bearing.scad: linearBearing(model) for LMxxUU bearings
+  - MCAD/materials.scad: color constants for materials
+  - MCAD/math.scad: deg(), small math helpers
+  - MCAD/metric_fastners.scad: bolt(), washer(), flat_nut(), cap_bolt()
+  - MCAD/motors.scad: stepper_motor_mount()
+  - MCAD/multiply.scad: spin(), radial_array()
+  - MCAD/nuts_and_bolts.scad: nutHole(), boltHole()
+  - MCAD/polyholes.scad: polyhole() for accurately sized printed holes
+  - MCAD/profiles.scad: extrusion profiles
+  - MCAD/regular_shapes.scad: triangle, pentagon, hexagon, octagon, regular_polygon, cone, torus, prisms
+  - MCAD/screw.scad: helix(), auger(), ball_groove()
+  - MCAD/servos.scad: servo outlines (towerprosg90, futabas3003, ...)
+  - MCAD/shapes.scad: box(), roundedBox(), cone(), ellipticalCylinder(), tube(), hexagon(), octagon()
+  - MCAD/stepper.scad: motor(Nema17, ...) NEMA stepper models
+  - MCAD/teardrop.scad: teardrop() overhang-safe holes
+  - MCAD/transformations.scad: mirror/scale helpers
+  - MCAD/triangles.scad: triangle(), a_triangle()
+  - MCAD/trochoids.scad: epitrochoid(), hypotrochoid() shapes
+  - MCAD/units.scad: mm, cm, inch, M3..M8 sizes, epsilon
+  - MCAD/utilities.scad: distance(), length2(), normalized()
+- Use at least one MCAD module when the object reasonably allows it, but do not force MCAD parts that
+  change what the object is.
+
+Modelling guidance:
+- Start from the object's real-world proportions and scale them down uniformly to fit the size limit.
+- Build the model from named modules (one per logical part) and assemble them in a final top-level call.
+- Hollow parts need explicit wall thicknesses; keep walls at least 1 unit thick.
+- Align parts on shared faces or overlap them slightly (0.01 units) so unions are manifold.
+- Put the model's base on z = 0 and centre it on the x/y origin.
+- Comment each module in one short line so later edits can find the right part.
+
+Common compile failures to avoid (these break the STL conversion step):
+- Undefined variables or modules: every identifier must be defined in this file or in an MCAD file
+  imported above. Do not call functions from other libraries (BOSL, BOSL2, threads.scad, ...).
+- Degenerate geometry: no zero-thickness walls, zero-height cylinders, scale factors of 0 or
+  polygons with repeated or collinear points.
+- Coincident faces in difference(): extend subtracted shapes 0.01 units past the surfaces they cut.
+- Recursive modules without a depth limit, and for() loops producing thousands of children.
+- Text: only use text() with the default font and keep it shallow when extruded.
+- linear_extrude() and rotate_extrude() need 2D children; rotate_extrude() children must lie
+  entirely on the positive x side.
+- Do not use import(), surface() or any external file other than the MCAD files listed above.
+
+Before answering, check that the program defines every variable it uses, imports only the MCAD files
+it needs, has exactly one top-level assembly, and contains nothing but OpenSCAD code.
+"""
+
+def cached_system(text: str) -> list[dict]:
+    """An Anthropic `system` block marked for prompt caching (ephemeral, ~5 minute TTL)."""
+    return [{"type": "text", "text": text, "cache_control": {"type": "ephemeral"}}]
+
+
+# Models often wrap the code in a fenced block even when told not to; every
+# pipeline strips it before the code is stored or rendered.
+def strip_markdown_fences(code: str) -> str:
+    """
+    Remove markdown code fences from SCAD code.
+    Handles various formats:
+    - ```openscad ... ```
+    - ```scad ... ```
+    - ```plaintext ... ```
+    - ``` ... ```
+    - With or without whitespace
+    """
+    code = code.strip()
+    
+    # Split into lines for robust fence detection
+    lines = code.split('\n')
+    
+    # Remove opening fence: Check first line for any fence format
+    if lines and lines[0].strip().startswith('```'):
+        fence_type = lines[0].strip()
+        lines = lines[1:]
+        print(f"[strip_markdown_fences] Stripped opening fence: {fence_type}")
+    
+    # Remove closing fence: Check last line
+    if lines and lines[-1].strip() == '```':
+        lines = lines[:-1]
+        print(f"[strip_markdown_fences] Stripped closing fence")
+    
+    result = '\n'.join(lines).strip()
+    return result
@@ -0,0 +1,288 @@
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+# Pluggable upstream providers.
+#
+# Route code asks this module for its clients instead of constructing them:
+#
+#   elevenlabs()      STT + TTS client (None when ELEVENLABS_API_KEY is unset)
+#   dedalus_runner()  a DedalusRunner for short LLM calls (None without DEDALUS_API_KEY)
+#   db()              Supabase client
+#   cad()             SCAD generator: .generate(prompt, variant=None) / .iterate(prompt, old_scad)
+#   hunyuan()         Gradio client for tencent/Hunyuan3D-2
+#   kittycad()        KittyCAD/Zoo client for text-to-CAD (None without KITTYCAD_API_TOKEN;
+#                     needs `pip install kittycad`)
+#   converter()       the Node SCAD -> STL converter (backend/nodeserv, SCAD_CONVERTER_URL)
+#
+# VIBECAD_PROVIDERS selects deterministic local fakes (fakes.py) instead of
+# the real services: "fake" for all of them, or a comma list such as
+# "cad,db". Fakes need no network or API keys, which is what the benchmark
+# suite (benchmark.py) runs against.
+#
+# Nothing here is imported or connected at module load. start_warmup() builds
+# the clients in a background thread once the app is up, so the first request
+# usually finds them ready without making worker boot wait on SDK imports.
+
+PROVIDER_NAMES = ("elevenlabs", "dedalus", "db", "cad", "hunyuan", "kittycad", "converter")
+
+_clients = {}
+_locks = {name: threading.Lock() for name in PROVIDER_NAMES}
+
+
+def _fake_names() -> set:
+    raw = os.getenv("VIBECAD_PROVIDERS", "").strip().lower()
+    if raw in ("fake", "fakes", "all"):
+        return set(PROVIDER_NAMES)
+    return {n.strip() for n in raw.split(",") if n.strip()}
+
+
+def is_fake(name: str) -> bool:
+    return name in _fake_names()
+
+
+def _cached(name: str, build):
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    # Per-provider lock: a slow Hunyuan connect must not hold up db()
+    with _locks[name]:
+        if name not in _clients:
+            _clients[name] = build()
+        return _clients[name]
+
+
+def reset():
+    """Drop cached clients (e.g. after changing VIBECAD_PROVIDERS)."""
+    _clients.clear()
+
+
+def run_coro(coro_fn):
+    """Run a coroutine from sync code, even if this thread already has a loop."""
+    try:
+        return asyncio.run(coro_fn())
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(coro_fn())
+        finally:
+            loop.close()
+
+
+# ------------------------------- ElevenLabs -------------------------------
+def elevenlabs():
+    if is_fake("elevenlabs"):
+        import fakes
+        return _cached("elevenlabs", fakes.FakeElevenLabs)
+
+    def build():
+        api_key = os.getenv("ELEVENLABS_API_KEY")
+        if not api_key:
+            print("[WARN] ELEVENLABS_API_KEY not set. /api/transcribe will return 501 until provided.")
+            return False
+        from elevenlabs import ElevenLabs
+        return ElevenLabs(api_key=api_key)
+    return _cached("elevenlabs", build) or None
+
+
+# -------------------------------- Dedalus ---------------------------------
+def dedalus_configured() -> bool:
+    return is_fake("dedalus") or bool(os.getenv("DEDALUS_API_KEY"))
+
+
+def dedalus_runner():
+    """A fresh runner per call: AsyncDedalus' HTTP pool is bound to the event loop
+    that first used it, and every sync caller here runs its own loop."""
+    if is_fake("dedalus"):
+        import fakes
+        return fakes.FakeDedalusRunner()
+    if not os.getenv("DEDALUS_API_KEY"):
+        return None
+    from dedalus_labs import AsyncDedalus, DedalusRunner
+    return DedalusRunner(AsyncDedalus())
+
+
+def _warm_dedalus():
+    if not is_fake("dedalus") and os.getenv("DEDALUS_API_KEY"):
+        import dedalus_labs  # noqa: F401  (the import is the slow part)
+
+
+# -------------------------------- Supabase --------------------------------
+def db():
+    if is_fake("db"):
+        import fakes
+        return _cached("db", fakes.FakeSupabase)
+
+    def build():
+        from supabase import create_client
+        client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_ANON_KEY"))
+        print("[INFO] Supabase client initialized")
+        return client
+    return _cached("db", build)
+
+
+# ---------------------------------- CAD -----------------------------------
+class DedalusCad:
+    """fin.get_cad / testing.iterate_cad. Both return their SCAD; the shared output files
+    are only a last-resort fallback, since concurrent jobs overwrite them. Returned text
+    may still carry markdown fences."""
+
+    def warm(self):
+        import fin, testing  # noqa: F401  (pulls in dedalus_labs + anthropic)
+
+    def generate(self, prompt: str, variant: str | None = None) -> str | None:
+        from fin import get_cad
+        code = run_coro(lambda: get_cad(prompt, variant))
+        return code if code is not None else self._read("output.scad")
+
+    def iterate(self, prompt: str, old_scad: str) -> str | None:
+        from testing import iterate_cad
+        code = run_coro(lambda: iterate_cad(prompt, old_scad))
+        return code if code is not None else self._read("outputIterated.scad")
+
+    @staticmethod
+    def _read(path: str) -> str | None:
+        p = Path(path)
+        return p.read_text(encoding="utf-8") if p.exists() else None
+
+
+# Batch variants of one prompt share its prompt prefix: the first variant registers
+# on_prefix_ready() and CAD implementations call prefix_ready() once the model has
+# processed (and cached) that prefix, which lets the sibling variants start warm.
+_prefix_hook = contextvars.ContextVar("cad_prefix_hook", default=None)
+
+
+def on_prefix_ready(fn):
+    _prefix_hook.set(fn)
+
+
+def prefix_ready():
+    fn = _prefix_hook.get()
+    if fn is not None:
+        fn()
+
+
+def cad():
+    if is_fake("cad"):
+        import fakes
+        return _cached("cad", fakes.FakeCad)
+    return _cached("cad", DedalusCad)
+
+
+# --------------------------------- Hunyuan --------------------------------
+def hunyuan():
+    if is_fake("hunyuan"):
+        import fakes
+        return _cached("hunyuan", fakes.FakeGradioClient)
+
+    def build():
+        from gradio_client import Client
+        last_err = None
+        hf_token = os.getenv("HUGGINGFACE_TOKEN")
+        for _ in range(3):
+            try:
+                return Client("tencent/Hunyuan3D-2", hf_token=hf_token) if hf_token else Client("tencent/Hunyuan3D-2")
+            except Exception as e:
+                last_err = e
+                time.sleep(2)
+        raise last_err
+    return _cached("hunyuan", build)
+
+
+# -------------------------------- KittyCAD --------------------------------
+def kittycad():
+    if is_fake("kittycad"):
+        import fakes
+        return _cached("kittycad", fakes.FakeKittyCAD)
+
+    def build():
+        if not (os.getenv("KITTYCAD_API_TOKEN") or os.getenv("ZOO_API_TOKEN")):
+            return False
+        from kittycad import KittyCAD  # optional dependency
+        return KittyCAD()
+    return _cached("kittycad", build) or None
+
+
+# -------------------------------- Converter -------------------------------
+class ScadConverter:
+    """POST /convert-scad on the Node converter. render() returns {"ok", "url", "bytes",
+    "quality"} or {"ok": False, "error"}: SCAD that does not compile is a result, not an
+    exception, so it does not count against the converter's circuit breaker."""
+
+    def __init__(self, base_url: str, timeout: float = 300):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def render(self, scad: str, quality: str = "full") -> dict:
+        req = urllib.request.Request(
+            f"{self.base_url}/convert-scad",
+            data=json.dumps({"scad": scad, "quality": quality}).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                body = json.load(resp)
+        except urllib.error.HTTPError as e:
+            try:
+                detail = json.load(e).get("error")
+            except Exception:
+                detail = None
+            if e.code in (400, 500) and detail:  # server.js answers compile errors with 500
+                return {"ok": False, "error": detail}
+            raise
+        return {"ok": True, "url": body["url"], "bytes": body.get("bytes"),
+                "quality": body.get("quality", quality)}
+
+
+def converter():
+    if is_fake("converter"):
+        import fakes
+        return _cached("converter", fakes.FakeConverter)
+    return _cached("converter", lambda: ScadConverter(os.getenv("SCAD_CONVERTER_URL", "http://localhost:3001")))
+
+
+# --------------------------------- Warm-up --------------------------------
+def _warm_cad():
+    client = cad()
+    if hasattr(client, "warm"):
+        client.warm()
+
+
+_WARMERS = {
+    "db": db,
+    "elevenlabs": elevenlabs,
+    "dedalus": _warm_dedalus,
+    "cad": _warm_cad,
+    "hunyuan": hunyuan,
+    "kittycad": kittycad,
+    "converter": converter,
+}
+
+
+def warm_up(names=None):
+    """Import SDKs and build clients ahead of the first request. Failures are only
+    logged; the accessors retry on first real use."""
+    for name in names or PROVIDER_NAMES:
+        t0 = time.perf_counter()
+        try:
+            _WARMERS[name]()
+            print(f"[WARMUP] {name} ready in {(time.perf_counter() - t0) * 1000:.0f} ms")
+        except Exception as e:
+            print(f"[WARMUP] {name} failed:", e)
+
+
+def start_warmup():
+    """VIBECAD_WARMUP: "1" (default) warms every provider, "0" disables, or a comma list."""
+    raw = os.getenv("VIBECAD_WARMUP", "1").strip().lower()
+    if raw in ("0", "false", "no", ""):
+        return None
+    names = None if raw in ("1", "true", "yes", "all") else [n.strip() for n in raw.split(",") if n.strip() in _WARMERS]
+    t = threading.Thread(target=warm_up, args=(names,), name="provider-warmup", daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import request, jsonify, make_response
+
+from metrics import metrics
+
+# Per-user token-bucket rate limits for expensive endpoints.
+#
+# Routes are grouped into classes with their own bucket per user (userid, or
+# the client address for anonymous callers):
+#
+#   generation  chained /api/transcribe, /api/iterate, /api/claude/*,   (LLM CAD runs)
+#               /api/generation/batch (one token per item)
+#   hunyuan     /api/hunyuan/generate                                (GPU mesh runs)
+#   voice       /api/getresponse, /api/generate-model-summary        (short LLM + TTS)
+#   speech      /api/transcribe without chaining                     (STT only)
+#
+# A bucket holds up to `burst` tokens and refills at `per_minute`; each request
+# takes one, and an empty bucket answers 429 with Retry-After. Override with
+# RATE_LIMIT_<CLASS>="burst/per_minute" (e.g. RATE_LIMIT_HUNYUAN=1/1); set
+# RATE_LIMITS=0 to disable. Buckets live in this process unless
+# RATE_LIMIT_REDIS_URL is set (needs the `redis` package), in which case all
+# workers share them; Redis errors fall back to the local buckets.
+
+DEFAULT_LIMITS = {
+    "generation": (5, 10),
+    "hunyuan": (2, 2),
+    "voice": (20, 60),
+    "speech": (20, 60),
+}
+ENABLED = os.getenv("RATE_LIMITS", "1").lower() not in ("0", "false", "no")
+REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+MAX_BUCKETS = 50000
+
+
+def _limits(cls: str) -> tuple[float, float]:
+    """(burst, refill per second) for a class."""
+    burst, per_minute = DEFAULT_LIMITS.get(cls, DEFAULT_LIMITS["speech"])
+    env = os.getenv(f"RATE_LIMIT_{cls.upper()}")
+    if env:
+        b, _, p = env.partition("/")
+        burst, per_minute = float(b), float(p or b)
+    return float(burst), float(per_minute) / 60.0
+
+
+class LocalBuckets:
+    def __init__(self, max_buckets: int = MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._buckets = {}  # key -> [tokens, updated_at]
+        self._lock = threading.Lock()
+
+    def take(self, key: str, burst: float, rate: float, cost: float = 1.0) -> tuple[bool, float, float]:
+        """Returns (allowed, tokens left, seconds until `cost` tokens are available)."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._prune(now)
+                bucket = self._buckets[key] = [burst, now]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            bucket[0], bucket[1] = tokens, now
+        wait = 0.0 if allowed else (cost - tokens) / rate if rate else float("inf")
+        return allowed, tokens, wait
+
+    def _prune(self, now: float):
+        # full buckets carry no state worth keeping; drop the oldest half if still too many
+        idle = [k for k, (_, ts) in self._buckets.items() if now - ts > 3600]
+        for k in idle:
+            del self._buckets[k]
+        if len(self._buckets) >= self.max_buckets:
+            for k in sorted(self._buckets, key=lambda k: self._buckets[k][1])[: self.max_buckets // 2]:
+                del self._buckets[k]
+
+
+# Atomic refill-and-take on a Redis hash, timed by the Redis server clock.
+_TAKE_LUA = """
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or burst
+local ts = tonumber(b[2]) or now
+tokens = math.min(burst, tokens + (now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBuckets:
+    def __init__(self, url: str, prefix: str = "vibecad:rl:"):
+        import redis  # optional dependency, only needed with RATE_LIMIT_REDIS_URL
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url, socket_timeout=0.25, socket_connect_timeout=0.25)
+        self._script = self._client.register_script(_TAKE_LUA)
+
+    def take(self, key: str, burst: float, rate: float, cost: float = 1.0) -> tuple[bool, float, float]:
+        allowed, tokens = self._script(keys=[self.prefix + key], args=[burst, rate, cost])
+        tokens = float(tokens)
+        wait = 0.0 if allowed else (cost - tokens) / rate if rate else float("inf")
+        return bool(allowed), tokens, wait
+
+
+class RateLimiter:
+    def __init__(self, redis_url: str | None = REDIS_URL, enabled: bool = ENABLED):
+        self.enabled = enabled
+        self.local = LocalBuckets()
+        self.shared = None
+        if redis_url:
+            try:
+                self.shared = RedisBuckets(redis_url)
+                print("[RATELIMIT] using shared Redis buckets")
+            except Exception as e:
+                print("[RATELIMIT] Redis unavailable, using in-process buckets:", e)
+
+    def take(self, cls: str, who: str, cost: float = 1.0) -> tuple[bool, float, float]:
+        burst, rate = _limits(cls)
+        key = f"{cls}:{who}"
+        if self.shared is not None:
+            try:
+                return self.shared.take(key, burst, rate, cost)
+            except Exception as e:
+                print("[RATELIMIT] Redis take failed, using local bucket:", e)
+        return self.local.take(key, burst, rate, cost)
+
+
+def _requester() -> str:
+    body = request.get_json(silent=True) if request.is_json else None
+    userid = request.args.get("userid") or request.form.get("userid") or (body or {}).get("userid")
+    if userid:
+        return f"user:{userid}"
+    return f"addr:{request.access_route[0] if request.access_route else request.remote_addr}"
+
+
+def rate_limited(limiter: RateLimiter, cls, cost=None):
+    """Route decorator taking one token from the requester's bucket for `cls` (a class
+    name, or a callable returning one -- or None to skip -- for the current request).
+    `cost` is an optional callable giving the tokens a request takes (capped at the burst)."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            name = cls() if callable(cls) else cls
+            if not limiter.enabled or name is None:
+                return view(*args, **kwargs)
+            burst, _ = _limits(name)
+            allowed, tokens, wait = limiter.take(name, _requester(), min(burst, cost()) if cost else 1.0)
+            metrics.count("rate_limit_decisions", "Rate-limited requests by class and outcome.",
+                          limit_class=name, outcome="allowed" if allowed else "limited")
+            headers = {"X-RateLimit-Limit": str(int(burst)), "X-RateLimit-Remaining": str(int(tokens))}
+            if not allowed:
+                print(f"[RATELIMIT] {name} limit hit for {_requester()}")
+                headers["Retry-After"] = str(max(1, int(wait + 0.999)))
+                return jsonify({"error": f"rate limit exceeded for {name} requests",
+                                "retry_after": round(wait, 1)}), 429, headers
+            resp = make_response(view(*args, **kwargs))
+            resp.headers.update(headers)
+            return resp
+        return wrapper
+    return decorator
@@ -0,0 +1,293 @@
+import asyncio
+import contextvars
+import inspect
+import os
+import threading
+import time
+
+import cancellation
+from metrics import metrics
+from profiling import profiler
+
+# Timeouts, circuit breakers and concurrency caps for upstream calls.
+#
+# Every upstream call goes through a named guard:
+#
+#   resilience.guard("elevenlabs_stt").call(fn, *args)
+#
+# - timeout: the call runs on its own thread and the caller stops waiting
+#   after `timeout` seconds (coroutines are additionally cancelled with
+#   asyncio.wait_for). The thread keeps its concurrency slot until the
+#   upstream call really returns, so a hung provider cannot pile up threads.
+# - concurrency cap: at most `max_concurrency` calls in flight per guard;
+#   extra callers wait up to `queue_timeout` and then fail with Saturated.
+# - cancellation: when the calling job is cancelled (cancellation.py) the
+#   caller stops waiting at once and coroutines are cancelled on their loop;
+#   this does not count as a provider failure.
+# - circuit breaker: `failure_threshold` consecutive failures open the
+#   circuit and calls fail immediately with CircuitOpen for `reset_after`
+#   seconds, after which one trial call decides whether it closes again.
+#
+# failover() tries equivalent providers (e.g. LLM models) fastest first by
+# an EWMA of recent latency, skipping open circuits.
+#
+# Settings per guard come from DEFAULTS (matched on the part before ":", so
+# "dedalus:openai/gpt-5" uses "dedalus") and can be overridden with
+# RESILIENCE_<NAME>_TIMEOUT / _MAX_CONCURRENCY / _FAILURES / _RESET_S / _QUEUE_S.
+
+DEFAULTS = {
+    "default":        {"timeout": 60,  "max_concurrency": 16, "failure_threshold": 5, "reset_after": 30, "queue_timeout": 1.0},
+    "elevenlabs_stt": {"timeout": 30,  "max_concurrency": 16},
+    "elevenlabs_tts": {"timeout": 20,  "max_concurrency": 16},
+    "dedalus":        {"timeout": 15,  "max_concurrency": 16},
+    "dedalus_cad":    {"timeout": 300, "max_concurrency": 8},
+    "anthropic":      {"timeout": 240, "max_concurrency": 8},
+    "cad":            {"timeout": 330, "max_concurrency": 8, "failure_threshold": 3, "reset_after": 60},
+    "hunyuan":        {"timeout": 300, "max_concurrency": 4, "failure_threshold": 3, "reset_after": 60},
+    "kittycad":       {"timeout": 300, "max_concurrency": 4, "failure_threshold": 3, "reset_after": 60},
+    "supabase":       {"timeout": 10,  "max_concurrency": 32},
+    "converter":      {"timeout": 180, "max_concurrency": 4},
+}
+EWMA_ALPHA = 0.3
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class ProviderUnavailable(RuntimeError):
+    """An upstream call was refused or gave up; callers should degrade or return 503."""
+
+    def __init__(self, provider: str, message: str, retry_after: float | None = None):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+class CircuitOpen(ProviderUnavailable):
+    pass
+
+
+class Saturated(ProviderUnavailable):
+    pass
+
+
+class ProviderTimeout(ProviderUnavailable, TimeoutError):
+    pass
+
+
+def _setting(name: str, key: str, env_key: str, cast=float):
+    base = name.split(":", 1)[0]
+    env = os.getenv(f"RESILIENCE_{base.upper()}_{env_key}")
+    if env is not None:
+        return cast(env)
+    return cast(DEFAULTS.get(base, {}).get(key, DEFAULTS["default"][key]))
+
+
+class Guard:
+    def __init__(self, name: str):
+        self.name = name
+        self.timeout = _setting(name, "timeout", "TIMEOUT")
+        self.max_concurrency = _setting(name, "max_concurrency", "MAX_CONCURRENCY", int)
+        self.failure_threshold = _setting(name, "failure_threshold", "FAILURES", int)
+        self.reset_after = _setting(name, "reset_after", "RESET_S")
+        self.queue_timeout = _setting(name, "queue_timeout", "QUEUE_S")
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.ewma_s = None
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self._trial_running = False
+
+    # ------------------------------ calling -------------------------------
+    def call(self, fn, *args, timeout: float | None = None, **kwargs):
+        """Run fn(*args, **kwargs) under this guard. Coroutine results are awaited
+        (with cancellation at the deadline) on the call's own event loop."""
+        timeout = self.timeout if timeout is None else timeout
+        token = cancellation.current()
+        cancellation.check()
+        self._admit()
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._release_trial()
+            with self._lock:
+                self.rejected += 1
+            raise Saturated(self.name, f"{self.max_concurrency} calls already in flight")
+
+        box = {}
+        done = threading.Event()
+        wake = threading.Event()  # done, or the calling job was cancelled
+        ctx = contextvars.copy_context()  # keep metric spans attributed to the caller's request
+
+        def run():
+            profiler.attach_thread()
+            try:
+                result = fn(*args, **kwargs)
+                if inspect.iscoroutine(result):
+                    result = asyncio.run(_await(result, timeout, token))
+                box["result"] = result
+            except BaseException as e:
+                box["error"] = e
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                self._slots.release()
+                done.set()
+                wake.set()
+
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+        t0 = time.perf_counter()
+        threading.Thread(target=ctx.run, args=(run,), name=f"guard-{self.name}", daemon=True).start()
+        unregister = token.on_cancel(wake.set) if token is not None else (lambda: None)
+        try:
+            wake.wait(timeout)
+        finally:
+            unregister()
+        if not done.is_set():
+            if token is not None and token.cancelled:
+                self._release_trial()
+                raise cancellation.Cancelled(token.reason)
+            self._failure(timeout)
+            raise ProviderTimeout(self.name, f"no response within {timeout:g}s")
+        elapsed = time.perf_counter() - t0
+        err = box.get("error")
+        if isinstance(err, (cancellation.Cancelled, asyncio.CancelledError)):
+            self._release_trial()
+            raise cancellation.Cancelled(token.reason if token else "cancelled") from err
+        if err is not None:
+            self._failure(elapsed)
+            if isinstance(err, (asyncio.TimeoutError, TimeoutError)) and not isinstance(err, ProviderUnavailable):
+                raise ProviderTimeout(self.name, f"no response within {timeout:g}s") from err
+            raise err
+        self._success(elapsed)
+        return box.get("result")
+
+    # ------------------------------ breaker -------------------------------
+    def _admit(self):
+        with self._lock:
+            if self.state == OPEN:
+                waited = time.time() - self.opened_at
+                if waited < self.reset_after:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name, "circuit open after repeated failures",
+                                      retry_after=self.reset_after - waited)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._trial_running:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name, "circuit half-open, trial call in progress",
+                                      retry_after=1.0)
+                self._trial_running = True
+
+    def _release_trial(self):
+        with self._lock:
+            self._trial_running = False
+
+    def _success(self, elapsed: float):
+        with self._lock:
+            self._observe(elapsed)
+            self.failures = 0
+            self._trial_running = False
+            if self.state != CLOSED:
+                print(f"[RESILIENCE] {self.name} circuit closed")
+            self.state = CLOSED
+
+    def _failure(self, elapsed: float):
+        with self._lock:
+            # failures count as slow so failover prefers healthier providers
+            self._observe(max(elapsed, self.timeout))
+            self.errors += 1
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"[RESILIENCE] {self.name} circuit opened after {self.failures} failures")
+                self.state = OPEN
+                self.opened_at = time.time()
+
+    def _observe(self, elapsed: float):
+        self.ewma_s = elapsed if self.ewma_s is None else EWMA_ALPHA * elapsed + (1 - EWMA_ALPHA) * self.ewma_s
+
+    def available(self) -> bool:
+        with self._lock:
+            return self.state != OPEN or time.time() - self.opened_at >= self.reset_after
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "ewma_ms": round(self.ewma_s * 1000, 1) if self.ewma_s is not None else None,
+                "in_flight": self.in_flight,
+                "max_concurrency": self.max_concurrency,
+                "timeout_s": self.timeout,
+                "calls": self.calls,
+                "errors": self.errors,
+                "rejected": self.rejected,
+            }
+
+
+async def _await(coro, timeout: float, token):
+    task = asyncio.ensure_future(coro)
+    loop = asyncio.get_running_loop()
+    unregister = (token.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+                  if token is not None else (lambda: None))
+    try:
+        return await asyncio.wait_for(task, timeout)
+    finally:
+        unregister()
+
+
+_guards = {}
+_guards_lock = threading.Lock()
+
+
+def guard(name: str) -> Guard:
+    g = _guards.get(name)
+    if g is None:
+        with _guards_lock:
+            g = _guards.setdefault(name, Guard(name))
+    return g
+
+
+def order_by_latency(names: list[str]) -> list[str]:
+    """Available guards first, fastest EWMA first; untried ones go ahead of measured ones so
+    they get a latency sample, and ties keep the configured order."""
+    def key(item):
+        i, name = item
+        g = guard(name)
+        return (not g.available(), g.ewma_s is not None, g.ewma_s or 0.0, i)
+    return [name for _, name in sorted(enumerate(names), key=key)]
+
+
+def failover(calls: list[tuple[str, object]], timeout: float | None = None):
+    """calls: [(guard name, fn)] for equivalent providers. Returns the first success."""
+    fns = dict(calls)
+    errors = []
+    for name in order_by_latency([n for n, _ in calls]):
+        try:
+            return guard(name).call(fns[name], timeout=timeout)
+        except cancellation.Cancelled:
+            raise
+        except Exception as e:
+            print(f"[RESILIENCE] {name} failed, trying next:", e)
+            errors.append(f"{name}: {e}")
+    raise ProviderUnavailable("+".join(n for n, _ in calls), "; ".join(errors))
+
+
+def stats() -> dict:
+    with _guards_lock:
+        guards = dict(_guards)
+    return {name: g.stats() for name, g in sorted(guards.items())}
+
+
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+metrics.gauge("circuit_state", "Circuit breaker state per provider (0 closed, 1 half-open, 2 open).",
+              lambda: {name: _STATE_VALUE[s["state"]] for name, s in stats().items()}, label="provider")
+metrics.gauge("provider_in_flight", "Upstream calls in flight per provider.",
+              lambda: {name: s["in_flight"] for name, s in stats().items()}, label="provider")
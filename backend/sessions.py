@@ -0,0 +1,85 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Per-session conversation state.
+#
+# Replaces the old process-wide `currentText`: each session (X-Session-Id
+# header, session_id param, or the userid) keeps its latest transcript, the
+# model it is working on and its last few turns. Memory is bounded by an LRU
+# cap on sessions, an idle TTL, a cap on turns and on stored text length.
+
+SESSION_TTL = int(os.getenv("SESSION_TTL", "1800"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "5000"))
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "10"))
+MAX_TEXT = 2000
+
+
+class SessionStore:
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = SESSION_MAX,
+                 max_turns: int = SESSION_MAX_TURNS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self._sessions = OrderedDict()  # sid -> state, least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, sid: str | None) -> dict:
+        """Snapshot of a session's state (empty state for unknown/anonymous sessions)."""
+        if not sid:
+            return self._empty()
+        with self._lock:
+            state = self._live(sid)
+            if state is None:
+                return self._empty()
+            return {**state, "turns": list(state["turns"])}
+
+    def transcript(self, sid: str | None) -> str:
+        return self.get(sid)["transcript"]
+
+    def active_model(self, sid: str | None) -> str | None:
+        return self.get(sid)["model_id"]
+
+    def update(self, sid: str | None, transcript: str | None = None, model_id: str | None = None,
+               turn: dict | None = None):
+        if not sid:
+            return
+        with self._lock:
+            state = self._live(sid)
+            if state is None:
+                state = self._empty()
+                state["turns"] = deque(maxlen=self.max_turns)
+                self._sessions[sid] = state
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+            if transcript is not None:
+                state["transcript"] = transcript[:MAX_TEXT]
+            if model_id is not None:
+                state["model_id"] = model_id
+            if turn is not None:
+                turn = {k: (v[:MAX_TEXT] if isinstance(v, str) else v) for k, v in turn.items()}
+                turn.setdefault("at", time.time())
+                state["turns"].append(turn)
+            state["updated_at"] = time.time()
+
+    def clear(self, sid: str | None):
+        if not sid:
+            return
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def _live(self, sid):
+        """Return the session if present and not expired, marking it recently used."""
+        state = self._sessions.get(sid)
+        if state is None:
+            return None
+        if time.time() - state["updated_at"] > self.ttl:
+            del self._sessions[sid]
+            return None
+        self._sessions.move_to_end(sid)
+        return state
+
+    @staticmethod
+    def _empty() -> dict:
+        return {"transcript": "", "model_id": None, "turns": [], "updated_at": None}
@@ -0,0 +1,156 @@
+import itertools
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Local status sentences ("Got it, generating your traffic cone now.") instead
+# of an LLM round trip per request.
+#
+# extract_noun() pulls the object from the transcript; templates rotate per
+# call. Audio is stitched from MP3 clips: every template prefix/suffix plus a
+# few common nouns are synthesized once by start(), other nouns are synthesized
+# in the background the first time they are seen. Until a noun's clip exists
+# the spoken sentence uses "model" instead, so status audio never waits on TTS
+# once the bank is warm. MP3 frames are self-contained, so concatenated clips
+# play as one file.
+
+NOUN_AUDIO_MAX = int(os.getenv("STATUS_NOUN_AUDIO_MAX", "512"))
+WARM_NOUNS = ("model", "part", "gear", "box", "stand", "holder", "bracket", "cup", "vase")
+GENERIC_NOUN = "model"
+MAX_NOUN_WORDS = 4
+
+TEMPLATES = {
+    "generate": (
+        ("Got it, generating your", "now."),
+        ("On it. Building your", "now."),
+        ("Okay, modeling your", "right away."),
+        ("Starting on your", "now; this takes a moment."),
+    ),
+    "iterate": (
+        ("Got it, updating your", "now."),
+        ("Making those changes to your", "now."),
+        ("Okay, reworking your", "right away."),
+    ),
+}
+
+_FILLER = re.compile(
+    r"^(?:(?:um+|uh+|okay|ok|so|hey|hi|please|now|just|alright)\b[\s,]*"
+    r"|(?:can|could|would|will) you\s+"
+    r"|i(?:'d| would)? (?:like|want|need)(?: you)?(?: to)?\s+"
+    r"|give me\s+"
+    r"|(?:make|create|generate|design|model|build|draw|print|do)\b\s*(?:me\s+)?"
+    r"|re[\s-]?iterate\b\s*(?:and\s+)?|iterate again\b\s*(?:and\s+)?"
+    r"|(?:a|an|the|some|my|one)\s+)+",
+    re.I,
+)
+_STOP_WORDS = {
+    "with", "that", "which", "for", "to", "and", "having", "where", "who", "so", "but", "like",
+    "on", "in", "at", "from", "by", "using", "please", "thanks", "is", "are", "should",
+}
+
+
+def strip_filler(text: str) -> str:
+    """Lowercased request without punctuation or lead-in: "Can you make me a gear?" -> "gear"."""
+    cleaned = re.sub(r"[^\w\s'-]", " ", (text or "").lower())
+    return _FILLER.sub("", re.sub(r"\s+", " ", cleaned).strip())
+
+
+def extract_noun(text: str) -> str:
+    """The object the user asked for, e.g. "make a pen holder that clips on" -> "pen holder"."""
+    words = []
+    for word in strip_filler(text).split():
+        if word in _STOP_WORDS:
+            break
+        words.append(word)
+    if not words or len(words) > MAX_NOUN_WORDS:
+        return GENERIC_NOUN
+    return " ".join(words)
+
+
+def _strip_id3(mp3: bytes) -> bytes:
+    """Drop a leading ID3v2 tag so clips concatenate into a single MP3 stream."""
+    if mp3[:3] == b"ID3" and len(mp3) >= 10:
+        size = (mp3[6] << 21) | (mp3[7] << 14) | (mp3[8] << 7) | mp3[9]
+        return mp3[10 + size:]
+    return mp3
+
+
+class PhraseBank:
+    """Rotating status templates with pre-synthesized audio fragments."""
+
+    def __init__(self, max_nouns: int = NOUN_AUDIO_MAX):
+        self.max_nouns = max_nouns
+        self._fragments = {}  # prefix/suffix text -> mp3
+        self._nouns = OrderedDict()  # noun -> mp3, LRU
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._tts = None
+        self._warming = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="status-tts")
+
+    def start(self, tts):
+        """Synthesize the fragments in the background (once); `tts(text) -> mp3 bytes`."""
+        with self._lock:
+            if self._warming:
+                return
+            self._warming, self._tts = True, tts
+        self._executor.submit(self._warm)
+
+    def _warm(self):
+        parts = {part for templates in TEMPLATES.values() for pair in templates for part in pair}
+        try:
+            for part in sorted(parts):
+                if part not in self._fragments:
+                    self._fragments[part] = _strip_id3(self._tts(part))
+            for noun in WARM_NOUNS:
+                self._synthesize_noun(noun)
+            print(f"[STATUS] phrase bank ready: {len(parts)} fragments, {len(self._nouns)} nouns")
+        except Exception as e:
+            print("[STATUS] phrase bank warm-up failed:", e)
+            with self._lock:
+                self._warming = False  # retried on the next start()
+
+    def _synthesize_noun(self, noun: str):
+        try:
+            clip = _strip_id3(self._tts(noun))
+        except Exception as e:
+            print(f"[STATUS] noun TTS failed for {noun!r}:", e)
+            return
+        finally:
+            with self._lock:
+                self._pending.discard(noun)
+        with self._lock:
+            self._nouns[noun] = clip
+            while len(self._nouns) > self.max_nouns:
+                self._nouns.popitem(last=False)
+
+    def _noun_clip(self, noun: str) -> bytes | None:
+        with self._lock:
+            clip = self._nouns.get(noun)
+            if clip is not None:
+                self._nouns.move_to_end(noun)
+                return clip
+            if self._tts is None or noun in self._pending:
+                return None
+            self._pending.add(noun)
+        self._executor.submit(self._synthesize_noun, noun)
+        return None
+
+    def phrase(self, text: str, iterate: bool = False) -> tuple[str, bytes | None]:
+        """(sentence, stitched mp3 or None if the fragments are not synthesized yet)."""
+        templates = TEMPLATES["iterate" if iterate else "generate"]
+        prefix, suffix = templates[next(self._turn) % len(templates)]
+        noun = GENERIC_NOUN if iterate else extract_noun(text)
+        head, tail = self._fragments.get(prefix), self._fragments.get(suffix)
+        if head is None or tail is None:
+            return f"{prefix} {noun} {suffix}", None
+        clip = self._noun_clip(noun)
+        if clip is None:
+            # noun audio is on its way; say the generic sentence this time
+            noun, clip = GENERIC_NOUN, self._noun_clip(GENERIC_NOUN)
+            if clip is None:
+                return f"{prefix} {noun} {suffix}", None
+        return f"{prefix} {noun} {suffix}", head + clip + tail
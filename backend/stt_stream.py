@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+# Segmented speech-to-text ingestion.
+#
+# Instead of uploading one recording after the user stops talking, the client
+# opens a stream and posts self-contained audio segments (e.g. restart the
+# MediaRecorder at each pause) as they are recorded. Every segment is sent to
+# STT as soon as it lands, so by the time the final segment arrives only that
+# one is still being transcribed. Partial transcripts are published after
+# every segment for incremental intent detection.
+
+STREAM_TTL = int(os.getenv("STT_STREAM_TTL", "300"))
+STREAM_MAX_SEGMENTS = int(os.getenv("STT_STREAM_MAX_SEGMENTS", "64"))
+STREAM_WORKERS = int(os.getenv("STT_STREAM_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=STREAM_WORKERS, thread_name_prefix="stt-segment")
+
+
+class TranscriptStream:
+    def __init__(self, transcribe, options: dict | None = None, on_partial=None):
+        """`transcribe(audio_bytes, filename, mimetype)` returns segment text.
+        `on_partial(stream)` runs after each segment is transcribed."""
+        self.id = str(uuid4())
+        self.options = dict(options or {})
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.final = False
+        self.extras = {}  # speculative work attached by the caller (e.g. status audio)
+        self._transcribe = transcribe
+        self._on_partial = on_partial
+        self._segments = []  # futures, in arrival order
+        self._texts = {}     # segment index -> text
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def add_segment(self, audio: bytes, filename: str = "segment.webm", mimetype: str | None = None,
+                    final: bool = False) -> int:
+        with self._lock:
+            if self.final:
+                raise ValueError("stream already finalized")
+            if len(self._segments) >= STREAM_MAX_SEGMENTS:
+                raise ValueError("too many segments")
+            index = len(self._segments)
+            self.final = final
+            self.updated_at = time.time()
+            fut = _executor.submit(self._run_segment, index, audio, filename, mimetype)
+            self._segments.append(fut)
+        return index
+
+    def mark_final(self):
+        with self._lock:
+            self.final = True
+            self.updated_at = time.time()
+
+    def partial_text(self) -> str:
+        """Transcript of the contiguous run of finished segments from the start."""
+        with self._lock:
+            parts = []
+            for i in range(len(self._segments)):
+                if i not in self._texts:
+                    break
+                parts.append(self._texts[i])
+        return " ".join(p for p in parts if p).strip()
+
+    def wait(self, timeout: float | None = None) -> str:
+        """Wait for every submitted segment and return the full transcript."""
+        with self._lock:
+            futures = list(self._segments)
+        deadline = None if timeout is None else time.time() + timeout
+        for fut in futures:
+            fut.result(None if deadline is None else max(0.0, deadline - time.time()))
+        return self.partial_text()
+
+    def state(self) -> dict:
+        with self._lock:
+            total = len(self._segments)
+            done = len(self._texts)
+            errors = dict(self._errors)
+        return {
+            "stream_id": self.id,
+            "segments": total,
+            "segments_done": done,
+            "final": self.final,
+            "partial_text": self.partial_text(),
+            "errors": errors or None,
+        }
+
+    def _run_segment(self, index, audio, filename, mimetype):
+        try:
+            text = self._transcribe(audio, filename, mimetype) or ""
+        except Exception as e:
+            print(f"[STT STREAM] segment {index} failed:", e)
+            with self._lock:
+                self._errors[index] = str(e)
+                self._texts[index] = ""
+            return ""
+        with self._lock:
+            self._texts[index] = text.strip()
+            self.updated_at = time.time()
+        if self._on_partial:
+            try:
+                self._on_partial(self)
+            except Exception as e:
+                print("[STT STREAM] on_partial failed:", e)
+        return text
+
+
+class StreamRegistry:
+    def __init__(self, ttl: float = STREAM_TTL):
+        self.ttl = ttl
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def open(self, transcribe, options: dict | None = None, on_partial=None) -> TranscriptStream:
+        stream = TranscriptStream(transcribe, options, on_partial)
+        with self._lock:
+            self._prune()
+            self._streams[stream.id] = stream
+        return stream
+
+    def get(self, stream_id: str) -> TranscriptStream | None:
+        with self._lock:
+            self._prune()
+            return self._streams.get(stream_id)
+
+    def close(self, stream_id: str):
+        with self._lock:
+            self._streams.pop(stream_id, None)
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        for sid in [sid for sid, s in self._streams.items() if s.updated_at < cutoff]:
+            del self._streams[sid]
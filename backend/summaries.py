@@ -0,0 +1,256 @@
+import hashlib
+import os
+import re
+import struct
+import threading
+from collections import Counter, OrderedDict
+
+import artifacts
+
+# Spoken model summaries built from the SCAD itself.
+#
+# parse_scad() pulls the structure out of the code (defined and instantiated
+# modules, primitives, boolean ops, MCAD libraries, named dimensions),
+# stl_stats() reads the bounding box from the rendered STL, and describe()
+# turns both into one sentence without any LLM call. An LLM may polish that
+# sentence (refine_prompt) but only sees the extracted facts, never a
+# truncated slice of the code. The parsed facts and mesh stats are cached by
+# the hash of the canonicalised SCAD. Sentences, audio included, are cached
+# by summary_key(): the SCAD hash plus the subject taken from the request and
+# the mesh size. The same code generated for two prompts therefore never
+# reads one user's request back to the other, and repeat views are instant.
+
+SUMMARY_CACHE_MAX = int(os.getenv("SUMMARY_CACHE_MAX", "256"))
+
+PRIMITIVES = ("cube", "cylinder", "sphere", "polyhedron", "circle", "square", "polygon", "text")
+FEATURES = {
+    "difference": "cut-outs",
+    "minkowski": "rounded edges",
+    "hull": "smooth hulled shapes",
+    "linear_extrude": "an extruded profile",
+    "rotate_extrude": "a turned profile",
+    "text": "raised lettering",
+    "for": "repeated elements",
+}
+# name fragment -> how a dimension is spoken ("60 mm wide")
+DIMENSION_WORDS = (
+    ("width", "wide"), ("length", "long"), ("height", "tall"), ("depth", "deep"),
+    ("diameter", "across"), ("thickness", "thick"),
+)
+GENERIC_MODULES = {"main", "assembly", "model", "object", "part", "base", "body", "render", "all"}
+_PLURALS = {"cube": "cubes", "cylinder": "cylinders", "sphere": "spheres", "polyhedron": "polyhedra",
+            "circle": "circles", "square": "squares", "polygon": "polygons", "text": "text blocks"}
+
+_COMMENT = re.compile(r"//[^\n]*|/\*.*?\*/", re.S)
+_CALL = re.compile(r"\b([A-Za-z_]\w*)\s*\(")
+_MODULE_DEF = re.compile(r"\bmodule\s+([A-Za-z_]\w*)\s*\(")
+_INCLUDE = re.compile(r"\b(?:include|use)\s*<([^>]+)>")
+_NUMERIC_VAR = re.compile(r"(?:^|(?<=;))\s*([A-Za-z_]\w*)\s*=\s*(-?\d+(?:\.\d+)?)\s*;", re.M)
+_LEAD_VERBS = re.compile(
+    r"^(?:please\s+)?(?:(?:can|could) you\s+)?(?:make|create|generate|design|model|build|draw|print)"
+    r"(?:\s+me)?\s+", re.I)
+_ARTICLE = re.compile(r"^(?:a|an|the|some)\s+", re.I)
+
+
+# ------------------------------- hashing ----------------------------------
+def canonical_scad(code: str) -> str:
+    """Comments, fences and formatting removed: cosmetic edits map to the same model."""
+    code = re.sub(r"^\s*```\w*\s*$", "", code or "", flags=re.M)
+    code = _COMMENT.sub(" ", code)
+    code = re.sub(r"\s+", " ", code)
+    return re.sub(r"\s*([{}()\[\];,=+\-*/<>:?!])\s*", r"\1", code).strip()
+
+
+def scad_hash(code: str) -> str:
+    return hashlib.sha256(canonical_scad(code).encode("utf-8")).hexdigest()
+
+
+# ------------------------------- parsing ----------------------------------
+def _top_level(code: str) -> str:
+    """The code with every module body removed, i.e. what actually gets rendered."""
+    out, i = [], 0
+    for m in _MODULE_DEF.finditer(code):
+        if m.start() < i:
+            continue  # nested inside a body we already skipped
+        out.append(code[i:m.start()])
+        j = code.find("{", m.end())
+        if j < 0:
+            i = len(code)
+            break
+        depth = 0
+        for k in range(j, len(code)):
+            if code[k] == "{":
+                depth += 1
+            elif code[k] == "}":
+                depth -= 1
+                if depth == 0:
+                    break
+        i = k + 1
+    out.append(code[i:])
+    return "".join(out)
+
+
+def parse_scad(code: str) -> dict:
+    code = _COMMENT.sub(" ", code or "")
+    modules = list(dict.fromkeys(_MODULE_DEF.findall(code)))
+    calls = Counter(_CALL.findall(code))
+    top = _top_level(code)
+    top_calls = [name for name in _CALL.findall(top) if name in modules]
+    libraries = []
+    for path in _INCLUDE.findall(code):
+        name = os.path.splitext(os.path.basename(path))[0]
+        libraries.append(f"MCAD {name}" if "mcad" in path.lower() else name)
+    dimensions = {}
+    for name, value in _NUMERIC_VAR.findall(top):
+        lowered = name.lower()
+        for fragment, word in DIMENSION_WORDS + (("radius", "across"),):
+            if fragment in lowered and word not in dimensions:
+                number = float(value) * (2 if fragment == "radius" else 1)
+                if number > 0:
+                    dimensions[word] = number
+                break
+    return {
+        "modules": modules,
+        "instantiated": list(dict.fromkeys(top_calls)),
+        "primitives": {p: calls[p] for p in PRIMITIVES if calls[p]},
+        "features": [label for op, label in FEATURES.items() if calls[op]],
+        "libraries": list(dict.fromkeys(libraries)),
+        "dimensions": dimensions,
+    }
+
+
+# ------------------------------ mesh stats --------------------------------
+def stl_stats(data: bytes) -> dict | None:
+    """Triangle count and bounding-box size of a binary or ASCII STL."""
+    if len(data) >= 84:
+        (count,) = struct.unpack_from("<I", data, 80)
+        if 84 + count * 50 == len(data):
+            lo, hi = [float("inf")] * 3, [float("-inf")] * 3
+            for tri in struct.iter_unpack("<12fH", data[84:]):
+                for v in (tri[3:6], tri[6:9], tri[9:12]):
+                    for axis in range(3):
+                        lo[axis] = min(lo[axis], v[axis])
+                        hi[axis] = max(hi[axis], v[axis])
+            return _stats(count, lo, hi)
+    text = data.decode("ascii", errors="ignore")
+    vertices = re.findall(r"vertex\s+(\S+)\s+(\S+)\s+(\S+)", text)
+    if not vertices:
+        return None
+    coords = [tuple(float(c) for c in v) for v in vertices]
+    lo = [min(c[a] for c in coords) for a in range(3)]
+    hi = [max(c[a] for c in coords) for a in range(3)]
+    return _stats(len(coords) // 3, lo, hi)
+
+
+def _stats(triangles: int, lo, hi) -> dict | None:
+    if not triangles:
+        return None
+    return {"triangles": triangles, "size": [round(h - l, 1) for l, h in zip(lo, hi)]}
+
+
+def stl_stats_for_url(url: str | None) -> dict | None:
+    """Mesh stats for a converter URL like /files/generated/ab/<sha>.stl, if the file is local."""
+    rel = artifacts.generated.rel_from_url(url)
+    if not rel or not re.fullmatch(r"(?:[\w.-]+/)*[\w.-]+\.stl", rel) or ".." in rel.split("/"):
+        return None
+    path = artifacts.generated.path(rel)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as f:
+        return stl_stats(f.read())
+
+
+# ------------------------------- wording ----------------------------------
+def _subject(facts: dict, user_prompt: str) -> str:
+    prompt = re.sub(r"\s+", " ", (user_prompt or "").strip().rstrip(".!?"))
+    if prompt:
+        words = _ARTICLE.sub("", _LEAD_VERBS.sub("", prompt)).split()
+        if words:
+            return " ".join(words[:10])
+    for name in facts["instantiated"] + facts["modules"]:
+        if name.lower() not in GENERIC_MODULES:
+            return name.replace("_", " ").strip()
+    return "3D object"
+
+
+def _article(phrase: str) -> str:
+    return "an" if phrase[:1].lower() in "aeiou" else "a"
+
+
+def _join(items: list[str]) -> str:
+    return items[0] if len(items) == 1 else ", ".join(items[:-1]) + " and " + items[-1]
+
+
+def _fmt(mm: float) -> str:
+    return f"{mm:.0f}" if mm >= 10 or mm == int(mm) else f"{mm:.1f}"
+
+
+def describe(facts: dict, mesh: dict | None = None, user_prompt: str = "") -> str:
+    """One spoken sentence from parsed SCAD facts and optional mesh stats."""
+    subject = _subject(facts, user_prompt)
+    sentence = f"I have modeled {_article(subject)} {subject}"
+
+    details = []
+    prims = sorted(facts["primitives"].items(), key=lambda kv: -kv[1])[:3]
+    if prims:
+        parts = [(f"{n} {_PLURALS[p]}" if n > 1 else f"{_article(p)} {p}") for p, n in prims]
+        details.append("built from " + _join(parts))
+    if facts["libraries"]:
+        details.append("using " + _join(facts["libraries"][:2]))
+    extras = facts["features"][:2]
+    if extras:
+        details.append("with " + _join(extras))
+    if details:
+        sentence += ", " + ", ".join(details)
+
+    size = (mesh or {}).get("size")
+    if size and len(size) == 3 and all(s > 0 for s in size):
+        sentence += ", about " + " by ".join(_fmt(s) for s in size) + " millimeters"
+    elif facts["dimensions"]:
+        order = [word for _, word in DIMENSION_WORDS]
+        dims = sorted(facts["dimensions"].items(), key=lambda kv: order.index(kv[0]))[:2]
+        sentence += ", " + _join([f"{_fmt(v)} millimeters {word}" for word, v in dims])
+    return sentence + "."
+
+
+def refine_prompt(sentence: str, facts: dict, mesh: dict | None, user_prompt: str = "") -> str:
+    return (
+        "Rewrite this description of a 3D model as ONE short, natural spoken sentence "
+        "(max 20 words) starting with \"I have created\" or \"I have modeled\". Use only the facts "
+        "given; do not mention OpenSCAD or code.\n\n"
+        f"{f'User requested: {user_prompt}' if user_prompt else ''}\n"
+        f"Draft: {sentence}\n"
+        f"Facts: modules={facts['instantiated'] or facts['modules']}, primitives={facts['primitives']}, "
+        f"libraries={facts['libraries']}, features={facts['features']}, "
+        f"dimensions_mm={facts['dimensions']}, mesh={mesh or {}}"
+    )
+
+
+# -------------------------------- cache -----------------------------------
+def summary_key(code_hash: str, facts: dict, mesh: dict | None, user_prompt: str, refine: bool) -> tuple:
+    """Cache key of a spoken summary: everything describe() and refine_prompt() vary on."""
+    size = tuple(mesh["size"]) if mesh and mesh.get("size") else None
+    return (code_hash, _subject(facts, user_prompt).lower(), size, refine)
+
+
+class SummaryCache:
+    """LRU of parsed models ("facts", scad hash) and summary entries (summary_key)."""
+
+    def __init__(self, max_entries: int = SUMMARY_CACHE_MAX):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, entry: dict):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -1,104 +1,101 @@
 from dotenv import load_dotenv
 import asyncio
 from dedalus_labs import AsyncDedalus, DedalusRunner, Dedalus
-from prompts import editprompt
+from prompts import editprompt, ITERATE_CAD_INSTRUCTIONS, GEN_CAD_SYSTEM, cached_system, strip_markdown_fences
 import os
 from dedalus_labs.utils.streaming import stream_sync
 import anthropic
+from metrics import metrics, span
+import resilience
+import cancellation
 from flask import Flask, jsonify
 from pathlib import Path
+import contextvars
 
 SCAD_PATH = (Path(__file__).resolve().parents[1] / "output.scad")
-scad_code = SCAD_PATH.read_text(encoding="utf-8")
 
 load_dotenv()
 
-client2 = anthropic.Anthropic(api_key=os.getenv("CLAUDE_API_KEY"))
+# Where gen_cad leaves its code for iterate_cad (outputIterated.scad is shared by every job)
+_output = contextvars.ContextVar("iterate_output", default=None)
+
+# Equivalent models for gen_cad, tried fastest-healthy first (see resilience.failover)
+ANTHROPIC_MODELS = [m.strip() for m in os.getenv(
+    "ANTHROPIC_MODELS", "claude-sonnet-4-5,claude-sonnet-4-20250514").split(",") if m.strip()]
+
+# Created on first use so importing this module never touches the network or env
+_client2 = None
+
+def _anthropic():
+    global _client2
+    if _client2 is None:
+        _client2 = anthropic.Anthropic(api_key=os.getenv("CLAUDE_API_KEY"))
+    return _client2
 
 def gen_cad(p):
-    response =  client2.messages.create(
-        model="claude-sonnet-4-5",
-        max_tokens=20000,
-        messages=[{"role": "user", "content": p}]
-    )
+    # the orchestrator has finished building the prompt once it calls us
+    metrics.end("prompt_build")
+    cancellation.check()  # don't start the expensive call for a cancelled job
+    def create(model):
+        return lambda: _anthropic().messages.create(
+            model=model,
+            max_tokens=20000,
+            system=cached_system(GEN_CAD_SYSTEM),
+            messages=[{"role": "user", "content": p}]
+        )
+    with span("llm_generate"):
+        response = resilience.failover([(f"anthropic:{m}", create(m)) for m in ANTHROPIC_MODELS])
+    _record_prompt_cache(response)
     content =  response.content
     code_blocks = [block.text for block in content if hasattr(block, "text")]
     full_text = "\n".join(code_blocks)
     
     # Strip markdown fences before writing
-    full_text = _strip_markdown_fences(full_text)
+    with span("fence_strip"):
+        full_text = strip_markdown_fences(full_text)
     
+    holder = _output.get()
+    if holder is not None:
+        holder["scad"] = full_text
     with open('outputIterated.scad', 'w', encoding='utf-8') as f:
         f.write(full_text)
 
-def _strip_markdown_fences(code: str) -> str:
-    """
-    Remove markdown code fences from SCAD code.
-    Handles various formats:
-    - ```openscad ... ```
-    - ```scad ... ```
-    - ```plaintext ... ```
-    - ``` ... ```
-    - With or without whitespace
-    """
-    code = code.strip()
-    
-    # Split into lines for robust fence detection
-    lines = code.split('\n')
-    
-    # Remove opening fence: Check first line for any fence format
-    if lines and lines[0].strip().startswith('```'):
-        lines = lines[1:]
-        print(f"[gen_cad] Stripped opening markdown fence from iteration")
-    
-    # Remove closing fence: Check last line
-    if lines and lines[-1].strip() == '```':
-        lines = lines[:-1]
-        print(f"[gen_cad] Stripped closing markdown fence from iteration")
-    
-    result = '\n'.join(lines).strip()
-    return result
-
+def _record_prompt_cache(response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    read = getattr(usage, "cache_read_input_tokens", 0) or 0
+    written = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    metrics.cache_result("anthropic_prompt", read > 0)
+    print(f"[gen_cad] prompt cache read={read} written={written} uncached={getattr(usage, 'input_tokens', 0)}")
 
 async def iterate_cad(user_prompt, scad_code):
+    holder = {}
+    _output.set(holder)
     client = Dedalus()
     runner = DedalusRunner(client)
-    result =  runner.run(
-        input=f"""Here is the user's fix to the old request: {user_prompt}
-                Here is the generated openSCAD code of the original request: {scad_code}
-                
-                Analyze the openSCAD code and see if it meets all the requirements of the user's original request.
-                If it does, respond with "The openSCAD code meets all the requirements."
-                If it does not, identify the shortcomings and generate a new prompt to fix the issues.
-                Use editprompt to create a new prompt that addresses the shortcomings and improves the openSCAD code.
-                --- pass in the old openSCAD code and the user's fix into editprompt to make the new prompt --- IMPORTANT
-
-                THEN, use gen_cad to generate a new openSCAD code based on the new prompt.
-                
-                MAKE SURE TO FOLLOW ALL THE GUIDELINES ABOUT USING MCAD LIBRARIES BUILT INTO OPENS CAD WHENEVER APPROPRIATE; 
-                ALL ITEMS MUST BE ATTACHED TOGETHER, AND THERE SHOULD NOT BE ANY RANDOM FLOATING BODIES.
-                
-                ALSO, MAKE SURE THE PROMPT SPECIFIES THAT THE ONLY RETURN SHOULD BE OPENS CAD CODE, WITH NO SUPPORTING TEXT OR DIALOGUE.
-                
-                THE NEW OPENSCAD CODE SHOULD BE WRITTEN INTO A FILE VIA gen_cad
-                
-                MAKE SURE THE ONLY THING PASSSED INTO GEN_CAD IS THE PROMPT FOR CAD GENERATION
-                THE FULL_TEXT IN GEN CAD SHOULD NOT BE WRITTEN TO THE SCAD FILE, ONLY THE OPEN SCAD CODE
-
-                YOU NEED TO WAIT UNTIL gen_cad HAS FINISHED WRITING THE FILE BEFORE YOU FINISH YOUR RESPONSE
-
-                ADDITIONALLY, IN THE output.scad FILE MAKE SURE TO REMOVE THE FIRST LINE IF IT CONTAINS ANYTHING LIKE "```openscad" OR "```"
-                AND THE LAST LINE IF IT CONTAINS "```"
-                """,
-        model=["openai/gpt-5-mini","claude-sonnet-4-20250514"],
-        mcp_servers=["windsor/brave-search-mcp", 'akakak/sonar', 'windsor/context7'],
-        tools = [gen_cad, editprompt, ],
-        stream = True,
-        verbose= True,
-    )
-    stream_sync(result)
+    metrics.begin("prompt_build")
+    def run():
+        # static instructions first so the provider can reuse the cached prefix;
+        # the stream is drained inside the guard so the timeout covers the whole run,
+        # and stops at the next chunk once the job is cancelled
+        stream_sync(cancellation.iterate(runner.run(
+            instructions=ITERATE_CAD_INSTRUCTIONS,
+            input=f"""Here is the user's fix to the old request: {user_prompt}
+                    Here is the generated openSCAD code of the original request: {scad_code}
+                    """,
+            model=["openai/gpt-5-mini","claude-sonnet-4-20250514"],
+            mcp_servers=["windsor/brave-search-mcp", 'akakak/sonar', 'windsor/context7'],
+            tools = [gen_cad, editprompt, ],
+            stream = True,
+            verbose= True,
+            prompt_cache_key="vibecad-iterate-cad",
+        )))
+    resilience.guard("dedalus_cad").call(run)
     print()
+    return holder.get("scad")
 
 
 if __name__=="__main__":
+    scad_code = SCAD_PATH.read_text(encoding="utf-8")
     asyncio.run(iterate_cad("Hey, look at the scad file again, the gears aren't rendering", scad_code))
@@ -0,0 +1,36 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("VIBECAD_PROVIDERS", "fake")
+os.environ.setdefault("FAKE_LATENCY_SCALE", "0")
+os.environ.setdefault("VIBECAD_WARMUP", "0")
+os.environ.setdefault("RATE_LIMITS", "0")
+os.environ.setdefault("ARTIFACT_SWEEP_S", "0")
+
+import app  # noqa: E402
+
+SCAD = "cube([10,10,10]);"
+
+
+def _summary(prompt):
+    resp = app.app.test_client().post("/api/generate-model-summary",
+                                      json={"scad_code": SCAD, "user_prompt": prompt})
+    assert resp.status_code == 200
+    return resp.get_json()
+
+
+def test_same_scad_different_prompts_do_not_share_a_summary():
+    first = _summary("a dice for my secret board game")
+    second = _summary("a sugar cube")
+    assert "secret board game" in first["summary"]
+    assert "secret board game" not in second["summary"]
+    assert "sugar cube" in second["summary"]
+    assert second["cached"] is False
+
+
+def test_same_prompt_is_cached():
+    _summary("a paperweight")
+    again = _summary("a paperweight")
+    assert again["cached"] is True
+    assert "paperweight" in again["summary"]
@@ -0,0 +1,129 @@
+import hashlib
+import os
+import tempfile
+from functools import wraps
+
+from flask import Request, current_app, request, jsonify
+
+# Upload handling: size caps and spooled, hashed request files.
+#
+# UploadRequest (app.request_class) has Werkzeug write every multipart file
+# into a HashingSpool: kept in memory up to SPOOL_MEMORY_BYTES, then rolled
+# over to an anonymous temp file, with its sha256 computed while the parser
+# writes it. A large upload therefore never sits in worker memory, and its
+# hash is known for dedup/cache keys without a second read.
+#
+# MAX_UPLOAD_BYTES is the app-wide MAX_CONTENT_LENGTH. Routes marked with the
+# upload_limit(cls) decorator get a lower cap per route class, applied by the
+# enforce_limit before_request hook, i.e. before any decorator (rate limits,
+# idempotency keys) or the view can read request.form:
+#
+#   image    /api/hunyuan/generate (main image + 4 views)
+#   audio    /api/transcribe
+#   segment  /api/transcribe/stream/<id> (one segment)
+#
+# Override with UPLOAD_LIMIT_<CLASS>_MB. Oversized requests get 413; bodies
+# without Content-Length (chunked) are cut off by Werkzeug at the same limit.
+
+MB = 1024 * 1024
+DEFAULT_LIMITS_MB = {
+    "image": 40,
+    "audio": 25,
+    "segment": 5,
+}
+LIMITS = {cls: int(float(os.getenv(f"UPLOAD_LIMIT_{cls.upper()}_MB", mb)) * MB)
+          for cls, mb in DEFAULT_LIMITS_MB.items()}
+MAX_UPLOAD_BYTES = int(float(os.getenv("MAX_UPLOAD_MB", max(DEFAULT_LIMITS_MB.values()))) * MB)
+SPOOL_MEMORY_BYTES = int(os.getenv("UPLOAD_SPOOL_MEMORY_BYTES", str(512 * 1024)))
+
+
+class HashingSpool(tempfile.SpooledTemporaryFile):
+    """SpooledTemporaryFile that hashes and counts what is written to it."""
+
+    def __init__(self, max_size: int = SPOOL_MEMORY_BYTES):
+        super().__init__(max_size=max_size)
+        self._sha = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._sha.update(data)
+        self.size += len(data)
+        return super().write(data)
+
+    @property
+    def sha256(self) -> str:
+        return self._sha.hexdigest()
+
+    @property
+    def on_disk(self) -> bool:
+        return self._rolled
+
+
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingSpool()
+
+
+def upload_limit(cls: str):
+    """Route decorator capping the request body at the limit for `cls`. The cap is set by
+    enforce_limit; the wrapper only checks that the hook ran, since a body parsed without it
+    was received uncapped."""
+    limit = LIMITS[cls]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.max_content_length != limit:
+                raise RuntimeError(f"upload_limit({cls!r}) requires uploads.enforce_limit as a before_request hook")
+            return view(*args, **kwargs)
+        wrapper.upload_limit = cls  # copied onto outer decorators by functools.wraps
+        return wrapper
+    return decorator
+
+
+def enforce_limit():
+    """before_request hook: apply the upload_limit of the matched route before the body is read."""
+    cls = getattr(current_app.view_functions.get(request.endpoint), "upload_limit", None)
+    if cls is None:
+        return None
+    limit = LIMITS[cls]
+    if request.content_length and request.content_length > limit:
+        return too_large(limit)
+    request.max_content_length = limit  # enforced while the body is parsed
+    return None
+
+
+def too_large(limit: int | None = None):
+    limit = limit or request.max_content_length
+    print(f"[UPLOAD] rejected {request.path}: {request.content_length or 'chunked'} bytes > {limit}")
+    return jsonify({"error": "upload too large", "limit_bytes": limit}), 413
+
+
+def digest(storage) -> str:
+    """sha256 of an uploaded file, computed while receiving when it was spooled here."""
+    stream = storage.stream
+    if isinstance(stream, HashingSpool):
+        return stream.sha256
+    sha = hashlib.sha256()
+    stream.seek(0)
+    for chunk in iter(lambda: stream.read(1024 * 1024), b""):
+        sha.update(chunk)
+    stream.seek(0)
+    return sha.hexdigest()
+
+
+def size(storage) -> int:
+    stream = storage.stream
+    if isinstance(stream, HashingSpool):
+        return stream.size
+    pos = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    end = stream.tell()
+    stream.seek(pos)
+    return end
+
+
+def persist(storage, store, ext: str) -> str:
+    """Store an upload in an artifacts.ArtifactStore by content hash; returns its path.
+    Identical uploads share one file."""
+    return store.path(store.put_stream(storage.stream, digest(storage), ext))
@@ -1,7 +1,11 @@
 // Minimal hook: start/stop and return Blob (WebM/Opus in most browsers)
 import { useRef, useState } from "react";
 
-export function useMediaRecorder(constraints: MediaStreamConstraints = { audio: true }) {
+export function useMediaRecorder(
+  constraints: MediaStreamConstraints = {
+    audio: { channelCount: 1, sampleRate: 16000, echoCancellation: true, noiseSuppression: true },
+  }
+) {
   const [isRecording, setIsRecording] = useState(false);
   const recRef = useRef<MediaRecorder | null>(null);
   const chunksRef = useRef<BlobPart[]>([]);
@@ -9,7 +13,7 @@ export function useMediaRecorder(constraints: MediaStreamConstraints = { audio:
 
   const start = async (mime = "audio/webm;codecs=opus") => {
     streamRef.current = await navigator.mediaDevices.getUserMedia(constraints);
-    recRef.current = new MediaRecorder(streamRef.current, { mimeType: mime });
+    recRef.current = new MediaRecorder(streamRef.current, { mimeType: mime, audioBitsPerSecond: 24000 });
     chunksRef.current = [];
     recRef.current.ondataavailable = e => e.data.size && chunksRef.current.push(e.data);
     recRef.current.start();
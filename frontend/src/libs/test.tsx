@@ -27,7 +27,7 @@ type TranscribeResponse = {
 };
 
 type GenerationJob = {
-  status: "pending" | "running" | "done" | "error";
+  status: "pending" | "running" | "done" | "error" | "cancelled";
   prompt?: string;
   userid?: string | null;
   modelid?: string | null;
@@ -199,7 +199,7 @@ export default function MicToFlask({
         const data = await fetchJob("/api/generation/job", jobId);
         if (cancelled) return;
         setJobStatus(data);
-        if (data.status === "done" || data.status === "error") {
+        if (data.status === "done" || data.status === "error" || data.status === "cancelled") {
           clearInterval(interval);
         }
       } catch (e) {
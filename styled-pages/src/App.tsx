@@ -16,7 +16,7 @@ import { ModelCarousel } from './components/editor/ModelCarousel';
 import { PhotoCapture } from './components/editor/PhotoCapture';
 import { WebXRScene } from './components/editor/WebXRScene';
 import { setupScene } from './three/sceneSetup';
-import { getUserModels } from './lib/quickStorage';
+import { getUserModelsPage } from './lib/quickStorage';
 import type { Model } from './lib/types';
 
 type AppScreen = 'landing' | 'photo-capture' | 'voice-interaction' | 'carousel' | 'editor' | 'ar';
@@ -30,6 +30,8 @@ type AppScreen = 'landing' | 'photo-capture' | 'voice-interaction' | 'carousel'
 function App() {
   const [screen, setScreen] = useState<AppScreen>('landing');
   const [models, setModels] = useState<Model[]>([]);
+  const [modelsCursor, setModelsCursor] = useState<string | null>(null);
+  const loadingMoreRef = useRef(false);
   const [mode, setMode] = useState('Edit');
   const [snapAngle] = useState(15);
   const [gridEnabled] = useState(true);
@@ -58,9 +60,10 @@ function App() {
       const userId = localStorage.getItem('3d_system_user_id');
       if (userId) {
         console.log('Loading models for user:', userId);
-        const userModels = await getUserModels(userId);
-        setModels(userModels);
-        console.log('Loaded', userModels.length, 'models');
+        const page = await getUserModelsPage(userId);
+        setModels(page.models);
+        setModelsCursor(page.nextCursor);
+        console.log('Loaded', page.models.length, 'models');
       } else {
         console.log('No user ID found');
       }
@@ -216,6 +219,20 @@ function App() {
     }
   };
 
+  // Fetch the next page when the carousel approaches the end of what is loaded
+  const loadMoreModels = async () => {
+    const userId = localStorage.getItem('3d_system_user_id');
+    if (!userId || !modelsCursor || loadingMoreRef.current) return;
+    loadingMoreRef.current = true;
+    try {
+      const page = await getUserModelsPage(userId, modelsCursor);
+      setModels((prev) => [...prev, ...page.models]);
+      setModelsCursor(page.nextCursor);
+    } finally {
+      loadingMoreRef.current = false;
+    }
+  };
+
   const handleModelSelect = (model: Model) => {
     console.log('Loading model:', model);
     // Set the GLB URL globally so the editor can load it
@@ -311,7 +328,7 @@ function App() {
             opacity: screen === 'carousel' ? 1 : 0,
           }}
         >
-          <ModelCarousel models={models} onSelectModel={handleModelSelect} />
+          <ModelCarousel models={models} onSelectModel={handleModelSelect} onReachEnd={loadMoreModels} />
         </div>
       )}
 
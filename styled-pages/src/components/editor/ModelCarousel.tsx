@@ -412,11 +412,19 @@ function Model3DPreview({ modelUrl, isActive }: { modelUrl: string; isActive: bo
 interface ModelCarouselProps {
   models: Model[];
   onSelectModel: (model: Model) => void;
+  onReachEnd?: () => void;
 }
 
-export function ModelCarousel({ models, onSelectModel }: ModelCarouselProps) {
+export function ModelCarousel({ models, onSelectModel, onReachEnd }: ModelCarouselProps) {
   const [currentIndex, setCurrentIndex] = useState(0);
 
+  // Ask for the next page a few slides before the loaded models run out
+  useEffect(() => {
+    if (onReachEnd && models.length > 0 && currentIndex >= models.length - 3) {
+      onReachEnd();
+    }
+  }, [currentIndex, models.length, onReachEnd]);
+
   const nextSlide = () => {
     setCurrentIndex((prev) => (prev + 1) % models.length);
   };
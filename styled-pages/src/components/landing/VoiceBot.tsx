@@ -9,6 +9,7 @@ type TranscribeEnvelope = {
   error?: string;
   scad_code?: string;
   model_id?: string;
+  stl_file_url?: string; // rendered by the generation job (absent if it could not render)
 };
 
 type VoiceBotProps = {
@@ -37,14 +38,18 @@ export function VoiceBot({
   const chunksRef = useRef<BlobPart[]>([]);
   const playingRef = useRef<HTMLAudioElement | null>(null);
   const pollRef = useRef<number | null>(null);
+  const pollJobRef = useRef<string | null>(null);
 
   // Start mic capture
   const startRecording = async () => {
     if (isRecording || sending) return;
     try {
       const mime = 'audio/webm;codecs=opus';
-      streamRef.current = await navigator.mediaDevices.getUserMedia({ audio: true });
-      const mr = new MediaRecorder(streamRef.current, { mimeType: mime });
+      // Voice commands only need one speech-quality channel; smaller uploads reach STT sooner
+      streamRef.current = await navigator.mediaDevices.getUserMedia({
+        audio: { channelCount: 1, sampleRate: 16000, echoCancellation: true, noiseSuppression: true },
+      });
+      const mr = new MediaRecorder(streamRef.current, { mimeType: mime, audioBitsPerSecond: 24000 });
       chunksRef.current = [];
       mr.ondataavailable = (e) => { if (e.data.size) chunksRef.current.push(e.data); };
       mr.start();
@@ -55,27 +60,66 @@ export function VoiceBot({
     }
   };
 
-  // Convert SCAD to STL via Node server and notify editor
-  const handleScad = async (scad: string, mid?: string) => {
+  // Swap in the full-quality render once the converter has finished it
+  const awaitFullRender = async (statusUrl: string, previewUrl: string) => {
+    const deadline = Date.now() + 5 * 60 * 1000;
+    while (Date.now() < deadline) {
+      await new Promise((r) => setTimeout(r, 1500));
+      try {
+        const resp = await fetch(statusUrl);
+        if (!resp.ok) return;
+        const status: { status?: string; url?: string } = await resp.json();
+        if (status.status === 'error') return;
+        if (status.status === 'done' && status.url) {
+          // the user may have moved on to another model meanwhile
+          const w = window as unknown as { VIBECAD_LAST_GLB_URL?: string };
+          if (w.VIBECAD_LAST_GLB_URL !== previewUrl) return;
+          w.VIBECAD_LAST_GLB_URL = status.url;
+          try {
+            localStorage.setItem('last_glb_url', status.url);
+          } catch (storageErr) {
+            console.warn('[VoiceBot] localStorage set failed:', storageErr);
+          }
+          window.dispatchEvent(new CustomEvent('vibecad:load-glb', { detail: { url: status.url } }));
+          console.log('[VoiceBot] Full-quality model ready at', status.url);
+          return;
+        }
+      } catch (e) {
+        console.warn('[VoiceBot] full render status failed:', e);
+        return;
+      }
+    }
+  };
+
+  // Convert SCAD to STL via Node server (unless the generation job already rendered it,
+  // in which case stlUrl is its full-quality STL) and notify editor
+  const handleScad = async (scad: string, mid?: string, stlUrl?: string) => {
     try {
-      console.log('[VoiceBot] Converting SCAD to STL via', convertEndpoint);
-      const resp = await fetch(convertEndpoint, {
+      let modelUrl: string | null = stlUrl || null;
+      let fullStatusUrl: string | null = null;
+      const resp = modelUrl ? null : await fetch(convertEndpoint, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ scad, model_id: mid, userid }),
+        body: JSON.stringify({ scad, model_id: mid, userid, quality: 'progressive' }),
       });
 
-      if (!resp.ok) {
+      if (resp && !resp.ok) {
         console.warn('[VoiceBot] convert-scad failed:', resp.status);
         return;
       }
 
-      const ct = resp.headers.get('content-type') || '';
-      let modelUrl: string | null = null;
+      const ct = resp?.headers.get('content-type') || '';
 
-      if (ct.includes('application/json')) {
-        const json: { url?: string } | null = await resp.json().catch(() => null);
+      if (!resp) {
+        console.log('[VoiceBot] Using STL rendered by the generation job');
+      } else if (ct.includes('application/json')) {
+        const json: { url?: string; full?: { status?: string; status_url?: string } | null } | null =
+          await resp.json().catch(() => null);
         modelUrl = json?.url || null;
+        // a preview was returned; the full-quality render is still running
+        if (json?.full?.status_url && json.full.status !== 'error') {
+          fullStatusUrl = json.full.status_url;
+        }
       } else if (ct.includes('application/sla') || ct.includes('model/') || ct.includes('application/octet-stream')) {
         // Raw STL stream - create blob URL
         const blob = await resp.blob();
@@ -105,7 +149,11 @@ export function VoiceBot({
         }
         
         // Generate and play summary after model is loaded
-        generateAndPlaySummary(scad);
+        generateAndPlaySummary(scad, modelUrl);
+
+        if (fullStatusUrl) {
+          awaitFullRender(fullStatusUrl, modelUrl);
+        }
       }
     } catch (e) {
       console.warn('[VoiceBot] SCAD conversion exception:', e);
@@ -113,13 +161,14 @@ export function VoiceBot({
   };
 
   // Generate model summary and play audio
-  const generateAndPlaySummary = async (scadCode: string) => {
+  const generateAndPlaySummary = async (scadCode: string, stlUrl?: string) => {
     try {
       console.log('[VoiceBot] Generating model summary...');
       const resp = await fetch('/api/generate-model-summary', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ scad_code: scadCode }),
+        // the STL lets the backend quote real dimensions; summaries are cached per model
+        body: JSON.stringify({ scad_code: scadCode, stl_url: stlUrl }),
       });
 
       if (!resp.ok) {
@@ -165,9 +214,19 @@ export function VoiceBot({
     }
   };
 
+  // Cancel a generation the user no longer waits for, freeing its server worker
+  const cancelGenerationJob = (jobId: string | null) => {
+    if (!jobId) return;
+    fetch(`/api/generation/job/${jobId}`, { method: 'DELETE', keepalive: true })
+      .catch((e) => console.warn('[VoiceBot] Job cancel failed:', e));
+  };
+
   // Poll backend job endpoint until SCAD is ready
   const pollGenerationJob = (jobId: string) => {
     if (pollRef.current) window.clearInterval(pollRef.current);
+    // a newer request supersedes the one still generating
+    if (pollJobRef.current && pollJobRef.current !== jobId) cancelGenerationJob(pollJobRef.current);
+    pollJobRef.current = jobId;
     console.log('[VoiceBot] Polling job:', jobId);
     
     pollRef.current = window.setInterval(async () => {
@@ -181,11 +240,13 @@ export function VoiceBot({
         if (j?.status === 'done' && j?.scad_code) {
           window.clearInterval(pollRef.current!);
           pollRef.current = null;
-          await handleScad(j.scad_code, j.model_id || modelid);
-        } else if (j?.status === 'error') {
+          pollJobRef.current = null;
+          await handleScad(j.scad_code, j.model_id || modelid, j.stl_file_url);
+        } else if (j?.status === 'error' || j?.status === 'cancelled') {
           window.clearInterval(pollRef.current!);
           pollRef.current = null;
-          console.warn('[VoiceBot] Generation error:', j?.error);
+          pollJobRef.current = null;
+          console.warn(`[VoiceBot] Generation ${j.status}:`, j?.error);
         }
       } catch (pollErr) {
         console.warn('[VoiceBot] Poll error (transient):', pollErr);
@@ -281,7 +342,7 @@ export function VoiceBot({
 
       // If SCAD arrived synchronously, convert right away; else poll for job
       if (data?.scad_code) {
-        await handleScad(data.scad_code, data.model_id || modelid);
+        await handleScad(data.scad_code, data.model_id || modelid, data.stl_file_url);
       } else if (data?.job_id) {
         pollGenerationJob(data.job_id);
       }
@@ -317,9 +378,10 @@ export function VoiceBot({
   }, []);
 
   useEffect(() => {
-    // Cleanup polling interval on unmount
+    // Cleanup polling interval on unmount; nobody is left to show the result
     return () => {
       if (pollRef.current) window.clearInterval(pollRef.current);
+      cancelGenerationJob(pollJobRef.current);
     };
   }, []);
 
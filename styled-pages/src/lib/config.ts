@@ -15,5 +15,6 @@ export const API_ENDPOINTS = {
   TRANSCRIBE: `${BACKEND_URL}/api/transcribe`,
   GET_RESPONSE: `${BACKEND_URL}/api/getresponse`,
   HEALTH: `${BACKEND_URL}/api/health`,
+  MODELS: `${BACKEND_URL}/api/models`,
 } as const;
 
@@ -1,5 +1,6 @@
 import { supabase } from './supabase';
 import type { Model } from './types';
+import { API_ENDPOINTS } from './config';
 
 /**
  * Quick save - just stores the Hunyuan GLB URL directly
@@ -38,29 +39,46 @@ export async function quickSaveModel(
   }
 }
 
+export interface ModelPage {
+  models: Model[];
+  nextCursor: string | null;
+}
+
 /**
- * Get all models for a user
+ * Get one page of a user's models (metadata only, newest first).
+ * Pass the previous page's nextCursor to continue.
  */
-export async function getUserModels(userId: string): Promise<Model[]> {
+export async function getUserModelsPage(
+  userId: string,
+  cursor: string | null = null,
+  limit = 24
+): Promise<ModelPage> {
   try {
-    const { data, error } = await supabase
-      .from('models')
-      .select('*')
-      .eq('user_id', userId)
-      .order('created_at', { ascending: false });
+    const params = new URLSearchParams({ userid: userId, limit: String(limit) });
+    if (cursor) params.set('cursor', cursor);
 
-    if (error) {
-      console.error('Error fetching models:', error);
-      return [];
+    const response = await fetch(`${API_ENDPOINTS.MODELS}?${params}`);
+    if (!response.ok) {
+      console.error('Error fetching models:', response.status, await response.text());
+      return { models: [], nextCursor: null };
     }
 
-    return (data as Model[]) || [];
+    const data = await response.json();
+    return { models: (data.models as Model[]) || [], nextCursor: data.next_cursor ?? null };
   } catch (error) {
-    console.error('Error in getUserModels:', error);
-    return [];
+    console.error('Error in getUserModelsPage:', error);
+    return { models: [], nextCursor: null };
   }
 }
 
+/**
+ * Get the first page of a user's models
+ */
+export async function getUserModels(userId: string): Promise<Model[]> {
+  const { models } = await getUserModelsPage(userId);
+  return models;
+}
+
 /**
  * Delete a model
  */
@@ -0,0 +1,20 @@
+/*
+  # Index models for keyset pagination
+
+  The backend's GET /api/models pages through a user's models newest first with
+  a (created_at, id) keyset cursor:
+
+    WHERE user_id = $1
+      AND (created_at < $2 OR (created_at = $2 AND id < $3))
+    ORDER BY created_at DESC, id DESC
+    LIMIT $4
+
+  This composite index serves that query as a single index range scan, so the
+  cost of every page stays flat no matter how many models a user has.
+  It supersedes idx_models_user_id for lookups by user.
+*/
+
+CREATE INDEX IF NOT EXISTS idx_models_user_created_at
+  ON models(user_id, created_at DESC, id DESC);
+
+DROP INDEX IF EXISTS idx_models_user_id;